@@ -1,26 +1,43 @@
 import numpy as np
+from GJMorph.swcFuncs import SWCMorphology, asSWCMorphology
+from GJMorph.voxelFuncs import getVoxelIndices
 
 
 # **********************************************************************************************************************
-def resampleSWC(swcFile, resampleLength, mask=None, swcData=None, calculateBranchLens=False):
+def resampleSWC(swcFile, resampleLength, mask=None, swcData=None, calculateBranchLens=False, vectorized=True):
     '''
     Resample the SWC points to place points at every resamplelength along the central line of every segment. Radii are interpolated.
-    :param swcData: nx4 swc point data
+    :param swcData: nx7 swc point data or GJMorph.swcFuncs.SWCMorphology. If None, swcFile is read.
     :param resampleLength: length at with resampling is done.
+    :param vectorized: bool, if True, all segments are resampled at once using numpy array operations, otherwise
+    segments are resampled one at a time. Both produce the same output.
     :return:    branchCenters, branchLens,
                 ndarray of shape (#pts, 7) with each row containing (node ID, node type, x, y, z, r, parent ID)
     '''
 
-    if swcData is None:
-        swcData = np.loadtxt(swcFile)
-    inds = swcData[:, 0].tolist()
+    swcMorph = asSWCMorphology(swcData, swcFile)
+
+    if mask is not None:
+        assert len(mask) == len(swcMorph), 'Supplied mask is invalid for ' + str(swcFile)
+
+    if vectorized:
+        return _resampleSWCVectorized(swcMorph, resampleLength, mask, calculateBranchLens)
+    else:
+        return _resampleSWCLoop(swcMorph, resampleLength, mask, calculateBranchLens)
+
+#***********************************************************************************************************************
+
+def _resampleSWCLoop(swcMorph, resampleLength, mask, calculateBranchLens):
+    '''
+    Implementation of resampleSWC resampling one segment at a time. See resampleSWC.
+    '''
+
+    swcData = swcMorph.asArray()
     oldNewDict = {}
 
     currentMax = 1
     if mask is None:
         mask = [True] * swcData.shape[0]
-    else:
-        assert len(mask) == swcData.shape[0], 'Supplied mask is invalid for ' + swcFile
     resampledSWCData = []
 
     getSegLen = lambda a, b: np.linalg.norm(a - b)
@@ -29,18 +46,18 @@ def resampleSWC(swcFile, resampleLength, mask=None, swcData=None, calculateBranc
         branchCenters = []
         branchLens = []
     totalLen = 0
-    for pt in swcData:
+    for ptInd, pt in enumerate(swcData):
 
         if pt[6] < 0:
-            if mask[inds.index(int(pt[0]))]:
+            if mask[ptInd]:
                 resampledSWCData.append([currentMax] + pt[1:].tolist())
                 oldNewDict[pt[0]] = currentMax
                 currentMax += 1
 
-        if (pt[6] > 0) and (int(pt[6]) in inds):
-            if mask[inds.index(int(pt[0]))]:
+        if (pt[6] > 0) and (swcMorph.parentRows[ptInd] >= 0):
+            if mask[ptInd]:
 
-                parentPt = swcData[inds.index(pt[6]), :]
+                parentPt = swcData[swcMorph.parentRows[ptInd], :]
                 segLen = getSegLen(pt[2:5], parentPt[2:5])
                 totalLen += segLen
                 currentParent = oldNewDict[pt[6]]
@@ -90,6 +107,118 @@ def resampleSWC(swcFile, resampleLength, mask=None, swcData=None, calculateBranc
 
 #***********************************************************************************************************************
 
+def _resampleSWCVectorized(swcMorph, resampleLength, mask, calculateBranchLens):
+    '''
+    Implementation of resampleSWC resampling all segments at once. See resampleSWC.
+
+    Every masked node with a negative parent ID produces one output row. Every other masked node whose parent is present
+    produces nNew + 1 output rows, where nNew = floor(segLen / resampleLength) if segLen > resampleLength and 0
+    otherwise: nNew interpolated points followed by the node itself. Output rows are ordered like the input rows, so new
+    node IDs follow from a cumulative sum of these row counts.
+    '''
+
+    nRows = len(swcMorph)
+    if mask is None:
+        mask = np.ones(nRows, dtype=bool)
+    else:
+        mask = np.asarray(mask, dtype=bool)
+
+    isRoot = mask & (swcMorph.parentIDs < 0)
+    isChild = mask & (swcMorph.parentIDs > 0) & (swcMorph.parentRows >= 0)
+    childRows = np.flatnonzero(isChild)
+    parentRows = swcMorph.parentRows[childRows]
+    if not (isRoot | isChild)[parentRows].all():
+        raise ValueError('The parents of some of the nodes to be resampled are masked out or have no parent '
+                         'themselves')
+
+    segVecs = swcMorph.xyz[childRows] - swcMorph.xyz[parentRows]
+    segLens = _rowNorms(segVecs)
+    # cumsum accumulates sequentially, like the loop implementation does
+    totalLen = np.cumsum(segLens)[-1] if segLens.shape[0] else 0
+
+    nNew = np.zeros(childRows.shape[0], dtype=np.int64)
+    isLong = segLens > resampleLength
+    nNew[isLong] = np.floor(segLens[isLong] / resampleLength).astype(np.int64)
+
+    rowCounts = np.zeros(nRows, dtype=np.int64)
+    rowCounts[isRoot] = 1
+    rowCounts[childRows] = nNew + 1
+    newIDs = np.cumsum(rowCounts)
+    nOut = int(newIDs[-1]) if nRows else 0
+
+    if nOut == 0:
+        if calculateBranchLens:
+            return np.array([]), np.array([]), np.array([])
+        else:
+            return totalLen, np.array([])
+
+    resampledSWCData = np.empty((nOut, 7), dtype=np.float64)
+    swcData = swcMorph.asArray()
+
+    rootRows = np.flatnonzero(isRoot)
+    resampledSWCData[newIDs[rootRows] - 1, 0] = newIDs[rootRows]
+    resampledSWCData[newIDs[rootRows] - 1, 1:] = swcData[rootRows, 1:]
+
+    # rows of the nodes themselves
+    childOutInds = newIDs[childRows] - 1
+    resampledSWCData[childOutInds, 0] = newIDs[childRows]
+    resampledSWCData[childOutInds, 1:6] = swcData[childRows, 1:6]
+    resampledSWCData[childOutInds, 6] = np.where(nNew > 0, newIDs[childRows] - 1, newIDs[parentRows])
+
+    # interpolated points, segment by segment, j = 1, ..., nNew along each segment
+    segInds = np.repeat(np.arange(childRows.shape[0]), nNew)
+    segStarts = np.cumsum(nNew) - nNew
+    newPtsInds = np.arange(segInds.shape[0]) - segStarts[segInds] + 1
+    newOutInds = childOutInds[segInds] - nNew[segInds] + newPtsInds - 1
+
+    unitDirections = segVecs[isLong] / segLens[isLong][:, None]
+    radGrads = (swcMorph.radius[childRows] - swcMorph.radius[parentRows])[isLong] / segLens[isLong]
+    longInds = np.cumsum(isLong) - 1
+    segUnitDirections = unitDirections[longInds[segInds]]
+    segParentXYZ = swcMorph.xyz[parentRows][segInds]
+
+    newXYZ = segParentXYZ + (newPtsInds * resampleLength)[:, None] * segUnitDirections
+    resampledSWCData[newOutInds, 0] = newOutInds + 1
+    resampledSWCData[newOutInds, 1] = swcMorph.types[childRows][segInds]
+    resampledSWCData[newOutInds, 2:5] = newXYZ
+    resampledSWCData[newOutInds, 5] = swcMorph.radius[parentRows][segInds] + \
+                                      newPtsInds * radGrads[longInds[segInds]] * resampleLength
+    resampledSWCData[newOutInds, 6] = np.where(newPtsInds == 1, newIDs[parentRows][segInds], newOutInds)
+
+    if not calculateBranchLens:
+        return totalLen, resampledSWCData
+
+    # one branch per output row of a non root node, in the same order
+    branchOutInds = np.sort(np.concatenate((childOutInds, newOutInds)))
+    branchCenters = np.empty((branchOutInds.shape[0], 3), dtype=np.float64)
+    branchLens = np.empty(branchOutInds.shape[0], dtype=np.float64)
+
+    newBranchInds = np.searchsorted(branchOutInds, newOutInds)
+    branchCenters[newBranchInds] = segParentXYZ + ((newPtsInds - 0.5) * resampleLength)[:, None] * segUnitDirections
+    branchLens[newBranchInds] = resampleLength
+
+    childBranchInds = np.searchsorted(branchOutInds, childOutInds)
+    previousXYZ = swcMorph.xyz[parentRows].copy()
+    previousXYZ[isLong] = resampledSWCData[childOutInds[isLong] - 1, 2:5]
+    childXYZ = swcMorph.xyz[childRows]
+    branchCenters[childBranchInds] = 0.5 * (childXYZ + previousXYZ)
+    lastSegLens = _rowNorms(childXYZ - previousXYZ)
+    branchLens[childBranchInds] = np.where(isLong, lastSegLens, segLens)
+
+    return branchCenters, branchLens, resampledSWCData
+
+def _rowNorms(vecs):
+    '''
+    Euclidean norms of the rows of <vecs>. Stacked matrix products are used so that the results are identical to those
+    of np.linalg.norm applied to each row separately.
+    :param vecs: np.ndarray of shape (nRows, nCols)
+    :return: np.ndarray of shape (nRows,)
+    '''
+
+    return np.sqrt(np.matmul(vecs[:, None, :], vecs[:, :, None])[:, 0, 0])
+
+#***********************************************************************************************************************
+
 def windowSWCPts(branchMeans, gridSize, translationIndicator=(0, 0, 0)):
     """
     Custom internal function, use at your own risk!
@@ -98,15 +227,19 @@ def windowSWCPts(branchMeans, gridSize, translationIndicator=(0, 0, 0)):
     <gridSize> and are constructed so that there is a voxel with center at the origin. If translationIndicator is
     specified, then the voxels are constructed in a way such that a voxel has a center at
     - <translationIndicator> * <gridSize> * 0.5.
-    :param branchMeans: np.array of shape (nRows, 3)
+    :param branchMeans: np.array of shape (nRows, 3) or GJMorph.swcFuncs.SWCMorphology, whose node coordinates are used
     :param gridSize: float
     :param translationIndicator: three member iterable of floats
     :return: voxelCenters, np.array of shape (nRows, 3), rounded to 6 digits
+
+    See GJMorph.voxelFuncs.getVoxelKeys for an integer representation of the voxels.
     """
 
+    if isinstance(branchMeans, SWCMorphology):
+        branchMeans = branchMeans.xyz
+
     offset = np.array(translationIndicator) * gridSize * 0.5
-    temp = branchMeans + offset
-    voxelCenters = np.array(np.round(temp / gridSize), dtype=np.int32) * gridSize - offset
+    voxelCenters = getVoxelIndices(branchMeans, gridSize, translationIndicator) * gridSize - offset
     return np.round(voxelCenters, 6)
 
 #***********************************************************************************************************************
\ No newline at end of file
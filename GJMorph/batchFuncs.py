@@ -0,0 +1,93 @@
+'''
+This file contains functions for applying a function to a batch of inputs, e.g., one SWC file at a time, using a pool of
+processes.
+'''
+
+import multiprocessing
+import traceback
+import logging
+
+
+class _SafeCall(object):
+    '''
+    Picklable wrapper around func, which catches exceptions raised by it and returns them as formatted tracebacks.
+    '''
+
+    def __init__(self, func):
+
+        self.func = func
+
+    def __call__(self, args):
+
+        try:
+            return True, self.func(*args)
+        except Exception:
+            return False, traceback.format_exc()
+
+
+def iterBatch(func, argsList, labels=None, nCPU=1, chunkSize=None):
+    '''
+    Applies func(*args) for each args in argsList, using a pool of <nCPU> processes if nCPU > 1, and yields results as
+    they become available, but in the order of argsList. An exception raised for one member of argsList does not
+    stop the processing of the others, it is logged with the corresponding label and yielded as a formatted traceback.
+    :param func: picklable function, i.e., defined at the top level of a module
+    :param argsList: list of tuples, arguments of func
+    :param labels: list of strings, names used for reporting failures, e.g. SWC file names. Defaults to the indices
+    of argsList.
+    :param nCPU: int, number of processes to use
+    :param chunkSize: int, number of members of argsList sent to a process at once. Defaults to a value which gives
+    roughly four chunks per process.
+    :return: generator of tuples (label, success, result), where result is the return value of func if success is
+    True and the formatted traceback otherwise.
+    '''
+
+    argsList = [tuple(args) for args in argsList]
+    if labels is None:
+        labels = [str(x) for x in range(len(argsList))]
+    assert len(labels) == len(argsList), "labels and argsList must have the same length"
+
+    safeFunc = _SafeCall(func)
+
+    if nCPU > 1 and len(argsList) > 1:
+        if chunkSize is None:
+            chunkSize = max(1, len(argsList) // (4 * nCPU))
+        pool = multiprocessing.Pool(processes=nCPU)
+        try:
+            for label, (success, result) in zip(labels, pool.imap(safeFunc, argsList, chunksize=chunkSize)):
+                if not success:
+                    logging.error("Failed processing {}:\n{}".format(label, result))
+                yield label, success, result
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for label, args in zip(labels, argsList):
+            success, result = safeFunc(args)
+            if not success:
+                logging.error("Failed processing {}:\n{}".format(label, result))
+            yield label, success, result
+
+
+def runBatch(func, argsList, labels=None, nCPU=1, chunkSize=None):
+    '''
+    Like iterBatch, but collects all results.
+    :return: results, failures
+    results: list of the return values of func for argsList, None for the members of argsList for which func
+    raised an exception
+    failures: list of tuples (label, formatted traceback) for the members of argsList for which func raised an exception
+    '''
+
+    results = []
+    failures = []
+    for label, success, result in iterBatch(func, argsList, labels, nCPU, chunkSize):
+        if success:
+            results.append(result)
+        else:
+            results.append(None)
+            failures.append((label, result))
+
+    if failures:
+        logging.error("Processing failed for {} of {} inputs: {}".format(len(failures), len(argsList),
+                                                                          ", ".join(x[0] for x in failures)))
+
+    return results, failures
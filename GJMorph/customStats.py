@@ -1,10 +1,134 @@
+import multiprocessing
+import logging
 import numpy as np
 import pandas as pd
-from rpy2 import robjects
-from rpy2.robjects import pandas2ri
-from rpy2.robjects import packages as rpackages
-from rpy2.rinterface import RRuntimeError
-pandas2ri.activate()
+from scipy import stats
+
+
+class RSession(object):
+    """
+    Lazily started embedded R, shared by the R-backed functions of this module. rpy2 is imported, R is started and
+    pandas2ri is activated only on the first use of an R-backed function, so that importing this module neither requires
+    R nor spends time starting it. The selection of a CRAN mirror, R packages and R functions compiled from source are
+    cached. When rpy2 or R are not available, R-backed functions use their numpy based counterparts instead, if
+    <useFallbacks> is True.
+    """
+
+    def __init__(self, useFallbacks=True):
+        """
+        :param useFallbacks: bool, if False, R-backed functions raise an ImportError when R is not available
+        """
+
+        self.useFallbacks = useFallbacks
+        self.robjects = None
+        self.rpackages = None
+        self.RRuntimeError = None
+        self._startError = None
+        self._mirrorChosen = False
+        self._packages = {}
+        self._functions = {}
+
+    def start(self):
+        """
+        Imports rpy2, which starts the embedded R, and activates pandas2ri. Does nothing if R has already been started.
+        :return: bool, whether R is available
+        """
+
+        if self.robjects is not None:
+            return True
+        if self._startError is not None:
+            return False
+
+        try:
+            from rpy2 import robjects
+            from rpy2.robjects import pandas2ri
+            from rpy2.robjects import packages as rpackages
+            from rpy2.rinterface import RRuntimeError
+            pandas2ri.activate()
+        except Exception as e:
+            # rpy2 raises various exceptions when R cannot be found or started
+            self._startError = e
+            logging.warning("Could not start R using rpy2 ({})".format(e))
+            return False
+
+        self.robjects = robjects
+        self.rpackages = rpackages
+        self.RRuntimeError = RRuntimeError
+        return True
+
+    def isAvailable(self):
+        """
+        Starts R if required and returns whether it is available.
+        :return: bool
+        """
+
+        return self.start()
+
+    def useFallback(self, funcName):
+        """
+        Returns whether the R-backed function <funcName> has to use its numpy based fallback because R is not
+        available. Raises ImportError if R is not available and fallbacks are disabled.
+        :param funcName: string, used for reporting
+        :return: bool
+        """
+
+        if self.start():
+            return False
+        elif self.useFallbacks:
+            return True
+        else:
+            raise ImportError("{} requires rpy2 and R, which could not be started ({})".format(funcName,
+                                                                                              self._startError))
+
+    def importPackage(self, packageName, install=False):
+        """
+        Imports the R package <packageName>, installing it from the first CRAN mirror if <install> is True and it is not
+        installed. Imported packages are cached.
+        :param packageName: string
+        :param install: bool
+        :return: rpy2 package object
+        """
+
+        if packageName in self._packages:
+            return self._packages[packageName]
+
+        if not self.start():
+            raise ImportError("R could not be started ({})".format(self._startError))
+
+        rUtils = self.rpackages.importr("utils")
+        if not self._mirrorChosen:
+            rUtils.chooseCRANmirror(ind=1)
+            self._mirrorChosen = True
+
+        try:
+            package = self.rpackages.importr(packageName)
+        except self.RRuntimeError as re:
+            if install and str(re).find("Error in loadNamespace") >= 0:
+                print("Insatalling package \"{}\" in the embedded R. This might take a while".format(packageName))
+                rUtils.install_packages(self.robjects.StrVector([packageName]))
+                package = self.rpackages.importr(packageName)
+            else:
+                raise re
+
+        self._packages[packageName] = package
+        return package
+
+    def getFunction(self, source):
+        """
+        Returns the R function defined by the R code <source>, compiling it only on the first call for <source>.
+        :param source: string, R code evaluating to a function
+        :return: rpy2 function object
+        """
+
+        if source not in self._functions:
+            if not self.start():
+                raise ImportError("R could not be started ({})".format(self._startError))
+            self._functions[source] = self.robjects.r(source)
+        return self._functions[source]
+
+
+rSession = RSession()
+
 
 def getWelchDF(var1, var2, N1, N2, df1, df2):
     """
@@ -31,6 +155,12 @@ def getWelchDF(var1, var2, N1, N2, df1, df2):
 
 # shamelessly stolen from https://github.com/scipy/scipy/pull/4933#issuecomment-292314817
 def r_mannwhitneyu(sample1, sample2, exact=True, alternative="two.sided"):
+    if rSession.useFallback("r_mannwhitneyu"):
+        # R's default for exact=FALSE is an exact test for small samples without ties
+        uval, pval = mannwhitneyu_np(np.asarray(sample1, dtype=np.float64), np.asarray(sample2, dtype=np.float64),
+                                     exact=True if exact else None, alternative=alternative)
+        return float(uval), float(pval)
+    robjects = rSession.robjects
     sample1 = "c({})".format(str(list(sample1))[1:-1])
     sample2 = "c({})".format(str(list(sample2))[1:-1])
     robjects.R()("""wres <- wilcox.test({}, {}, alternative="{}"{});
@@ -42,11 +172,223 @@ def r_mannwhitneyu(sample1, sample2, exact=True, alternative="two.sided"):
     pval = wres[2][0]
     return uval, pval
 
-def bootstrapWelsch_ttest(vals1, vals2, nBootstrap=1000):
+
+_mannwhitneyuExactCache = {}
+
+
+def _getMannwhitneyuExactDist(n1, n2):
+    """
+    Returns the null distribution of the Mann-Whitney U statistic (number of pairs with the member of sample 1 larger
+    than the member of sample 2) for samples of sizes <n1> and <n2> without ties, as cumulative probabilities
+    P(U <= u) and survival probabilities P(U >= u) for u = 0, ..., n1 * n2. Uses the recursion
+    P_{i,j}(u) = i / (i + j) * P_{i-1,j}(u - j) + j / (i + j) * P_{i,j-1}(u), conditioning on whether the largest
+    observation belongs to sample 1. Results are cached across calls.
+    :param n1: int
+    :param n2: int
+    :return: cdf, sf; np.ndarrays of shape (n1 * n2 + 1,)
+    """
+
+    if (n1, n2) in _mannwhitneyuExactCache:
+        return _mannwhitneyuExactCache[(n1, n2)]
+
+    # pmfs of U for sample sizes (i - 1, j), j = 0, ..., n2
+    previousPMFs = [np.ones(1)] * (n2 + 1)
+    for i in range(1, n1 + 1):
+        currentPMFs = [np.ones(1)]
+        for j in range(1, n2 + 1):
+            pmf = np.zeros(i * j + 1)
+            pmf[j:] += (i / float(i + j)) * previousPMFs[j]
+            pmf[:i * (j - 1) + 1] += (j / float(i + j)) * currentPMFs[j - 1]
+            currentPMFs.append(pmf)
+        previousPMFs = currentPMFs
+    pmf = previousPMFs[n2]
+
+    cdf = np.minimum(np.cumsum(pmf), 1)
+    sf = np.minimum(np.cumsum(pmf[::-1])[::-1], 1)
+    _mannwhitneyuExactCache[(n1, n2)] = cdf, sf
+
+    return cdf, sf
+
+
+def mannwhitneyu_np(samples1, samples2, exact=True, alternative="two.sided"):
+    """
+    Mann-Whitney U test (Wilcoxon rank sum test) implemented with numpy, giving the same results as R's wilcox.test,
+    i.e., as r_mannwhitneyu. Can test many pairs of samples of the same sizes at once, e.g., many measures of the
+    same two groups of neurons.
+    Exact p-values are calculated from the null distribution of U, which is cached for every combination of sample
+    sizes. Otherwise, the normal approximation with tie and continuity correction is used.
+    :param samples1: iterable of floats of size n1 or np.ndarray of shape (nTests, n1)
+    :param samples2: iterable of floats of size n2 or np.ndarray of shape (nTests, n2)
+    :param exact: True, None or False. If True, exact p-values are calculated for tests without ties in the samples.
+    If None, only if additionally both samples have less than 50 members (default of wilcox.test). If False, the normal
+    approximation is used for all tests.
+    :param alternative: one of "two.sided", "less" and "greater"
+    :return: uval, pval: floats, or np.ndarrays of shape (nTests,) for two dimensional samples. uval is the statistic W
+    of wilcox.test, the number of pairs with the member of sample 1 larger than the member of sample 2, counting ties
+    as one half.
+    """
+
+    assert alternative in ["two.sided", "less", "greater"], "Unknown alternative {}".format(alternative)
+
+    samples1 = np.asarray(samples1, dtype=np.float64)
+    samples2 = np.asarray(samples2, dtype=np.float64)
+    isSingleTest = samples1.ndim == 1
+    samples1 = np.atleast_2d(samples1)
+    samples2 = np.atleast_2d(samples2)
+    assert samples1.shape[0] == samples2.shape[0], "samples1 and samples2 must contain the same number of tests"
+    n1 = samples1.shape[1]
+    n2 = samples2.shape[1]
+    nTotal = n1 + n2
+
+    pooled = np.hstack((samples1, samples2))
+    ranks = _rankRows(pooled)
+    uvals = ranks[:, :n1].sum(axis=1) - n1 * (n1 + 1) / 2.0
+
+    # tie correction term sum(t ** 3 - t) over groups of ties
+    sortedPooled = np.sort(pooled, axis=1)
+    isRunStart = np.ones(pooled.shape, dtype=bool)
+    isRunStart[:, 1:] = sortedPooled[:, 1:] != sortedPooled[:, :-1]
+    runLengths = np.bincount(np.cumsum(isRunStart.reshape((-1,))) - 1).astype(np.float64)
+    runRows = np.repeat(np.arange(pooled.shape[0]), isRunStart.sum(axis=1))
+    tieSums = np.bincount(runRows, weights=runLengths ** 3 - runLengths, minlength=pooled.shape[0])
+    hasTies = tieSums > 0
+
+    if exact is None:
+        useExact = ~hasTies & (n1 < 50) & (n2 < 50)
+    elif exact:
+        useExact = ~hasTies
+    else:
+        useExact = np.zeros(pooled.shape[0], dtype=bool)
+
+    pvals = np.empty(pooled.shape[0])
+
+    if useExact.any():
+        cdf, sf = _getMannwhitneyuExactDist(n1, n2)
+        exactUs = np.round(uvals[useExact]).astype(np.int64)
+        if alternative == "two.sided":
+            pExact = np.where(exactUs > n1 * n2 / 2.0, sf[exactUs], cdf[exactUs])
+            pvals[useExact] = np.minimum(2 * pExact, 1)
+        elif alternative == "greater":
+            pvals[useExact] = sf[exactUs]
+        else:
+            pvals[useExact] = cdf[exactUs]
+
+    useNormal = ~useExact
+    if useNormal.any():
+        z = uvals[useNormal] - n1 * n2 / 2.0
+        sigma = np.sqrt((n1 * n2 / 12.0) * ((nTotal + 1) - tieSums[useNormal] / (nTotal * (nTotal - 1.0))))
+        if alternative == "two.sided":
+            correction = np.sign(z) * 0.5
+        elif alternative == "greater":
+            correction = 0.5
+        else:
+            correction = -0.5
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (z - correction) / sigma
+        if alternative == "two.sided":
+            pvals[useNormal] = 2 * np.minimum(stats.norm.cdf(z), stats.norm.sf(z))
+        elif alternative == "greater":
+            pvals[useNormal] = stats.norm.sf(z)
+        else:
+            pvals[useNormal] = stats.norm.cdf(z)
+
+    if isSingleTest:
+        return uvals[0], pvals[0]
+    else:
+        return uvals, pvals
+
+
+def _getBootstrapCounts(rng, nReplicates, nSamples):
+    """
+    Draws <nReplicates> bootstrap resamples of <nSamples> observations with replacement and returns how often each
+    observation was drawn in each resample.
+    :param rng: np.random.Generator
+    :param nReplicates: int
+    :param nSamples: int
+    :return: np.ndarray of float64 and shape (nReplicates, nSamples)
+    """
+
+    drawn = rng.integers(0, nSamples, size=(nReplicates, nSamples))
+    drawn += (np.arange(nReplicates) * nSamples)[:, None]
+    return np.bincount(drawn.reshape((-1,)), minlength=nReplicates * nSamples).reshape(
+        (nReplicates, nSamples)).astype(np.float64)
+
+
+def bootstrapWelsch_ttest_batch(vals1, vals2, nBootstrap=1000, seed=None, maxBytes=256 * 1024 ** 2, blockSize=100):
+    """
+    Runs bootstrapWelsch_ttest for several tests at once, e.g., one per measure or voxel.
+
+    Bootstrap replicates are generated in blocks of <blockSize> replicates, each drawn by its own np.random.Generator
+    whose seed is spawned from <seed> using np.random.SeedSequence. Each replicate resamples the same observation
+    indices for all tests. Resamples are represented as counts of the observations, so that the means and
+    variances of all tests in a block are obtained using matrix products. Tests are processed in chunks so that the
+    arrays of a block take up about <maxBytes> bytes. Results only depend on <seed>, <nBootstrap> and <blockSize>,
+    not on <maxBytes>. To reproduce parallel runs, pass each run one of the children of
+    np.random.SeedSequence(seed).spawn(nRuns).
+    :param vals1: array-like of shape (nTests, N1), one row of values of set 1 per test
+    :param vals2: array-like of shape (nTests, N2), one row of values of set 2 per test
+    :param nBootstrap: int, number of bootstrap replicates
+    :param seed: None, int or np.random.SeedSequence. If None, fresh entropy is used.
+    :param maxBytes: int, approximate memory budget in bytes for the arrays of a block
+    :param blockSize: int, number of bootstrap replicates drawn from each spawned seed
+    :return: tStats, pVals : np.ndarrays of shape (nTests,)
+    """
+
+    vals1 = np.asarray(vals1, dtype=np.float64)
+    vals2 = np.asarray(vals2, dtype=np.float64)
+    assert vals1.ndim == 2 and vals2.ndim == 2 and vals1.shape[0] == vals2.shape[0], \
+        "vals1 and vals2 must be arrays of shapes (nTests, N1) and (nTests, N2)"
+
+    nTests, N1 = vals1.shape
+    N2 = vals2.shape[1]
+
+    vals10Mean = vals1 - vals1.mean(axis=1)[:, None]
+    vals20Mean = vals2 - vals2.mean(axis=1)[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observedTStats = (vals1.mean(axis=1) - vals2.mean(axis=1)) / \
+                         np.sqrt(vals1.var(axis=1) / N1 + vals2.var(axis=1) / N2)
+    absObservedTStats = np.abs(observedTStats)
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    nBlocks = int(np.ceil(nBootstrap / float(blockSize)))
+    blockSeeds = seed.spawn(nBlocks)
+
+    # per test and replicate, one mean and one mean of squares for each set and one t statistic are held in memory
+    testsPerChunk = max(1, int(maxBytes // (8 * 5 * blockSize)))
+
+    nExceeding = np.zeros(nTests, dtype=np.int64)
+    for blockInd, blockSeed in enumerate(blockSeeds):
+        rng = np.random.default_rng(blockSeed)
+        nReplicates = min(blockSize, nBootstrap - blockInd * blockSize)
+        counts1 = _getBootstrapCounts(rng, nReplicates, N1) / N1
+        counts2 = _getBootstrapCounts(rng, nReplicates, N2) / N2
+
+        for testStart in range(0, nTests, testsPerChunk):
+            testSlice = slice(testStart, testStart + testsPerChunk)
+            BSSampleMeans1 = vals10Mean[testSlice].dot(counts1.T)
+            BSSampleMeans2 = vals20Mean[testSlice].dot(counts2.T)
+            BSSampleVar1 = (vals10Mean[testSlice] ** 2).dot(counts1.T) - BSSampleMeans1 ** 2
+            BSSampleVar2 = (vals20Mean[testSlice] ** 2).dot(counts2.T) - BSSampleMeans2 ** 2
+
+            with np.errstate(invalid="ignore", divide="ignore"):
+                tStats = (BSSampleMeans1 - BSSampleMeans2) / \
+                         np.sqrt(np.maximum(BSSampleVar1, 0) / N1 + np.maximum(BSSampleVar2, 0) / N2)
+            nExceeding[testSlice] += (np.abs(tStats) >= absObservedTStats[testSlice, None]).sum(axis=1)
+
+    pVals = nExceeding / float(nBootstrap)
+    pVals[np.isnan(observedTStats)] = np.nan
+
+    return observedTStats, pVals
+
+
+def bootstrapWelsch_ttest(vals1, vals2, nBootstrap=1000, seed=None, maxBytes=256 * 1024 ** 2):
 
     """
     Calculates the pVal of difference of means of vals1 and vals2 using the Welsch t-test.
     It uses bootstrap sampling to determine the distribution of the Welsch t-statistic.
+    See bootstrapWelsch_ttest_batch for running many tests at once.
 
     Refs:
     1. http://www.biostat.umn.edu/%7Ewill/6470stuff/Class21-12/Handout21.pdf
@@ -55,47 +397,34 @@ def bootstrapWelsch_ttest(vals1, vals2, nBootstrap=1000):
     :param vals1: iterable
     :param vals2: iterable
     :param nBootstrap: number of bootstraps to use
+    :param seed: None, int or np.random.SeedSequence, seed of the bootstrap sampling. If None, fresh entropy is used.
+    :param maxBytes: int, approximate memory budget in bytes, see bootstrapWelsch_ttest_batch
     :return: tStat, pVal : float, float
     """
 
     try:
-        vals1 = np.array(vals1)
+        vals1 = np.array(vals1, dtype=np.float64).reshape((1, -1))
     except Exception as e:
         raise(ValueError('vals1 must be an iterable of numbers'))
 
     try:
-        vals2 = np.array(vals2)
+        vals2 = np.array(vals2, dtype=np.float64).reshape((1, -1))
     except Exception as e:
         raise (ValueError('vals2 must be an iterable of numbers'))
 
-    N1 = len(vals1)
-    N2 = len(vals2)
-
-    vals1Mean = vals1.mean()
-    vals2Mean = vals2.mean()
+    tStats, pVals = bootstrapWelsch_ttest_batch(vals1, vals2, nBootstrap=nBootstrap, seed=seed, maxBytes=maxBytes)
 
-    observedTStat = (vals1Mean - vals2Mean) / np.sqrt((np.var(vals1) / N1) + (np.var(vals2) / N2))
+    return tStats[0], pVals[0]
 
-    vals10Mean = vals1 - vals1Mean
-    vals20Mean = vals2 - vals2Mean
 
-    bootstrapSamples1 = np.random.choice(vals10Mean, size=(nBootstrap, N1))
-    bootstrapSamples2 = np.random.choice(vals20Mean, size=(nBootstrap, N2))
-
-    BSSampleMeans1 = bootstrapSamples1.mean(axis=1)
-    BSSampleMeans2 = bootstrapSamples2.mean(axis=1)
-
-    BSSampleVar1 = bootstrapSamples1.var(axis=1)
-    BSSampleVar2 = bootstrapSamples1.var(axis=1)
-
-    temp1 = (BSSampleVar1 / N1)
-    temp2 = (BSSampleVar2 / N2)
-
-    tStats = (BSSampleMeans1 - BSSampleMeans2) / np.sqrt(temp1 + temp2)
-
-    pVal = (np.abs(tStats) >= np.abs(observedTStat)).sum() / float(nBootstrap)
+def _loadARTool():
+    """
+    Loads the R package ARTool into the embedded R, installing it if required. Does nothing if it has already been
+    loaded.
+    :return:
+    """
 
-    return observedTStat, pVal
+    rSession.importPackage("ARTool", install=True)
 
 
 def art_two_way_anova(dataDF):
@@ -119,22 +448,17 @@ def art_two_way_anova(dataDF):
     assert type(dataDF) is pd.DataFrame, "Input <dataDF> is not a pandas DataFrame as expected"
     assert type(dataDF.shape[1] == 3), "The number of columns in <dataDF> is not 4 as expected"
 
+    if rSession.useFallback("art_two_way_anova"):
+        correctness, pVals = art_two_way_anova_np(dataDF.iloc[:, 2].values.astype(np.float64),
+                                                  dataDF.iloc[:, 0].values, dataDF.iloc[:, 1].values)
+        return correctness, tuple(pVals)
+    robjects, RRuntimeError = rSession.robjects, rSession.RRuntimeError
+
     ART_IPDF_r = robjects.DataFrame({"f1": robjects.FactorVector(dataDF.iloc[:, 0]),
                                    "f2": robjects.FactorVector(dataDF.iloc[:, 1]),
                                    "m": robjects.FloatVector(dataDF.iloc[:, 2])})
 
-    rUtils = rpackages.importr("utils")
-    rUtils.chooseCRANmirror(ind=1)
-
-    try:
-        rpackages.importr("ARTool")
-    except RRuntimeError as re:
-        if str(re).find("Error in loadNamespace") >= 0:
-            print("Insatalling package \"ARTool\" in the embedded R. This might take a while")
-            rUtils.install_packages(robjects.StrVector(["ARTool"]))
-            rpackages.importr("ARTool")
-        else:
-            raise re
+    _loadARTool()
 
     ARTFunc_r = robjects.r["art"]
 
@@ -160,20 +484,543 @@ def art_two_way_anova(dataDF):
 
     return ART_success, tuple(ART_res[6])
 
+
+# R function doing the same as art_two_way_anova for every group of rows of a data frame with the columns g (integer
+# group codes), f1, f2 and m. Returns a numeric vector with four entries per group, in the order of the group codes:
+# ART correctness and the pVals of f1, f2 and f1:f2.
+_ARTBatchRSource = """
+function(df) {
+    rowsPerGroup <- split(seq_len(nrow(df)), df$g)
+    as.numeric(vapply(rowsPerGroup, function(rows) {
+        groupDF <- data.frame(f1=factor(df$f1[rows]), f2=factor(df$f2[rows]), m=df$m[rows])
+        artModel <- art(m ~ f1 * f2, data=groupDF)
+        artSummary <- tryCatch(summary(artModel), error=function(e) {
+            if (grepl("Anova.lm", paste(deparse(conditionCall(e)), collapse=""))) NULL else stop(e)
+        })
+        if (is.null(artSummary)) {
+            return(c(1, NA, NA, NA))
+        }
+        artSuccess <- isTRUE(all(abs(artSummary$aligned.col.sums) <= 1e-8)) &&
+                      isTRUE(all(abs(artSummary$aligned.anova$F) <= 1e-8))
+        c(as.numeric(artSuccess), anova(artModel)[["Pr(>F)"]])
+    }, numeric(4)))
+}
+"""
+
+
+def art_two_way_anova_batch(dataDF):
+    """
+    Performs Aligned rank transform of the data followed by two-way Anova using ARTool like art_two_way_anova, but for
+    many groups of rows of <dataDF> at once, e.g., for all voxels. The whole table is transferred to R once and the
+    groups are processed within R.
+    :param dataDF: pandas.DataFrame with the following column ordering:
+                      Column 1. Group, e.g., voxel key
+                      Column 2. Factor 1
+                      Column 3. Factor 2
+                      Column 4. Measurements
+    :return: pandas.DataFrame indexed by the unique values of the group column, with the columns "ART correctness",
+    "pVal(f1)", "pVal(f2)" and "pVal(f1:f2)" containing for each group the values returned by art_two_way_anova.
+    """
+
+    assert type(dataDF) is pd.DataFrame, "Input <dataDF> is not a pandas DataFrame as expected"
+    assert dataDF.shape[1] == 4, "The number of columns in <dataDF> is not 4 as expected"
+
+    groupCodes, groups = pd.factorize(dataDF.iloc[:, 0], sort=True)
+
+    if rSession.useFallback("art_two_way_anova_batch"):
+        results = np.empty((len(groups), 4))
+        for groupCode, groupDF in dataDF.loc[groupCodes >= 0, :].groupby(groupCodes[groupCodes >= 0]):
+            correctness, pVals = art_two_way_anova_np(groupDF.iloc[:, 3].values.astype(np.float64),
+                                                      groupDF.iloc[:, 1].values, groupDF.iloc[:, 2].values)
+            results[groupCode] = [correctness] + list(pVals)
+    else:
+        results = _art_two_way_anova_batch_r(groupCodes, len(groups), dataDF)
+
+    resultsDF = pd.DataFrame(results, index=groups, columns=["ART correctness", "pVal(f1)", "pVal(f2)", "pVal(f1:f2)"])
+    resultsDF["ART correctness"] = resultsDF["ART correctness"].astype(bool)
+
+    return resultsDF
+
+
+def _art_two_way_anova_batch_r(groupCodes, nGroups, dataDF):
+    """
+    R part of art_two_way_anova_batch.
+    :return: np.ndarray of shape (nGroups, 4)
+    """
+
+    _loadARTool()
+    robjects = rSession.robjects
+    ARTBatchFunc_r = rSession.getFunction(_ARTBatchRSource)
+
+    ART_IPDF_r = robjects.DataFrame({"g": robjects.IntVector(groupCodes.tolist()),
+                                     "f1": robjects.StrVector(dataDF.iloc[:, 1].astype(str).tolist()),
+                                     "f2": robjects.StrVector(dataDF.iloc[:, 2].astype(str).tolist()),
+                                     "m": robjects.FloatVector(dataDF.iloc[:, 3].astype(float).tolist())})
+
+    return np.array(ARTBatchFunc_r(ART_IPDF_r), dtype=np.float64).reshape((nGroups, 4))
+
+#***********************************************************************************************************************
+
+
+def _initRWorker():
+    """
+    Initializer of the processes of RWorkerPool, starts the embedded R of the process and loads ARTool into it. When R is
+    not available, the workers use the numpy based fallbacks.
+    :return:
+    """
+
+    if rSession.isAvailable():
+        _loadARTool()
+
+
+def _rMannwhitneyuChunk(args):
+
+    samplePairs, exact, alternative = args
+    return [r_mannwhitneyu(sample1, sample2, exact=exact, alternative=alternative)
+            for sample1, sample2 in samplePairs]
+
+
+def _splitIntoChunks(nItems, nChunks):
+    """
+    Returns the boundaries of <nChunks> contiguous chunks of roughly equal size of <nItems> items.
+    :return: list of tuples (start, stop)
+    """
+
+    bounds = np.linspace(0, nItems, max(1, min(nChunks, nItems)) + 1).round().astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class RWorkerPool(object):
+    """
+    Pool of worker processes, each with its own embedded R in which ARTool is loaded once when the pool is started, for
+    running R-backed tests on several cores. Processes are started with the "spawn" method, as an embedded R cannot be
+    shared with forked processes. Can be used as a context manager, which closes the pool on exit:
+
+    with RWorkerPool(4) as pool:
+        artDF = pool.art_two_way_anova_batch(dataDF)
+    """
+
+    def __init__(self, nWorkers=None, chunksPerWorker=4):
+        """
+        :param nWorkers: int, number of worker processes, defaults to the number of CPUs
+        :param chunksPerWorker: int, number of chunks into which work is split per worker, for balancing load
+        """
+
+        if nWorkers is None:
+            nWorkers = multiprocessing.cpu_count()
+        self.nWorkers = nWorkers
+        self.chunksPerWorker = chunksPerWorker
+        self.pool = multiprocessing.get_context("spawn").Pool(processes=nWorkers, initializer=_initRWorker)
+
+    def art_two_way_anova_batch(self, dataDF):
+        """
+        Parallel version of art_two_way_anova_batch. Groups are split into chunks, which are processed by the workers.
+        :param dataDF: pandas.DataFrame, see art_two_way_anova_batch
+        :return: pandas.DataFrame, see art_two_way_anova_batch
+        """
+
+        groups = np.unique(dataDF.iloc[:, 0])
+        if groups.shape[0] == 0:
+            return pd.DataFrame(columns=["ART correctness", "pVal(f1)", "pVal(f2)", "pVal(f1:f2)"])
+        chunkBounds = _splitIntoChunks(groups.shape[0], self.nWorkers * self.chunksPerWorker)
+        groupChunkInds = np.searchsorted(np.array([x[1] for x in chunkBounds]),
+                                         np.searchsorted(groups, dataDF.iloc[:, 0].values), side="right")
+        chunkDFs = [chunkDF for chunkInd, chunkDF in dataDF.groupby(groupChunkInds)]
+
+        return pd.concat(self.pool.map(art_two_way_anova_batch, chunkDFs, chunksize=1))
+
+    def r_mannwhitneyu_batch(self, samplePairs, exact=True, alternative="two.sided"):
+        """
+        Runs r_mannwhitneyu for each pair of samples in <samplePairs> using the workers.
+        :param samplePairs: list of tuples (sample1, sample2)
+        :param exact: see r_mannwhitneyu
+        :param alternative: see r_mannwhitneyu
+        :return: list of tuples (uval, pval), one per member of samplePairs
+        """
+
+        samplePairs = list(samplePairs)
+        chunks = [(samplePairs[start: stop], exact, alternative)
+                  for start, stop in _splitIntoChunks(len(samplePairs), self.nWorkers * self.chunksPerWorker)]
+        results = []
+        for chunkResults in self.pool.map(_rMannwhitneyuChunk, chunks, chunksize=1):
+            results.extend(chunkResults)
+        return results
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+
+        if excType is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
+
+#***********************************************************************************************************************
+
+
+def _getLevelIndices(factor):
+    """
+    Returns the index of the level of each member of <factor> among the sorted unique levels of <factor>.
+    :param factor: iterable
+    :return: levelIndices, nLevels
+    """
+
+    levels, levelIndices = np.unique(np.asarray(factor), return_inverse=True)
+    return levelIndices.reshape((-1,)), levels.shape[0]
+
+
+def _groupMeans(values, groupIndices, nGroups):
+    """
+    Returns the mean of each row of <values> over each group of columns, expanded back to the shape of <values>.
+    :param values: np.ndarray of shape (nRows, nCols)
+    :param groupIndices: np.ndarray of ints and shape (nCols,)
+    :param nGroups: int
+    :return: np.ndarray of shape (nRows, nCols)
+    """
+
+    indicators = np.zeros((groupIndices.shape[0], nGroups))
+    indicators[np.arange(groupIndices.shape[0]), groupIndices] = 1
+    means = np.dot(values, indicators) / indicators.sum(axis=0)
+    return means[:, groupIndices]
+
+
+def _rankRows(values, tieDigits=None):
+    """
+    Ranks the members of each row of <values>, assigning average ranks to ties (like scipy.stats.rankdata and R's rank).
+    :param values: np.ndarray of shape (nRows, nCols)
+    :param tieDigits: None or int, if not None, values of a row agreeing up to <tieDigits> significant digits relative
+    to the largest absolute value of the row are considered ties.
+    :return: np.ndarray of float64 and shape (nRows, nCols)
+    """
+
+    nRows, nCols = values.shape
+    if tieDigits is not None:
+        scales = np.abs(values).max(axis=1)[:, None]
+        scales[scales == 0] = 1
+        values = np.round(values / scales, tieDigits)
+    order = np.argsort(values, axis=1, kind="mergesort")
+    sortedValues = np.take_along_axis(values, order, axis=1)
+
+    # runs of tied values, numbered across all rows
+    isRunStart = np.ones((nRows, nCols), dtype=bool)
+    isRunStart[:, 1:] = sortedValues[:, 1:] != sortedValues[:, :-1]
+    runIDs = np.cumsum(isRunStart.reshape((-1,))) - 1
+    positions = np.tile(np.arange(1, nCols + 1, dtype=np.float64), nRows)
+    runSums = np.bincount(runIDs, weights=positions)
+    runCounts = np.bincount(runIDs)
+    sortedRanks = (runSums / runCounts)[runIDs].reshape((nRows, nCols))
+
+    ranks = np.empty((nRows, nCols))
+    np.put_along_axis(ranks, order, sortedRanks, axis=1)
+    return ranks
+
+
+def _getResidualMaker(designMatrix):
+    """
+    Returns the matrix projecting observations onto the residuals of the least squares fit of <designMatrix>.
+    :param designMatrix: np.ndarray of shape (nObs, nParams)
+    :return: np.ndarray of shape (nObs, nObs)
+    """
+
+    return np.eye(designMatrix.shape[0]) - np.dot(designMatrix, np.linalg.pinv(designMatrix))
+
+
+def art_two_way_anova_np(values, factor1, factor2):
+    """
+    Performs Aligned rank transform of the data followed by two-way Anova, like art_two_way_anova, but implemented with
+    numpy and for many sets of measurements with the same factor layout at once, e.g., the dendritic lengths of a set of
+    neurons in each of many voxels. Measurements are aligned for each effect, ranked with average ranks for ties and
+    for each effect, the F-test of the effect is performed on the aligned and ranked measurements for the effect, using
+    type III sums of squares with sum-to-zero contrasts as ARTool does. If some combination of factor levels has no
+    measurements, or no combination has more than one, NaNs are returned as p-values.
+    Ref: Wobbrock, J.O., Findlater, L., Gergle, D. and Higgins, J.J. (2011).
+    "The Aligned Rank Transform for nonparametric factorial analyses using only ANOVA procedures."
+    Proceedings of the ACM Conference on Human Factors in Computing Systems (CHI '11). doi: 10.1145/1978942.1978963
+    :param values: np.ndarray of shape (nSets, nObs) or (nObs,), measurements
+    :param factor1: iterable of size nObs, level of Factor 1 of each measurement
+    :param factor2: iterable of size nObs, level of Factor 2 of each measurement
+    :return: correctness_ART, pVals
+             correctness_ART: np.ndarray of bool and shape (nSets,), correctness of ART procedure (see section "Ensuring
+                              Correctness" of the reference paper), i.e., whether the column sums of the aligned
+                              measurements are zero and whether effects other than the one aligned for have F values
+                              of zero on the aligned measurements.
+             pVals: np.ndarray of shape (nSets, 3), pVals for effect of Factor 1, for effect of Factor 2, and for the
+                    interaction effect between Factor 1 and Factor 2. NaN when they cannot be calculated, e.g.,
+                    for constant measurements.
+             For one dimensional <values>, correctness_ART is a bool and pVals has shape (3,).
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    isSingleSet = values.ndim == 1
+    values = np.atleast_2d(values)
+    nSets, nObs = values.shape
+
+    f1Inds, nF1 = _getLevelIndices(factor1)
+    f2Inds, nF2 = _getLevelIndices(factor2)
+    assert f1Inds.shape[0] == f2Inds.shape[0] == nObs, "factor1 and factor2 must have one entry per measurement"
+    cellInds = f1Inds * nF2 + f2Inds
+    nCells = nF1 * nF2
+    if np.unique(cellInds).shape[0] < nCells or nObs <= nCells:
+        # type III tests are not possible, art_two_way_anova returns NaNs in this case as well
+        correctness, pVals = np.ones(nSets, dtype=bool), np.full((nSets, 3), np.nan)
+        return (bool(correctness[0]), pVals[0]) if isSingleSet else (correctness, pVals)
+
+    # alignment: residuals plus estimated effects
+    f1Means = _groupMeans(values, f1Inds, nF1)
+    f2Means = _groupMeans(values, f2Inds, nF2)
+    cellMeans = _groupMeans(values, cellInds, nCells)
+    grandMeans = values.mean(axis=1)[:, None]
+    residuals = values - cellMeans
+    aligned = [residuals + f1Means - grandMeans,
+               residuals + f2Means - grandMeans,
+               residuals + cellMeans - f1Means - f2Means + grandMeans]
+
+    # sum-to-zero coded design matrix columns of each effect
+    f1Contrasts = np.vstack((np.eye(nF1 - 1), -np.ones((1, nF1 - 1))))[f1Inds]
+    f2Contrasts = np.vstack((np.eye(nF2 - 1), -np.ones((1, nF2 - 1))))[f2Inds]
+    interactionContrasts = (f1Contrasts[:, :, None] * f2Contrasts[:, None, :]).reshape((nObs, -1))
+    effectColumns = [f1Contrasts, f2Contrasts, interactionContrasts]
+    intercept = np.ones((nObs, 1))
+
+    fullResidualMaker = _getResidualMaker(np.hstack([intercept] + effectColumns))
+    reducedResidualMakers = [_getResidualMaker(np.hstack([intercept] + effectColumns[:effectInd] +
+                                                         effectColumns[effectInd + 1:]))
+                             for effectInd in range(3)]
+    effectDFs = [nF1 - 1, nF2 - 1, (nF1 - 1) * (nF2 - 1)]
+    residualDF = nObs - nCells
+
+    def getFValues(response, effectInd):
+        sseFull = (np.dot(response, fullResidualMaker) * response).sum(axis=1)
+        sseReduced = (np.dot(response, reducedResidualMakers[effectInd]) * response).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fValues = ((sseReduced - sseFull) / effectDFs[effectInd]) / (sseFull / residualDF)
+        # like car::Anova, no test when the residual sum of squares vanishes
+        fValues[sseFull <= 1e-10 * (response ** 2).sum(axis=1)] = np.nan
+        return fValues
+
+    pVals = np.empty((nSets, 3))
+    alignedFValues = []
+    for effectInd in range(3):
+        # aligned values which are equal up to rounding errors are ranked as ties
+        fValues = getFValues(_rankRows(aligned[effectInd], tieDigits=10), effectInd)
+        pVals[:, effectInd] = stats.f.sf(fValues, effectDFs[effectInd], residualDF)
+        alignedFValues.extend(getFValues(aligned[effectInd], otherEffectInd)
+                              for otherEffectInd in range(3) if otherEffectInd != effectInd)
+
+    alignedFValues = np.column_stack(alignedFValues)
+    columnSums = np.column_stack([x.sum(axis=1) for x in aligned])
+    # F values of constant aligned measurements are NaN, but they do not indicate a failure of alignment
+    correctness = np.isclose(columnSums, 0).all(axis=1) & \
+                  (np.isclose(alignedFValues, 0) | np.isnan(alignedFValues)).all(axis=1)
+
+    if isSingleSet:
+        return bool(correctness[0]), pVals[0]
+    else:
+        return correctness, pVals
+
+def two_way_anova_np(values, factor1, factor2):
+    """
+    Performs two-way Anova with interaction and type II sums of squares, like statsmodels' anova_lm(typ=2) of the
+    ordinary least squares fit of "value ~ C(factor1) + C(factor2) + C(factor1):C(factor2)", for many sets of
+    measurements with the same factor layout at once, e.g., the dendritic lengths of a set of neurons in each of many
+    spatial bins. The design matrices and their residual makers are built only once and the sums of squares of all sets
+    are obtained using matrix products. Combinations of factor levels without measurements reduce the degrees of
+    freedom of the interaction effect.
+    :param values: np.ndarray of shape (nSets, nObs) or (nObs,), measurements
+    :param factor1: iterable of size nObs, level of Factor 1 of each measurement
+    :param factor2: iterable of size nObs, level of Factor 2 of each measurement
+    :return: fValues, pVals
+             fValues, pVals: np.ndarrays of shape (nSets, 3), F values and pVals for effect of Factor 1, for effect of
+                    Factor 2, and for the interaction effect between Factor 1 and Factor 2. NaN when they cannot be
+                    calculated, e.g., for constant measurements.
+             For one dimensional <values>, both have shape (3,).
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    isSingleSet = values.ndim == 1
+    values = np.atleast_2d(values)
+    nSets, nObs = values.shape
+
+    f1Inds, nF1 = _getLevelIndices(factor1)
+    f2Inds, nF2 = _getLevelIndices(factor2)
+    assert f1Inds.shape[0] == f2Inds.shape[0] == nObs, "factor1 and factor2 must have one entry per measurement"
+
+    # type II sums of squares do not depend on the coding of the factors, dummy coding is used
+    f1Columns = np.eye(nF1)[f1Inds][:, 1:]
+    f2Columns = np.eye(nF2)[f2Inds][:, 1:]
+    interactionColumns = (f1Columns[:, :, None] * f2Columns[:, None, :]).reshape((nObs, -1))
+    intercept = np.ones((nObs, 1))
+
+    designs = {"f1": np.hstack((intercept, f1Columns)),
+               "f2": np.hstack((intercept, f2Columns)),
+               "main": np.hstack((intercept, f1Columns, f2Columns)),
+               "full": np.hstack((intercept, f1Columns, f2Columns, interactionColumns))}
+    ranks = {name: np.linalg.matrix_rank(design) for name, design in designs.items()}
+    sses = {name: (np.dot(values, _getResidualMaker(design)) * values).sum(axis=1)
+            for name, design in designs.items()}
+
+    # each effect is tested against the model containing all effects not containing it
+    sumsOfSquares = np.column_stack((sses["f2"] - sses["main"], sses["f1"] - sses["main"],
+                                     sses["main"] - sses["full"]))
+    effectDFs = np.array([ranks["main"] - ranks["f2"], ranks["main"] - ranks["f1"], ranks["full"] - ranks["main"]])
+    residualDF = nObs - ranks["full"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fValues = (sumsOfSquares / effectDFs) / (sses["full"] / residualDF)[:, None]
+    fValues[:, effectDFs == 0] = np.nan
+    if residualDF == 0:
+        fValues[:] = np.nan
+    fValues[sses["full"] <= 1e-10 * (values ** 2).sum(axis=1)] = np.nan
+    pVals = stats.f.sf(fValues, effectDFs[None, :], residualDF)
+
+    if isSingleSet:
+        return fValues[0], pVals[0]
+    else:
+        return fValues, pVals
+
 #***********************************************************************************************************************
 
+def _countPairDifferencesBelow(xSorted, yDescending, pivots, strict=False):
+    """
+    For each row of <xSorted> and each of its values x_i, counts the values y_j of the same row of <yDescending> with
+    x_i - y_j <= pivot (x_i - y_j < pivot if <strict>), with pivot being the value of <pivots> of the row. As x_i - y_j
+    is non-decreasing along j, the counts are found by a binary search over j, vectorized over all rows and x_i.
+    :param xSorted: np.ndarray of shape (nSets, n), each row sorted in ascending order
+    :param yDescending: np.ndarray of shape (nSets, m), each row sorted in descending order
+    :param pivots: np.ndarray of shape (nSets,)
+    :param strict: bool
+    :return: np.ndarray of int64 and shape (nSets, n)
+    """
+
+    m = yDescending.shape[1]
+    lows = np.zeros(xSorted.shape, dtype=np.int64)
+    highs = np.full(xSorted.shape, m, dtype=np.int64)
+    pivots = pivots[:, None]
+
+    isActive = lows < highs
+    while isActive.any():
+        mids = (lows + highs) // 2
+        differences = xSorted - np.take_along_axis(yDescending, np.minimum(mids, m - 1), axis=1)
+        isBelow = differences < pivots if strict else differences <= pivots
+        lows = np.where(isActive & isBelow, mids + 1, lows)
+        highs = np.where(isActive & ~isBelow, mids, highs)
+        isActive = lows < highs
+
+    return lows
+
+
+def _selectPairDifferences(xSorted, yDescending, ks):
+    """
+    Returns the <ks>-th smallest (1-based) of all the pairwise differences x_i - y_j between the values of a row of
+    <xSorted> and the values of the same row of <yDescending>, for every row, without forming all the differences.
+    The differences form a matrix with non-decreasing rows and columns. For every row of this matrix, the range of
+    columns still containing candidates is tracked. In every iteration, the weighted median of the middle candidates
+    of all rows is used as pivot and compared with the number of differences below it, which removes at least a
+    quarter of the remaining candidates. This needs O(log(n * m)) iterations of O(n log(m)) each.
+    :param xSorted: np.ndarray of shape (nSets, n), each row sorted in ascending order
+    :param yDescending: np.ndarray of shape (nSets, m), each row sorted in descending order
+    :param ks: np.ndarray of int64 and shape (nSets,), with 1 <= k <= n * m
+    :return: np.ndarray of shape (nSets,)
+    """
+
+    nSets, n = xSorted.shape
+    m = yDescending.shape[1]
+    lefts = np.zeros((nSets, n), dtype=np.int64)
+    rights = np.full((nSets, n), m, dtype=np.int64)
+    selected = np.full(nSets, np.nan)
+    isDone = np.zeros(nSets, dtype=bool)
+
+    while not isDone.all():
+        # weighted median of the middle candidates of the rows, weighted by their numbers of candidates
+        weights = np.where(isDone[:, None], 0, rights - lefts)
+        middles = xSorted - np.take_along_axis(yDescending, np.minimum((lefts + rights) // 2, m - 1), axis=1)
+        middles[weights == 0] = np.inf
+        order = np.argsort(middles, axis=1, kind="mergesort")
+        cumWeights = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+        medianPositions = np.argmax(2 * cumWeights >= cumWeights[:, -1:], axis=1)
+        pivots = np.take_along_axis(middles, np.take_along_axis(order, medianPositions[:, None], axis=1),
+                                    axis=1)[:, 0]
+        pivots[isDone] = 0
+
+        nBelowOrEqual = _countPairDifferencesBelow(xSorted, yDescending, pivots)
+        nBelow = _countPairDifferencesBelow(xSorted, yDescending, pivots, strict=True)
+        totalBelowOrEqual = nBelowOrEqual.sum(axis=1)
+        totalBelow = nBelow.sum(axis=1)
+
+        isPivot = ~isDone & (totalBelow < ks) & (ks <= totalBelowOrEqual)
+        selected[isPivot] = pivots[isPivot]
+        isDone |= isPivot
+
+        isAbove = ~isDone & (ks <= totalBelow)
+        rights[isAbove] = np.minimum(rights[isAbove], nBelow[isAbove])
+        isBelow = ~isDone & (ks > totalBelowOrEqual)
+        lefts[isBelow] = np.maximum(lefts[isBelow], nBelowOrEqual[isBelow])
+
+    return selected
+
+
+def HodgesLehmannEstimate_batch(x, y):
+    """
+    Calculates the Hodges-Lehmann estimate of HodgesLehmannEstimate for every column of <x> and <y>, e.g., for
+    every voxel of matrices with one row per neuron and one column per voxel. The median of the pairwise differences is
+    found by selection (see _selectPairDifferences) in O((n + m) log(n + m) log(n * m)) time per column, without
+    forming the n * m pairwise differences. Columns containing NaNs yield NaN.
+    :param x: array-like of shape (n, nColumns), or (n,) for a single column
+    :param y: array-like of shape (m, nColumns), or (m,) for a single column
+    :return: np.ndarray of shape (nColumns,), h-l estimates "x-y"
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x.reshape((-1, 1))
+    if y.ndim == 1:
+        y = y.reshape((-1, 1))
+    assert x.ndim == 2 and y.ndim == 2 and x.shape[1] == y.shape[1], \
+        "x and y must be arrays of shapes (n, nColumns) and (m, nColumns)"
+
+    n, m = x.shape[0], y.shape[0]
+    if n == 0 or m == 0:
+        return np.full(x.shape[1], np.nan)
+
+    hasNaNs = np.isnan(x).any(axis=0) | np.isnan(y).any(axis=0)
+    xSorted = np.sort(np.where(hasNaNs[None, :], 0, x).T, axis=1)
+    yDescending = -np.sort(-np.where(hasNaNs[None, :], 0, y).T, axis=1)
+
+    # for an even number of differences, the median is the mean of the two middle ones
+    nDifferences = n * m
+    lowerMiddles = _selectPairDifferences(xSorted, yDescending, np.full(x.shape[1], (nDifferences + 1) // 2))
+    if nDifferences % 2:
+        estimates = lowerMiddles
+    else:
+        upperMiddles = _selectPairDifferences(xSorted, yDescending, np.full(x.shape[1], nDifferences // 2 + 1))
+        estimates = (lowerMiddles + upperMiddles) / 2.0
+
+    estimates[hasNaNs] = np.nan
+
+    return estimates
+
+
 def HodgesLehmannEstimate(x, y):
     """
     Calculates the Hodges-Lehmann estimate of the difference between medians of two populations x, y. The output is to
-    be interpreted as "x-y". It constructs all possible sets of two elements where one element is from x and one from y,
-    and calculates differences between the elements for all sets, and calculates the median of the resulting differences.
-    bewteen
+    be interpreted as "x-y". It is the median of the differences between the elements of all possible sets of two
+    elements where one element is from x and one from y. The median is found by selection without forming all the
+    differences (see HodgesLehmannEstimate_batch).
     :param x: iterable of float
     :param y: iterable of float
     :return: float, h-l estimate
     """
 
-    return np.median([(a - b) for a in x for b in y])
+    return HodgesLehmannEstimate_batch(np.fromiter(x, dtype=np.float64), np.fromiter(y, dtype=np.float64))[0]
 
 #***********************************************************************************************************************
 
@@ -2,45 +2,178 @@
 This file contains functions for transforming pandas.DataFrames in certain specific ways.
 '''
 
+import numpy as np
 import pandas as pd
 
 
-def dfCorr(data, x, ys, func, outLabels, hue=None):
+class RecordBuilder(object):
     '''
-    Applies func(y, x) for each y in ys. func must return an iterable of the same size as outLabels.
+    Collects the rows of a table and creates the pandas.DataFrame once at the end, to be used instead of calling
+    DataFrame.append in a loop, which copies the whole table for every row added. Columns with a dtype given in <dtypes>
+    are stored in preallocated numpy arrays, whose capacity is doubled when full, all other columns in lists. Columns
+    appear in the DataFrame in the order of <columns> and <dtypes>, followed by the other columns in the order they are
+    first added. Rows that do not contain a column get NaN in it, or the
+    zero of the dtype for typed columns of non-float dtypes.
+    '''
+
+    def __init__(self, columns=(), dtypes=None, nRows=16):
+        '''
+        :param columns: iterable of column names, to fix the order of these columns in the DataFrame
+        :param dtypes: dict, mapping column names to numpy dtypes, for columns to be stored in numpy arrays
+        :param nRows: int, expected number of rows, initial capacity of the numpy arrays
+        '''
+
+        self.dtypes = {} if dtypes is None else dict(dtypes)
+        self._capacity = max(int(nRows), 1)
+        self._nRows = 0
+        self._columns = {}
+        for column in list(columns) + list(self.dtypes):
+            self._addColumn(column)
+
+    def __len__(self):
+
+        return self._nRows
+
+    def _addColumn(self, column):
+
+        if column in self._columns:
+            return
+
+        if column in self.dtypes:
+            dtype = np.dtype(self.dtypes[column])
+            fillValue = np.nan if dtype.kind in "fc" else 0
+            self._columns[column] = np.full(self._capacity, fillValue, dtype=dtype)
+        else:
+            self._columns[column] = [np.nan] * self._nRows
+
+    def _reserve(self, nRows):
+
+        if nRows <= self._capacity:
+            return
+
+        newCapacity = max(nRows, 2 * self._capacity)
+        for column, values in self._columns.items():
+            if isinstance(values, np.ndarray):
+                newValues = np.full(newCapacity, np.nan if values.dtype.kind in "fc" else 0, dtype=values.dtype)
+                newValues[:self._nRows] = values[:self._nRows]
+                self._columns[column] = newValues
+        self._capacity = newCapacity
+
+    def addRecord(self, record):
+        '''
+        Adds one row.
+        :param record: dict or pandas.Series, mapping column names to values
+        :return:
+        '''
+
+        self._reserve(self._nRows + 1)
+        for column, value in record.items():
+            self._addColumn(column)
+            values = self._columns[column]
+            if isinstance(values, np.ndarray):
+                values[self._nRows] = value
+            else:
+                values.append(value)
+
+        self._nRows += 1
+        for values in self._columns.values():
+            if not isinstance(values, np.ndarray) and len(values) < self._nRows:
+                values.append(np.nan)
+
+    def addRecords(self, records):
+        '''
+        Adds several rows at once.
+        :param records: dict, mapping column names to iterables of values, one per row, or to scalars, which are used
+        for all rows. All iterables must have the same length.
+        :return:
+        '''
+
+        nNew = None
+        for value in records.values():
+            if not np.isscalar(value) and value is not None:
+                valueLength = len(value)
+                assert nNew is None or nNew == valueLength, "All columns in <records> must have the same length"
+                nNew = valueLength
+        assert nNew is not None, "At least one column in <records> must be an iterable"
+
+        self._reserve(self._nRows + nNew)
+        for column, value in records.items():
+            self._addColumn(column)
+            values = self._columns[column]
+            isScalar = np.isscalar(value) or value is None
+            if isinstance(values, np.ndarray):
+                values[self._nRows: self._nRows + nNew] = value if isScalar else np.asarray(value)
+            else:
+                values.extend([value] * nNew if isScalar else list(value))
+
+        self._nRows += nNew
+        for values in self._columns.values():
+            if not isinstance(values, np.ndarray) and len(values) < self._nRows:
+                values.extend([np.nan] * (self._nRows - len(values)))
+
+    def toDataFrame(self, index=None):
+        '''
+        Creates the DataFrame of all rows added so far.
+        :param index: None or an index with one entry per row, e.g. a pandas.MultiIndex. If None, rows are numbered
+        starting at 0.
+        :return: pandas.DataFrame
+        '''
+
+        data = {column: values[:self._nRows] if isinstance(values, np.ndarray) else values
+                for column, values in self._columns.items()}
+        return pd.DataFrame(data, columns=list(self._columns), index=index)
+
+
+
+def _getHueGroupArrays(data, columns, hue):
+    '''
+    Groups <data> once on <hue> and extracts the values of <columns> of each group as one 2D array.
+    :return: list of (hueValue, np.ndarray of shape (nRowsOfGroup, len(columns))), in the sorted order of hue values
+    '''
+
+    return [(hueValue, hueDF[list(columns)].values)
+            for hueValue, hueDF in data.groupby(hue, sort=True, observed=True)]
+
+
+def dfCorr(data, x, ys, func, outLabels, hue=None, vectorized=False):
+    '''
+    Applies func(x, y) for each y in ys. func must return an iterable of the same size as outLabels.
     Returns the results as a DataFrame with ys as indexes and outLabels as columns. If hue is not None, the analysis is
-    done for each y grouped on the hue. In this case, columns would be multiindexed with the hue on the higher level and
-    outLabels at the lower.
+    done for each y grouped on the hue. In this case, the index has ys on the higher level and the groups of hue
+    on the lower, with an additional row for all data.
     :param data: a pandas DataFrame
     :param x: the column of data to be used as the independent variable
-    :param ys: the columns of data to be used as
-    :param func: the function to be applied
+    :param ys: the columns of data to be used as dependent variables
+    :param func: the function to be applied. If <vectorized> is False, it is called with two np.ndarrays of shape
+    (nRows,), once per y and group. If <vectorized> is True, it is called once per group with an np.ndarray of shape
+    (nRows,) for x and one of shape (nRows, len(ys)) for all ys, and must return an iterable of the same size as
+    outLabels with arrays of shape (len(ys),), e.g. lambda x, Y: pearsonr(x[:, None], Y, axis=0)
     :param outLabels: labels for the values returned by func
     :param hue: grouping key
+    :param vectorized: bool, see <func>
     :return: a pandas DataFrame
     '''
 
-
-    allDfs = []
-    for y in ys:
-        df = pd.DataFrame({'Overall (n={})'.format(len(data)): func(data[x], data[y])}, index=outLabels).T
-
-
-        if hue is not None:
-            groupedData = data.groupby(hue)
-
-            for group in groupedData.groups:
-
-                hueData = groupedData.get_group(group)
-
-                dfT = pd.DataFrame({group + ' (n={})'.format(len(hueData)): func(hueData[x], hueData[y])},
-                                   index=outLabels).T
-
-                df = df.append(dfT)
-
-        allDfs.append(df)
-
-    return pd.concat(allDfs, axis=0, keys=ys)
+    ys = list(ys)
+    # the data and its groups are extracted as arrays only once, for all ys
+    groupArrays = [('Overall (n={})'.format(len(data)), data[[x] + ys].values)]
+    if hue is not None:
+        groupArrays += [('{} (n={})'.format(group, groupValues.shape[0]), groupValues)
+                        for group, groupValues in _getHueGroupArrays(data, [x] + ys, hue)]
+
+    # one row of results per y and group, of shape (nGroups, len(ys), len(outLabels))
+    results = np.empty((len(groupArrays), len(ys), len(outLabels)))
+    for groupInd, (groupLabel, groupValues) in enumerate(groupArrays):
+        if vectorized:
+            results[groupInd] = np.array([np.asarray(outValues).reshape((-1,))
+                                          for outValues in func(groupValues[:, 0], groupValues[:, 1:])]).T
+        else:
+            for yInd in range(len(ys)):
+                results[groupInd, yInd] = list(func(groupValues[:, 0], groupValues[:, 1 + yInd]))
+
+    index = pd.MultiIndex.from_tuples([(y, groupLabel) for y in ys for groupLabel, _ in groupArrays])
+    return pd.DataFrame(results.transpose((1, 0, 2)).reshape((-1, len(outLabels))), index=index,
+                        columns=list(outLabels))
 
 def getLevelUniques(df, level):
     '''
@@ -52,31 +185,33 @@ def getLevelUniques(df, level):
     return df.index.get_level_values(level).unique()
 
 
-def dfInterHueFunc(data, pars, hue, func, outLabels, kwargsDict={}):
+def dfInterHueFunc(data, pars, hue, func, outLabels, kwargsDict={}, vectorized=False):
     '''
-    Splits each column named in pars into series' depending on hue values. Applies func with these series as argument.
-    Compiles and returns the results as a dataframe with pars as index names and outLabels as column names.
+    Splits each column named in pars into arrays depending on hue values. Applies func with these arrays as argument.
+    Compiles and returns the results as a dataframe with pars as index names and outLabels as column names. <data> is
+    grouped on <hue> only once and the values of all pars of each group are extracted as one 2D array.
     :param data: pandas dataframe
     :param pars: iterable strings, valid labels of columns of data
     :param hue: string, valid label of a column of data. The column with 'class labels'
-    :param func: a function which takes data[hue].unique().size number of arguments
+    :param func: a function which takes data[hue].unique().size number of arguments, one np.ndarray per hue value in
+    the sorted order of hue values. If <vectorized> is False, it is called once per par with arrays of shape
+    (nRowsOfHue,). If <vectorized> is True, it is called only once with arrays of shape (nRowsOfHue, len(pars)) and
+    must return an iterable of the same size as outLabels with arrays of shape (len(pars),), like scipy tests with
+    axis=0, e.g., lambda x, y: ttest_ind(x, y, equal_var=False)
     :param outLabels: iterable of strings, corresponding to the return values of func
+    :param kwargsDict: dict, keyword arguments of func
+    :param vectorized: bool, see <func>
     :return: pandas dataframe
     '''
 
-    hueGroupedData = data.groupby(hue)
-    hueGroupedDFs = {hue: hueDF for hue, hueDF in hueGroupedData}
-
-    allDFs = []
-
-    for par in pars:
-
-        df = pd.DataFrame({'{}'.format(par): func(*[hueDF[par] for hueDF in hueGroupedDFs.itervalues()], **kwargsDict)},
-                          index=outLabels).T
-        allDFs.append(df)
-
-    return pd.concat(allDFs, axis=0)
-
-
+    pars = list(pars)
+    hueArrays = [hueValues for hueValue, hueValues in _getHueGroupArrays(data, pars, hue)]
 
+    if vectorized:
+        results = np.array([np.asarray(outValues).reshape((-1,)) for outValues in func(*hueArrays, **kwargsDict)]).T
+    else:
+        results = np.array([list(func(*[hueValues[:, parInd] for hueValues in hueArrays], **kwargsDict))
+                            for parInd in range(len(pars))])
 
+    return pd.DataFrame(results.reshape((len(pars), len(outLabels))), index=['{}'.format(par) for par in pars],
+                        columns=list(outLabels))
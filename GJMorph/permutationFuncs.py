@@ -0,0 +1,346 @@
+'''
+This file contains functions for permutation tests of the difference between two groups of neurons, e.g., Forager and
+Newly Emerged, in every voxel of a voxel length matrix (see GJMorph.voxelMatrixFuncs), with control of the family wise
+error rate (FWER) over all voxels.
+
+Group labels are permuted within strata, e.g., within the neurons registered to the same initial reference
+("initRefs"), so that the permutations respect the structure of the data. The voxel statistics of all voxels are
+computed for many permutations at once using matrix products, which also work on scipy.sparse matrices without making
+them dense. Permutations are processed in chunks, each with its own random generator spawned from one
+np.random.SeedSequence, so that results are reproducible and do not depend on the number of processes used.
+
+Cluster based inference (see clusterPermutationTest) groups voxels whose statistics exceed a threshold into clusters of
+face connected voxels and tests the masses of the clusters against the permutation distribution of the largest cluster
+mass.
+'''
+
+import functools
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from GJMorph.batchFuncs import runBatch
+from GJMorph.voxelFuncs import getFaceNeighbourPairs
+
+
+# **********************************************************************************************************************
+def _weightedRowSums(weights, values):
+    '''
+    Returns weights . values for dense or sparse <values>, as a dense array.
+    :param weights: np.ndarray of shape (nSets, nRows)
+    :param values: np.ndarray or scipy.sparse matrix of shape (nRows, nColumns)
+    :return: np.ndarray of shape (nSets, nColumns)
+    '''
+
+    if sparse.issparse(values):
+        return np.asarray(values.T.dot(weights.T)).T
+    else:
+        return weights.dot(values)
+
+
+def getGroupStatistics(values, isGroup1, statistic="t"):
+    '''
+    Calculates a statistic of the difference between two groups of rows of <values> in every column of <values>, for
+    several assignments of rows to groups at once.
+    :param values: np.ndarray or scipy.sparse matrix of shape (nRows, nColumns), e.g. a voxel length matrix
+    :param isGroup1: np.ndarray of bools of shape (nAssignments, nRows) or (nRows,), True for rows of group 1 and False
+    for rows of group 2
+    :param statistic: "t" for the Welch t-statistic or "meanDiff" for the difference of means, of "group1 - group2"
+    :return: np.ndarray of shape (nAssignments, nColumns) or (nColumns,). Columns for which the statistic is not finite,
+    e.g., columns with zero variance in both groups, are NaN.
+    '''
+
+    assert statistic in ["t", "meanDiff"], "statistic must be one of 't' or 'meanDiff'"
+
+    isGroup1 = np.asarray(isGroup1, dtype=bool)
+    singleAssignment = isGroup1.ndim == 1
+    isGroup1 = isGroup1.reshape((-1, isGroup1.shape[-1]))
+    weights1 = isGroup1.astype(np.float64)
+    weights2 = 1 - weights1
+    N1 = weights1.sum(axis=1)[:, None]
+    N2 = weights2.sum(axis=1)[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means1 = _weightedRowSums(weights1, values) / N1
+        means2 = _weightedRowSums(weights2, values) / N2
+        if statistic == "meanDiff":
+            stats = means1 - means2
+        else:
+            squares = values.multiply(values) if sparse.issparse(values) else values ** 2
+            vars1 = np.maximum(_weightedRowSums(weights1, squares) / N1 - means1 ** 2, 0) * N1 / (N1 - 1)
+            vars2 = np.maximum(_weightedRowSums(weights2, squares) / N2 - means2 ** 2, 0) * N2 / (N2 - 1)
+            stats = (means1 - means2) / np.sqrt(vars1 / N1 + vars2 / N2)
+
+    stats[~np.isfinite(stats)] = np.nan
+
+    if singleAssignment:
+        return stats[0]
+    else:
+        return stats
+
+
+def permuteWithinStrata(isGroup1, strataCodes, nPermutations, rng):
+    '''
+    Returns <nPermutations> random permutations of the group labels <isGroup1>, each label being permuted only among
+    the rows with the same stratum code.
+    :param isGroup1: np.ndarray of bools of shape (nRows,)
+    :param strataCodes: np.ndarray of ints of shape (nRows,), one code per stratum
+    :param nPermutations: int
+    :param rng: np.random.Generator
+    :return: np.ndarray of bools of shape (nPermutations, nRows)
+    '''
+
+    # sorting random keys offset by the stratum codes shuffles the rows within each stratum
+    stratumOrder = np.argsort(strataCodes, kind="mergesort")
+    shuffledOrder = np.argsort(strataCodes[None, :] + rng.random((nPermutations, strataCodes.shape[0])), axis=1)
+    permuted = np.empty((nPermutations, strataCodes.shape[0]), dtype=bool)
+    permuted[:, stratumOrder] = isGroup1[shuffledOrder]
+
+    return permuted
+
+
+def getMaxAbsStatistics(stats):
+    '''
+    Returns the maximum absolute statistic of each row of <stats>, ignoring NaNs.
+    :param stats: np.ndarray of shape (nPermutations, nColumns)
+    :return: np.ndarray of shape (nPermutations,)
+    '''
+
+    return np.nanmax(np.concatenate((np.abs(stats), np.zeros((stats.shape[0], 1))), axis=1), axis=1)
+
+
+def _permutationNullChunk(values, isGroup1, strataCodes, nPermutations, seed, statistic, nullFunc):
+    '''
+    Generates <nPermutations> permutations of <isGroup1> within strata using a random generator seeded with <seed>,
+    and returns nullFunc applied to the statistics of all permutations. Run by the processes of runPermutationNull.
+    '''
+
+    permuted = permuteWithinStrata(isGroup1, strataCodes, nPermutations, np.random.default_rng(seed))
+    return nullFunc(getGroupStatistics(values, permuted, statistic))
+
+
+def runPermutationNull(values, isGroup1, strata=None, nPermutations=1000, statistic="t", nullFunc=getMaxAbsStatistics,
+                       seed=None, nCPU=1, chunkSize=100):
+    '''
+    Builds a permutation null distribution of a function of the statistics of all columns of <values>, e.g., of the
+    maximum absolute statistic over all voxels. Group labels are permuted within strata, in chunks of <chunkSize>
+    permutations, on a pool of <nCPU> processes.
+    :param values: np.ndarray or scipy.sparse matrix of shape (nRows, nColumns), e.g. a voxel length matrix
+    :param isGroup1: iterable of bools of size nRows, True for rows of group 1 and False for rows of group 2
+    :param strata: iterable of size nRows, labels of the strata within which group labels are permuted. If None, all
+    rows form one stratum.
+    :param nPermutations: int, number of permutations
+    :param statistic: see getGroupStatistics
+    :param nullFunc: picklable function, i.e., defined at the top level of a module or a functools.partial of one,
+    mapping the array of statistics of shape (nPerm, nColumns) of a chunk of permutations to an array with nPerm rows.
+    :param seed: None, int or np.random.SeedSequence. If None, fresh entropy is used.
+    :param nCPU: int, number of processes to use
+    :param chunkSize: int, number of permutations generated with each spawned seed and processed at once
+    :return: np.ndarray with nPermutations rows, the values of nullFunc for all permutations
+    '''
+
+    isGroup1 = np.asarray(isGroup1, dtype=bool)
+    assert values.shape[0] == isGroup1.shape[0], "isGroup1 must have one entry per row of values"
+    if strata is None:
+        strataCodes = np.zeros(isGroup1.shape[0], dtype=np.int64)
+    else:
+        strataCodes = np.unique(np.asarray(strata), return_inverse=True)[1].reshape((-1,))
+    assert strataCodes.shape[0] == isGroup1.shape[0], "strata must have one entry per row of values"
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    chunkSizes = [min(chunkSize, nPermutations - start) for start in range(0, nPermutations, chunkSize)]
+    argsList = [(values, isGroup1, strataCodes, nPerm, chunkSeed, statistic, nullFunc)
+                for nPerm, chunkSeed in zip(chunkSizes, seed.spawn(len(chunkSizes)))]
+
+    results, failures = runBatch(_permutationNullChunk, argsList, nCPU=nCPU, chunkSize=1)
+    if failures:
+        raise RuntimeError("Permutations failed:\n{}".format(failures[0][1]))
+
+    return np.concatenate(results, axis=0)
+
+
+def permutationMaxStatTest(values, isGroup1, strata=None, nPermutations=1000, statistic="t", seed=None, nCPU=1,
+                           chunkSize=100):
+    '''
+    Tests the difference between two groups of rows of <values> in each of its columns, e.g., between Forager and
+    Newly Emerged neurons in each voxel, using a permutation test with group labels permuted within <strata>. The
+    p-values are adjusted for the family wise error rate over all columns using the permutation distribution of the
+    maximum absolute statistic over columns (Westfall & Young, 1993; Nichols & Holmes, 2002).
+    :param values: np.ndarray or scipy.sparse matrix of shape (nRows, nColumns), e.g. a voxel length matrix
+    :param isGroup1: iterable of bools of size nRows, True for rows of group 1 and False for rows of group 2
+    :param strata: see runPermutationNull
+    :param nPermutations: int, number of permutations
+    :param statistic: see getGroupStatistics
+    :param seed: see runPermutationNull
+    :param nCPU: int, number of processes to use
+    :param chunkSize: see runPermutationNull
+    :return: observedStats, fwerPVals, maxNull
+    observedStats: np.ndarray of shape (nColumns,), statistics of "group1 - group2"
+    fwerPVals: np.ndarray of shape (nColumns,), FWER adjusted p-values, NaN where the statistic is NaN
+    maxNull: np.ndarray of shape (nPermutations,), maximum absolute statistics of the permutations
+    '''
+
+    observedStats = getGroupStatistics(values, isGroup1, statistic)
+    maxNull = runPermutationNull(values, isGroup1, strata, nPermutations, statistic, getMaxAbsStatistics, seed, nCPU,
+                                 chunkSize)
+
+    return observedStats, getPermutationPValues(np.abs(observedStats), maxNull), maxNull
+
+
+def getPermutationPValues(observedValues, null):
+    '''
+    Returns the fraction of permutations whose value in <null> is at least each of <observedValues>, counting the
+    observed labelling as one of the permutations.
+    :param observedValues: np.ndarray, e.g. absolute statistics or cluster masses
+    :param null: np.ndarray of shape (nPermutations,)
+    :return: np.ndarray of the shape of <observedValues>, NaN where <observedValues> is NaN
+    '''
+
+    nExceeding = null.shape[0] - np.searchsorted(np.sort(null), observedValues, side="left")
+    pVals = (nExceeding + 1) / float(null.shape[0] + 1)
+    pVals[np.isnan(observedValues)] = np.nan
+
+    return pVals
+
+
+
+def labelClusters(stats, neighbourPairs, threshold):
+    '''
+    Labels clusters of voxels with statistics above <threshold> and, separately, of voxels with statistics below
+    -<threshold>, two voxels being in the same cluster if they are connected through neighbouring voxels of the same
+    sign. Clusters of all rows of <stats> are found using one connected components search on a graph containing the
+    voxels of all rows.
+    :param stats: np.ndarray of shape (nSets, nVoxels) or (nVoxels,), statistics of voxels, NaNs are never in clusters
+    :param neighbourPairs: tuple (rows1, rows2) of np.ndarrays of int, pairs of indices of neighbouring voxels, see
+    GJMorph.voxelFuncs.getFaceNeighbourPairs
+    :param threshold: float, positive cluster forming threshold
+    :return: labels, clusterMasses, clusterSets
+    labels: np.ndarray of int64 of the same shape as <stats>, cluster of each voxel, -1 for voxels not in a cluster.
+    Clusters are numbered consecutively over all rows.
+    clusterMasses: np.ndarray of shape (nClusters,), sum of the absolute statistics of the voxels of each cluster
+    clusterSets: np.ndarray of int64 and shape (nClusters,), row of <stats> of each cluster
+    '''
+
+    stats = np.asarray(stats, dtype=np.float64)
+    singleSet = stats.ndim == 1
+    stats = stats.reshape((-1, stats.shape[-1]))
+    nSets, nVoxels = stats.shape
+    rows1, rows2 = (np.asarray(x, dtype=np.int64) for x in neighbourPairs)
+
+    with np.errstate(invalid="ignore"):
+        signs = (stats > threshold).astype(np.int8) - (stats < -threshold).astype(np.int8)
+
+    isConnected = (signs[:, rows1] != 0) & (signs[:, rows1] == signs[:, rows2])
+    edgeSets, edgePairs = np.nonzero(isConnected)
+    nodes1 = edgeSets * nVoxels + rows1[edgePairs]
+    nodes2 = edgeSets * nVoxels + rows2[edgePairs]
+    graph = sparse.coo_matrix((np.ones(nodes1.shape[0], dtype=np.int8), (nodes1, nodes2)),
+                              shape=(nSets * nVoxels, nSets * nVoxels))
+    components = csgraph.connected_components(graph, directed=False)[1]
+
+    isInCluster = signs.reshape((-1,)) != 0
+    clusterIDs, labelsInClusters = np.unique(components[isInCluster], return_inverse=True)
+    labels = np.full(nSets * nVoxels, -1, dtype=np.int64)
+    labels[isInCluster] = labelsInClusters.reshape((-1,))
+
+    clusterMasses = np.bincount(labels[isInCluster], weights=np.abs(stats.reshape((-1,))[isInCluster]),
+                                minlength=clusterIDs.shape[0])
+    clusterSets = np.zeros(clusterIDs.shape[0], dtype=np.int64)
+    clusterSets[labels[isInCluster]] = np.flatnonzero(isInCluster) // nVoxels
+
+    if singleSet:
+        return labels, clusterMasses, clusterSets
+    else:
+        return labels.reshape((nSets, nVoxels)), clusterMasses, clusterSets
+
+
+def getMaxClusterMasses(stats, neighbourPairs, threshold):
+    '''
+    Returns the largest cluster mass of each row of <stats>, 0 for rows without clusters. See labelClusters.
+    :return: np.ndarray of shape (nSets,)
+    '''
+
+    stats = np.asarray(stats, dtype=np.float64).reshape((-1, np.shape(stats)[-1]))
+    labels, clusterMasses, clusterSets = labelClusters(stats, neighbourPairs, threshold)
+    maxClusterMasses = np.zeros(stats.shape[0])
+    np.maximum.at(maxClusterMasses, clusterSets, clusterMasses)
+
+    return maxClusterMasses
+
+
+def clusterPermutationTest(values, isGroup1, voxelKeys, threshold, strata=None, nPermutations=1000, statistic="t",
+                           seed=None, nCPU=1, chunkSize=100):
+    '''
+    Cluster based permutation test of the difference between two groups of rows of <values> (Maris & Oostenveld, 2007).
+    Voxels whose statistics exceed <threshold> in absolute value are grouped into clusters of face connected voxels
+    with statistics of the same sign, and each cluster is assigned the sum of the absolute statistics of its voxels as
+    mass. The p-value of a cluster is the fraction of permutations, with group labels permuted within <strata>, whose
+    largest cluster mass is at least the mass of the cluster, which controls the family wise error rate over clusters.
+    :param values: np.ndarray or scipy.sparse matrix of shape (nRows, nVoxels), e.g. a voxel length matrix
+    :param isGroup1: iterable of bools of size nRows, True for rows of group 1 and False for rows of group 2
+    :param voxelKeys: np.ndarray of int64 and shape (nVoxels,), voxel keys of one grid size of the columns of <values>
+    :param threshold: float, positive cluster forming threshold of the statistic
+    :param strata: see runPermutationNull
+    :param nPermutations: int, number of permutations
+    :param statistic: see getGroupStatistics
+    :param seed: see runPermutationNull
+    :param nCPU: int, number of processes to use
+    :param chunkSize: see runPermutationNull
+    :return: observedStats, clusterLabels, clusterMasses, clusterPVals, maxNull
+    observedStats: np.ndarray of shape (nVoxels,), statistics of "group1 - group2"
+    clusterLabels: np.ndarray of int64 and shape (nVoxels,), cluster of each voxel, -1 for voxels not in a cluster
+    clusterMasses, clusterPVals: np.ndarrays of shape (nClusters,), mass and FWER adjusted p-value of each cluster
+    maxNull: np.ndarray of shape (nPermutations,), largest cluster masses of the permutations
+    '''
+
+    assert threshold > 0, "threshold must be positive"
+    assert values.shape[1] == np.shape(voxelKeys)[0], "voxelKeys must have one entry per column of values"
+
+    neighbourPairs = getFaceNeighbourPairs(voxelKeys)
+    observedStats = getGroupStatistics(values, isGroup1, statistic)
+    clusterLabels, clusterMasses, clusterSets = labelClusters(observedStats, neighbourPairs, threshold)
+
+    nullFunc = functools.partial(getMaxClusterMasses, neighbourPairs=neighbourPairs, threshold=threshold)
+    maxNull = runPermutationNull(values, isGroup1, strata, nPermutations, statistic, nullFunc, seed, nCPU, chunkSize)
+
+    return observedStats, clusterLabels, clusterMasses, getPermutationPValues(clusterMasses, maxNull), maxNull
+
+
+def getMaxAbsStatisticsAndClusterMasses(stats, neighbourPairs, threshold):
+    '''
+    Returns the maximum absolute statistic and the largest cluster mass of each row of <stats>, see getMaxAbsStatistics
+    and getMaxClusterMasses.
+    :return: np.ndarray of shape (nSets, 2)
+    '''
+
+    return np.stack((getMaxAbsStatistics(stats), getMaxClusterMasses(stats, neighbourPairs, threshold)), axis=1)
+
+
+def maxStatClusterPermutationTest(values, isGroup1, voxelKeys, threshold, strata=None, nPermutations=1000,
+                                  statistic="t", seed=None, nCPU=1, chunkSize=100):
+    '''
+    Does the tests of permutationMaxStatTest and clusterPermutationTest using the same permutations, generated and
+    processed only once. Results are equal to those of the two functions called with the same <seed>.
+    :params: see clusterPermutationTest
+    :return: observedStats, fwerPVals, clusterLabels, clusterMasses, clusterPVals, maxStatNull, maxClusterMassNull
+    fwerPVals, maxStatNull: see permutationMaxStatTest
+    observedStats, clusterLabels, clusterMasses, clusterPVals: see clusterPermutationTest
+    maxClusterMassNull: np.ndarray of shape (nPermutations,), largest cluster masses of the permutations
+    '''
+
+    assert threshold > 0, "threshold must be positive"
+    assert values.shape[1] == np.shape(voxelKeys)[0], "voxelKeys must have one entry per column of values"
+
+    neighbourPairs = getFaceNeighbourPairs(voxelKeys)
+    observedStats = getGroupStatistics(values, isGroup1, statistic)
+    clusterLabels, clusterMasses, clusterSets = labelClusters(observedStats, neighbourPairs, threshold)
+
+    nullFunc = functools.partial(getMaxAbsStatisticsAndClusterMasses, neighbourPairs=neighbourPairs,
+                                 threshold=threshold)
+    nulls = runPermutationNull(values, isGroup1, strata, nPermutations, statistic, nullFunc, seed, nCPU, chunkSize)
+    maxStatNull, maxClusterMassNull = nulls[:, 0], nulls[:, 1]
+
+    return observedStats, getPermutationPValues(np.abs(observedStats), maxStatNull), clusterLabels, clusterMasses, \
+        getPermutationPValues(clusterMasses, maxClusterMassNull), maxStatNull, maxClusterMassNull
+
+# **********************************************************************************************************************
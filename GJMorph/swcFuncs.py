@@ -0,0 +1,318 @@
+'''
+This file contains a compact, numpy array backed container for SWC morphologies and functions for reading SWC files
+into it. Parsed SWC files are cached in binary form (see SWCCache), so that every SWC text file needs to be parsed only
+once.
+
+The default cache is stored in the directory given by the environment variable GJMORPH_SWC_CACHE_DIR, or if it is not
+set, in "~/.cache/GJMorph/swc". It can be turned off by setting the environment variable GJMORPH_SWC_CACHE to "0" or by
+setting "defaultSWCCache.enabled = False".
+'''
+
+import numpy as np
+import os
+import hashlib
+import logging
+
+
+# **********************************************************************************************************************
+class SWCMorphology(object):
+    '''
+    Compact representation of the nodes of an SWC file. Every column of the SWC data is stored as a numpy array and the
+    row of the parent of every node is precomputed, so that parent lookups do not require searching node IDs. The row
+    order of the SWC data is preserved.
+    Attributes:
+    ids: np.ndarray of int64, shape (nRows,), node IDs
+    types: np.ndarray of int64, shape (nRows,), node types
+    xyz: np.ndarray of float64, shape (nRows, 3), node coordinates
+    radius: np.ndarray of float64, shape (nRows,), node radii
+    parentIDs: np.ndarray of int64, shape (nRows,), parent IDs as in the SWC data
+    parentRows: np.ndarray of int64, shape (nRows,), row of the parent of every node. -1 for roots (negative parent
+    IDs) and for nodes whose parent ID is not present in the data.
+    '''
+
+    def __init__(self, swcData):
+        '''
+        :param swcData: np.ndarray of shape (nRows, 7) with each row containing
+        (node ID, node type, x, y, z, r, parent ID)
+        '''
+
+        swcData = np.asarray(swcData, dtype=np.float64)
+        if swcData.ndim == 1:
+            swcData = swcData.reshape((1, -1))
+        assert swcData.ndim == 2 and swcData.shape[1] >= 7, 'swcData must be an array of shape (nRows, 7)'
+
+        self.ids = swcData[:, 0].astype(np.int64)
+        self.types = swcData[:, 1].astype(np.int64)
+        self.xyz = swcData[:, 2:5]
+        self.radius = swcData[:, 5]
+        self.parentIDs = swcData[:, 6].astype(np.int64)
+
+        self._sortOrder = np.argsort(self.ids, kind='mergesort')
+        self._sortedIDs = self.ids[self._sortOrder]
+
+        self.parentRows = self.getRows(self.parentIDs)
+        self.parentRows[self.parentIDs < 0] = -1
+
+    @classmethod
+    def fromFile(cls, swcFile):
+        '''
+        Reads an SWC file, using the default SWC cache, and returns its SWCMorphology.
+        :param swcFile: string, path of an SWC file
+        :return: SWCMorphology
+        '''
+
+        return cls(loadSWCData(swcFile))
+
+    def __len__(self):
+
+        return self.ids.shape[0]
+
+    @property
+    def shape(self):
+
+        return (len(self), 7)
+
+    def getRows(self, ids):
+        '''
+        Returns the rows of the nodes with IDs <ids>. -1 is returned for IDs not present in the data.
+        :param ids: int or iterable of ints
+        :return: np.ndarray of int64 of the same shape as <ids>
+        '''
+
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self._sortedIDs, ids)
+        positions = np.minimum(positions, max(len(self) - 1, 0))
+        if len(self):
+            found = self._sortedIDs[positions] == ids
+            return np.where(found, self._sortOrder[positions], -1)
+        else:
+            return np.full(ids.shape, -1, dtype=np.int64)
+
+    def getRow(self, nodeID):
+        '''
+        Returns the row of the node with ID <nodeID>, -1 if it is not present in the data.
+        :param nodeID: int
+        :return: int
+        '''
+
+        return int(self.getRows(nodeID))
+
+    def getSegmentRows(self):
+        '''
+        Returns the rows of the end points of all segments, i.e., of all nodes with positive parent IDs whose parent is
+        present in the data, and of their parents. These are the segments whose lengths add up to the total length
+        returned by GJMorph.auxFuncs.resampleSWC.
+        :return: childRows, parentRows, np.ndarrays of int64 and shape (nSegments,)
+        '''
+
+        childRows = np.flatnonzero((self.parentIDs > 0) & (self.parentRows >= 0))
+        return childRows, self.parentRows[childRows]
+
+    def asArray(self):
+        '''
+        Returns the SWC data as an array of shape (nRows, 7) with each row containing
+        (node ID, node type, x, y, z, r, parent ID)
+        :return: np.ndarray of float64
+        '''
+
+        return np.column_stack((self.ids, self.types, self.xyz, self.radius, self.parentIDs)).astype(np.float64)
+
+    def __array__(self, dtype=None, copy=None):
+
+        swcArray = self.asArray()
+        if dtype is not None:
+            swcArray = swcArray.astype(dtype)
+        return swcArray
+
+# **********************************************************************************************************************
+
+
+def asSWCMorphology(swcData=None, swcFile=None):
+    '''
+    Returns <swcData> as an SWCMorphology. If <swcData> is None, <swcFile> is read.
+    :param swcData: None, SWCMorphology or array-like of shape (nRows, 7)
+    :param swcFile: string, path of an SWC file. Used only when swcData is None
+    :return: SWCMorphology
+    '''
+
+    if isinstance(swcData, SWCMorphology):
+        return swcData
+    elif swcData is None:
+        assert swcFile is not None, 'One of swcData or swcFile must be specified'
+        return SWCMorphology.fromFile(swcFile)
+    else:
+        return SWCMorphology(swcData)
+
+# **********************************************************************************************************************
+
+
+class SWCCache(object):
+    '''
+    Cache of parsed SWC files stored as .npy files, which are loaded using memory mapping. Entries are keyed by the
+    absolute path, modification time and size of the SWC file, so that modified SWC files are parsed again. When the
+    total size of the cache directory exceeds <maxBytes>, least recently used entries are deleted.
+    '''
+
+    def __init__(self, cacheDir=None, maxBytes=2 * 1024 ** 3, enabled=True):
+        '''
+        :param cacheDir: string, directory in which cache files are stored. If None, cache files are stored in a
+        directory called ".swcCache" next to each SWC file.
+        :param maxBytes: int, maximum total size in bytes of the cache files in a cache directory
+        :param enabled: bool, when False, SWC files are always parsed and nothing is written to the cache
+        '''
+
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.enabled = enabled
+
+    def getCacheFile(self, swcFile):
+        '''
+        Returns the path of the cache file corresponding to the current state of <swcFile>.
+        :param swcFile: string, path of an SWC file
+        :return: string
+        '''
+
+        swcFile = os.path.abspath(swcFile)
+        swcStat = os.stat(swcFile)
+        keyStr = "{}|{}|{}".format(swcFile, swcStat.st_mtime, swcStat.st_size)
+        key = hashlib.sha1(keyStr.encode("utf-8")).hexdigest()
+
+        if self.cacheDir is None:
+            cacheDir = os.path.join(os.path.dirname(swcFile), ".swcCache")
+        else:
+            cacheDir = self.cacheDir
+
+        return os.path.join(cacheDir, "{}.npy".format(key))
+
+    def load(self, swcFile):
+        '''
+        Returns the SWC data in <swcFile> as an array of shape (nRows, 7), read only and memory mapped if it was
+        found in the cache. SWC files not found in the cache are parsed and added to it.
+        :param swcFile: string, path of an SWC file
+        :return: np.ndarray
+        '''
+
+        if not self.enabled:
+            return _parseSWC(swcFile)
+
+        cacheFile = self.getCacheFile(swcFile)
+
+        if os.path.isfile(cacheFile):
+            try:
+                swcData = np.load(cacheFile, mmap_mode="r")
+                # modification time of cache files records their last use
+                os.utime(cacheFile, None)
+                return swcData
+            except (IOError, OSError, ValueError) as e:
+                logging.warning("Could not read SWC cache file {} ({}), parsing {}".format(cacheFile, e, swcFile))
+
+        swcData = _parseSWC(swcFile)
+        self._store(cacheFile, swcData)
+
+        return swcData
+
+    def _store(self, cacheFile, swcData):
+
+        cacheDir = os.path.dirname(cacheFile)
+        tempFile = "{}.{}.tmp.npy".format(cacheFile[:-4], os.getpid())
+        try:
+            if not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir)
+            np.save(tempFile, swcData)
+            os.rename(tempFile, cacheFile)
+        except (IOError, OSError) as e:
+            logging.warning("Could not write SWC cache file {} ({})".format(cacheFile, e))
+            return
+
+        self.evict(cacheDir)
+
+    def evict(self, cacheDir=None):
+        '''
+        Deletes least recently used cache files from <cacheDir> until their total size is at most self.maxBytes.
+        :param cacheDir: string, cache directory. Defaults to self.cacheDir.
+        :return:
+        '''
+
+        if cacheDir is None:
+            cacheDir = self.cacheDir
+        if cacheDir is None or not os.path.isdir(cacheDir):
+            return
+
+        entries = []
+        for fle in os.listdir(cacheDir):
+            if fle.endswith(".npy") and not fle.endswith(".tmp.npy"):
+                fleStat = os.stat(os.path.join(cacheDir, fle))
+                entries.append((fleStat.st_mtime, fleStat.st_size, fle))
+
+        totalBytes = sum(x[1] for x in entries)
+        for mtime, size, fle in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(cacheDir, fle))
+                totalBytes -= size
+            except OSError:
+                pass
+
+    def clear(self, cacheDir=None):
+        '''
+        Deletes all cache files from <cacheDir>.
+        :param cacheDir: string, cache directory. Defaults to self.cacheDir.
+        :return:
+        '''
+
+        maxBytes = self.maxBytes
+        self.maxBytes = 0
+        try:
+            self.evict(cacheDir)
+        finally:
+            self.maxBytes = maxBytes
+
+# **********************************************************************************************************************
+
+
+def _parseSWC(swcFile):
+
+    return np.loadtxt(swcFile, ndmin=2)
+
+
+defaultSWCCache = SWCCache(cacheDir=os.environ.get("GJMORPH_SWC_CACHE_DIR",
+                                                   os.path.join(os.path.expanduser("~"), ".cache", "GJMorph", "swc")),
+                           enabled=os.environ.get("GJMORPH_SWC_CACHE", "1") != "0")
+
+
+def loadSWCData(swcFile, cache=None):
+    '''
+    Returns the data in <swcFile> as an array of shape (nRows, 7) with each row containing
+    (node ID, node type, x, y, z, r, parent ID). Replacement for np.loadtxt(swcFile) which uses an SWCCache.
+    The returned array may be a read only memory map.
+    :param swcFile: string, path of an SWC file
+    :param cache: SWCCache to use, defaults to defaultSWCCache
+    :return: np.ndarray
+    '''
+
+    if cache is None:
+        cache = defaultSWCCache
+
+    return cache.load(swcFile)
+
+
+def readSWCHeader(swcFile):
+    '''
+    Returns the header of <swcFile>, i.e., the concatenation of its leading comment lines without the leading "#".
+    Only the header lines are read.
+    :param swcFile: string, path of an SWC file
+    :return: string
+    '''
+
+    headr = ''
+    with open(swcFile, 'r') as fle:
+        for line in fle:
+            if line.startswith('#'):
+                headr += line[1:]
+            elif line.strip():
+                break
+
+    return headr
+
+# **********************************************************************************************************************
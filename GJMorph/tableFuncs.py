@@ -0,0 +1,305 @@
+'''
+This file contains functions for reading and writing tables (pandas.DataFrames) in a format chosen by the extension of
+the file name, so that scripts passing tables to each other can use columnar formats instead of Excel:
+
+".parquet", ".pq": Apache Parquet, typed and compressed columns, index is preserved. Requires pyarrow.
+".feather", ".arrow": Feather (Arrow IPC), typed and compressed columns, fast to read and write. Requires pyarrow.
+".csv", ".csv.gz": comma separated values, optionally gzip compressed
+".xlsx", ".xls": Excel, limited to 1048576 rows, mainly for inspecting results
+
+Like DataFrame.to_excel, writeTable writes the index of a table as its first column for Feather, CSV and Excel files,
+so that such tables are read back with readTable(..., indexCol=0). Parquet files store the index separately and restore
+it on reading, <indexCol> is ignored for them. Tables too large to be held in memory can be written chunk by chunk into
+Parquet or CSV files with TableChunkWriter and read partially with the <filters> of readTable.
+'''
+
+import operator
+import numpy as np
+import pandas as pd
+
+
+_tableFormats = {".parquet": "parquet", ".pq": "parquet",
+                 ".feather": "feather", ".arrow": "feather",
+                 ".csv": "csv", ".csv.gz": "csv",
+                 ".xlsx": "excel", ".xls": "excel"}
+
+_excelMaxRows = 1048576
+
+_filterOperators = {"==": operator.eq, "=": operator.eq, "!=": operator.ne,
+                    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+                    "in": lambda series, values: series.isin(values),
+                    "not in": lambda series, values: ~series.isin(values)}
+
+
+# **********************************************************************************************************************
+def getTableFormat(tableFile):
+    '''
+    Returns the format of <tableFile> given by its extension.
+    :param tableFile: string, path of a table file
+    :return: string, one of "parquet", "feather", "csv" and "excel"
+    '''
+
+    lowerFile = str(tableFile).lower()
+    for extension in sorted(_tableFormats, key=len, reverse=True):
+        if lowerFile.endswith(extension):
+            return _tableFormats[extension]
+
+    raise ValueError("Unknown table format of {}, use one of the extensions {}".format(tableFile,
+                                                                                      sorted(_tableFormats)))
+
+
+def isTableFile(tableFile):
+    '''
+    Returns whether <tableFile> has the extension of one of the supported table formats.
+    :param tableFile: string
+    :return: bool
+    '''
+
+    try:
+        getTableFormat(tableFile)
+        return True
+    except ValueError:
+        return False
+
+
+def getOutputTableFile(outBase, defaultExtension=".xlsx"):
+    '''
+    Returns <outBase> if it ends with the extension of a supported table format, else "<outBase><defaultExtension>".
+    Allows scripts writing "<outBase>.xlsx" to write other formats when given e.g. "<outBase>.parquet".
+    :param outBase: string
+    :param defaultExtension: string
+    :return: string
+    '''
+
+    if isTableFile(outBase):
+        return outBase
+    else:
+        return "{}{}".format(outBase, defaultExtension)
+
+# **********************************************************************************************************************
+
+
+def _getFeatherColumnNames(tableFile):
+
+    from pyarrow import ipc
+    with ipc.open_file(tableFile) as reader:
+        return reader.schema.names
+
+
+def _applyDtypes(df, dtypes):
+
+    if dtypes is None:
+        return df
+    presentDtypes = {column: dtype for column, dtype in dtypes.items()
+                     if column in df.columns and df[column].dtype != dtype}
+    return df.astype(presentDtypes) if presentDtypes else df
+
+
+def _restoreParquetCategoricals(df, tableFile):
+
+    # Parquet stores only string dictionaries, categorical columns with e.g. float categories are read back with the
+    # dtype of their categories although the pandas metadata of the file records them as categorical
+    from pyarrow import parquet
+    pandasMetadata = parquet.read_schema(tableFile).pandas_metadata or {}
+    categoricalColumns = [x["name"] for x in pandasMetadata.get("columns", []) if x["pandas_type"] == "categorical"]
+    return _applyDtypes(df, {column: "category" for column in categoricalColumns
+                             if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+
+def _getFilterConjunctions(filters):
+
+    # a list of tuples is one conjunction, a list of lists of tuples a disjunction of conjunctions
+    return [filters] if isinstance(filters[0], tuple) else filters
+
+
+def _getFilterColumns(filters):
+
+    if not filters:
+        return []
+    return [column for conjunction in _getFilterConjunctions(filters) for column, operator, value in conjunction]
+
+
+def _applyFilters(df, filters):
+
+    if not filters:
+        return df
+
+    mask = np.zeros(df.shape[0], dtype=bool)
+    for conjunction in _getFilterConjunctions(filters):
+        conjunctionMask = np.ones(df.shape[0], dtype=bool)
+        for column, operator, value in conjunction:
+            assert operator in _filterOperators, "Unknown filter operator {}, use one of {}".format(
+                operator, sorted(_filterOperators))
+            conjunctionMask &= np.asarray(_filterOperators[operator](df[column], value), dtype=bool)
+        mask |= conjunctionMask
+
+    return df.loc[mask, :]
+
+
+def readTable(tableFile, columns=None, indexCol=None, dtypes=None, filters=None, **kwargs):
+    '''
+    Reads the table in <tableFile>, in the format given by its extension.
+    :param tableFile: string, path of a table file
+    :param columns: None or list of column names, if not None, only these columns (and the index) are returned. For
+    Parquet and Feather files, only these columns are read from the file.
+    :param indexCol: None, int or string, position or name of the column to use as index, like index_col of
+    pandas.read_excel. Ignored for Parquet files.
+    :param dtypes: None or dict, mapping column names to dtypes, e.g. "category" or np.float32, columns not in the table
+    are ignored. Parquet and Feather files keep the dtypes they were written with, so that converting is only needed for
+    tables written with other dtypes. Categorical columns of Parquet files whose categories are not strings, e.g. "voxel
+    size", are restored with the categories occurring in the rows read. CSV and Excel files are parsed directly into these dtypes, except for categorical
+    columns, which are converted after parsing so that their categories keep the parsed types, e.g. floats.
+    :param filters: None or list of (column, operator, value) tuples, only rows satisfying all of them are returned, or
+    a list of such lists, only rows satisfying all tuples of any of the lists are returned. Operators are "==", "!=",
+    "<", "<=", ">", ">=", "in" and "not in", e.g. [("initRefs", "==", "ref_1"), ("voxel key", ">=", 10)], like the
+    filters of pyarrow. For Parquet files, row groups whose statistics exclude the filters are not read, e.g. those of
+    other neurons in tables written by TableChunkWriter. Other formats are filtered after reading.
+    :param kwargs: further keyword arguments of the pandas reader of the format
+    :return: pandas.DataFrame
+    '''
+
+    tableFormat = getTableFormat(tableFile)
+
+    if tableFormat == "parquet":
+        if filters:
+            kwargs["filters"] = filters
+        df = pd.read_parquet(tableFile, columns=None if columns is None else list(columns), **kwargs)
+        return _applyDtypes(_restoreParquetCategoricals(df, tableFile), dtypes)
+
+    if tableFormat == "feather":
+        indexName = None
+        if indexCol is not None:
+            indexName = _getFeatherColumnNames(tableFile)[indexCol] if isinstance(indexCol, int) else indexCol
+        readColumns = None
+        if columns is not None:
+            readColumns = ([] if indexName is None or indexName in columns else [indexName]) + list(columns)
+            readColumns += [x for x in _getFilterColumns(filters) if x not in readColumns]
+        df = _applyFilters(pd.read_feather(tableFile, columns=readColumns, **kwargs), filters)
+        if indexName is not None:
+            df = df.set_index(indexName)
+            # unnamed indices are written as the column "index", see writeTable
+            if indexName == "index":
+                df.index.name = None
+        if columns is not None:
+            df = df.loc[:, list(columns)]
+        return _applyDtypes(df, dtypes)
+
+    parseDtypes = None if dtypes is None else {column: dtype for column, dtype in dtypes.items()
+                                               if not (isinstance(dtype, str) and dtype == "category")}
+    if tableFormat == "csv":
+        df = pd.read_csv(tableFile, index_col=indexCol, dtype=parseDtypes, **kwargs)
+    else:
+        df = pd.read_excel(tableFile, index_col=indexCol, dtype=parseDtypes, **kwargs)
+
+    df = _applyFilters(df, filters)
+
+    if columns is not None:
+        df = df.loc[:, list(columns)]
+
+    return _applyDtypes(df, dtypes)
+
+
+def writeTable(df, tableFile, index=True, compression="zstd", **kwargs):
+    '''
+    Writes <df> into <tableFile>, in the format given by its extension.
+    :param df: pandas.DataFrame
+    :param tableFile: string, path of the table file
+    :param index: bool, whether to write the index of <df>
+    :param compression: string, compression of Parquet and Feather files, e.g. "zstd", "snappy" or "lz4". Ignored for
+    other formats, CSV files are gzip compressed when their name ends with ".gz".
+    :param kwargs: further keyword arguments of the pandas writer of the format
+    :return:
+    '''
+
+    tableFormat = getTableFormat(tableFile)
+
+    if tableFormat == "parquet":
+        df.to_parquet(tableFile, index=index, compression=compression, **kwargs)
+    elif tableFormat == "feather":
+        # Feather files cannot store indices, the index is written as the first column
+        (df.reset_index() if index else df.reset_index(drop=True)).to_feather(tableFile, compression=compression,
+                                                                               **kwargs)
+    elif tableFormat == "csv":
+        df.to_csv(tableFile, index=index, **kwargs)
+    else:
+        if df.shape[0] + 1 > _excelMaxRows:
+            raise ValueError("{} rows cannot be written into the Excel file {}, use a file ending with \".parquet\" "
+                             "or \".feather\" instead".format(df.shape[0], tableFile))
+        df.to_excel(tableFile, index=index, **kwargs)
+
+# **********************************************************************************************************************
+
+
+class TableChunkWriter(object):
+    '''
+    Writes a table chunk by chunk, so that a table too large to be held in memory can be written while its rows are
+    generated. Parquet files are written with pyarrow.parquet.ParquetWriter, each chunk as one row group, whose column
+    statistics allow readTable to skip chunks not matching its <filters>. CSV files are appended to. Feather and Excel
+    files cannot be written in chunks. All chunks must have the same columns and dtypes; categorical columns must have
+    the same categories in all chunks. Like writeTable, rows are numbered continuously over all chunks, in the first
+    column of CSV files and as the default index restored on reading Parquet files. Use as a context manager:
+
+    with TableChunkWriter("table.parquet") as writer:
+        for chunkDF in chunkDFs:
+            writer.write(chunkDF)
+    '''
+
+    def __init__(self, tableFile, compression="zstd"):
+        '''
+        :param tableFile: string, path of a Parquet or CSV file
+        :param compression: string, compression of Parquet files, ignored for CSV files, see writeTable
+        '''
+
+        self.tableFile = tableFile
+        self.tableFormat = getTableFormat(tableFile)
+        if self.tableFormat not in ["parquet", "csv"]:
+            raise ValueError("{} cannot be written in chunks, use a file ending with \".parquet\" or \".csv\" "
+                             "instead".format(tableFile))
+        self.compression = compression
+        self.nRows = 0
+        self._parquetWriter = None
+        self._schema = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+
+        self.close()
+
+    def write(self, df):
+        '''
+        Appends the rows of <df> to the table. The index of <df> is not written.
+        :param df: pandas.DataFrame
+        :return:
+        '''
+
+        if self.tableFormat == "parquet":
+            import pyarrow
+            from pyarrow import parquet
+            if self._parquetWriter is None:
+                table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema
+                self._parquetWriter = parquet.ParquetWriter(self.tableFile, self._schema,
+                                                            compression=self.compression)
+            else:
+                table = pyarrow.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._parquetWriter.write_table(table)
+        else:
+            chunkDF = df.set_axis(pd.RangeIndex(self.nRows, self.nRows + df.shape[0]), axis=0)
+            chunkDF.to_csv(self.tableFile, mode="w" if self.nRows == 0 else "a", header=self.nRows == 0)
+
+        self.nRows += df.shape[0]
+
+    def close(self):
+        '''
+        Finishes writing the table.
+        :return:
+        '''
+
+        if self._parquetWriter is not None:
+            self._parquetWriter.close()
+            self._parquetWriter = None
+
+# **********************************************************************************************************************
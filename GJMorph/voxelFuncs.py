@@ -0,0 +1,426 @@
+'''
+This file contains functions for dividing space into cubic voxels and for representing voxels with integer keys.
+
+Voxels are cubes of side <gridSize> constructed so that there is a voxel with center at the origin. If a
+translationIndicator (three members, each 0 or 1) is specified, the voxels are translated so that a voxel has a center at
+- translationIndicator * gridSize * 0.5 (see GJMorph.auxFuncs.windowSWCPts). A voxel with integer index ijk therefore
+has its center at (2 * ijk - translationIndicator) * gridSize * 0.5, i.e., voxel centers of all eight translated grids lie
+on a common lattice with spacing gridSize * 0.5, the "half voxel lattice". Voxel keys are int64 values into which the
+three half voxel lattice coordinates of voxel centers are packed. Keys are thus unique across the eight translated grids
+of one grid size, and the translation of a voxel is given by the parity of its half voxel lattice coordinates. The grid
+size itself is not part of the key and needs to be stored alongside, e.g., in the column "voxel size" of a DataFrame.
+
+Each coordinate is stored in 17 bits, so that keys are smaller than 2 ** 51 and survive round trips through formats
+storing numbers as double precision floats, like Excel.
+
+Points can also be quantized once into "half voxel cells", cubes of side gridSize * 0.5 with a corner at the origin. Each
+half voxel cell lies in exactly one voxel of each of the eight translated grids, so that the voxels of all eight grids
+can be derived from the half voxel cells using integer arithmetic (see halfVoxelCellsToVoxelKeys). Since half voxel
+cells of a grid size nest within those of any integer multiple of it, the same holds for voxels of coarser grids, which
+allows computing voxel lengths for several grid sizes from one pass over a fine base grid (see
+accumulateVoxelLengthPyramid).
+'''
+
+import itertools
+import numpy as np
+
+
+_keyBitsPerAxis = 17
+_keyCoordOffset = 2 ** (_keyBitsPerAxis - 1)
+_keyCoordMask = 2 ** _keyBitsPerAxis - 1
+
+
+# **********************************************************************************************************************
+def getVoxelIndices(points, gridSize, translationIndicator=(0, 0, 0)):
+    '''
+    Returns the integer indices of the voxels containing <points>. Voxels are half open, i.e., points on the boundary
+    between two voxels are assigned to the voxel with the larger index.
+    :param points: np.ndarray of shape (nRows, 3)
+    :param gridSize: float
+    :param translationIndicator: three member iterable of 0s and 1s
+    :return: np.ndarray of int64 and shape (nRows, 3)
+    '''
+
+    # equal to floor((points + translationIndicator * gridSize * 0.5) / gridSize + 0.5), but computed from the half
+    # voxel cells of points, so that points on voxel boundaries are assigned consistently with
+    # accumulateOverlappingVoxelLengths
+    halfVoxelCells = getHalfVoxelCells(points, gridSize)
+    return (halfVoxelCells + 1 + np.asarray(translationIndicator, dtype=np.int64)) >> 1
+
+#***********************************************************************************************************************
+
+
+def packVoxelKeys(halfLatticeCoords):
+    '''
+    Packs half voxel lattice coordinates of voxel centers into int64 voxel keys.
+    :param halfLatticeCoords: np.ndarray of integers and shape (nRows, 3)
+    :return: np.ndarray of int64 and shape (nRows,)
+    '''
+
+    halfLatticeCoords = np.asarray(halfLatticeCoords, dtype=np.int64).reshape((-1, 3))
+    if halfLatticeCoords.shape[0] and (np.abs(halfLatticeCoords).max() >= _keyCoordOffset):
+        raise ValueError("Voxel coordinates exceed the range representable by voxel keys, use a larger voxel size")
+
+    shifted = halfLatticeCoords + _keyCoordOffset
+    return (shifted[:, 0] << (2 * _keyBitsPerAxis)) | (shifted[:, 1] << _keyBitsPerAxis) | shifted[:, 2]
+
+
+def unpackVoxelKeys(keys):
+    '''
+    Inverse of packVoxelKeys.
+    :param keys: np.ndarray of int64 and shape (nRows,)
+    :return: np.ndarray of int64 and shape (nRows, 3), half voxel lattice coordinates of voxel centers
+    '''
+
+    keys = np.asarray(keys, dtype=np.int64).reshape((-1,))
+    halfLatticeCoords = np.empty((keys.shape[0], 3), dtype=np.int64)
+    halfLatticeCoords[:, 0] = (keys >> (2 * _keyBitsPerAxis)) & _keyCoordMask
+    halfLatticeCoords[:, 1] = (keys >> _keyBitsPerAxis) & _keyCoordMask
+    halfLatticeCoords[:, 2] = keys & _keyCoordMask
+    return halfLatticeCoords - _keyCoordOffset
+
+#***********************************************************************************************************************
+
+
+def getVoxelKeys(points, gridSize, translationIndicator=(0, 0, 0)):
+    '''
+    Returns the keys of the voxels containing <points>.
+    :param points: np.ndarray of shape (nRows, 3)
+    :param gridSize: float
+    :param translationIndicator: three member iterable of 0s and 1s
+    :return: np.ndarray of int64 and shape (nRows,)
+    '''
+
+    voxelIndices = getVoxelIndices(points, gridSize, translationIndicator)
+    return packVoxelKeys(2 * voxelIndices - np.asarray(translationIndicator, dtype=np.int64))
+
+
+def voxelKeysToIndices(keys):
+    '''
+    Returns the voxel indices and translation indicators of the voxels represented by <keys>.
+    :param keys: np.ndarray of int64 and shape (nRows,)
+    :return: voxelIndices, translationIndicators, both np.ndarray of int64 and shape (nRows, 3)
+    '''
+
+    halfLatticeCoords = unpackVoxelKeys(keys)
+    translationIndicators = halfLatticeCoords & 1
+    return (halfLatticeCoords + translationIndicators) // 2, translationIndicators
+
+
+def voxelKeysToCenters(keys, gridSize):
+    '''
+    Returns the centers of the voxels represented by <keys>.
+    :param keys: np.ndarray of int64 and shape (nRows,)
+    :param gridSize: float
+    :return: np.ndarray of float64 and shape (nRows, 3), rounded to 6 digits
+    '''
+
+    return np.round(unpackVoxelKeys(keys) * (gridSize * 0.5), 6)
+
+
+def getVoxelKeyRange(xMin, xMax, gridSize):
+    '''
+    Returns the smallest and largest voxel key of voxels of size <gridSize> with centers whose X coordinate is within
+    [<xMin>, <xMax>]. As X is the most significant part of voxel keys, exactly these voxels have keys in this range, so
+    that slabs of voxels can be selected with filters on the column "voxel key", e.g. when reading parts of tables
+    (see GJMorph.tableFuncs.readTable).
+    :param xMin: float
+    :param xMax: float
+    :param gridSize: float
+    :return: minKey, maxKey; ints
+    '''
+
+    halfGridSize = gridSize * 0.5
+    maxCoord = _keyCoordOffset - 1
+    halfXMin = int(np.clip(np.ceil(np.round(xMin / halfGridSize, 6)), -maxCoord, maxCoord))
+    halfXMax = int(np.clip(np.floor(np.round(xMax / halfGridSize, 6)), -maxCoord, maxCoord))
+    minKey, maxKey = packVoxelKeys([[halfXMin, -maxCoord, -maxCoord], [halfXMax, maxCoord, maxCoord]])
+    return int(minKey), int(maxKey)
+
+#***********************************************************************************************************************
+
+
+def sumByKey(keys, weights):
+    '''
+    Sums <weights> over equal <keys>.
+    :param keys: np.ndarray of int64 and shape (nRows,)
+    :param weights: np.ndarray of floats and shape (nRows,)
+    :return: uniqueKeys, sums, np.ndarrays of shape (nUniqueKeys,), uniqueKeys sorted in ascending order
+    '''
+
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+    return uniqueKeys, np.bincount(inverse.reshape((-1,)), weights=weights, minlength=uniqueKeys.shape[0])
+
+
+def accumulateVoxelLengths(points, lengths, gridSize, translationIndicator=(0, 0, 0)):
+    '''
+    Sums <lengths> over the voxels containing <points>.
+    :param points: np.ndarray of shape (nRows, 3), e.g. branch centers returned by GJMorph.auxFuncs.resampleSWC
+    :param lengths: np.ndarray of shape (nRows,), e.g. branch lengths returned by GJMorph.auxFuncs.resampleSWC
+    :param gridSize: float
+    :param translationIndicator: three member iterable of 0s and 1s
+    :return: voxelKeys, voxelLengths, np.ndarrays of shape (nVoxels,)
+    '''
+
+    return sumByKey(getVoxelKeys(points, gridSize, translationIndicator), lengths)
+
+#***********************************************************************************************************************
+
+
+def getHalfVoxelCells(points, gridSize):
+    '''
+    Returns the integer indices of the half voxel cells, cubes of side <gridSize> * 0.5 with a corner at the origin,
+    containing <points>.
+    :param points: np.ndarray of shape (nRows, 3)
+    :param gridSize: float
+    :return: np.ndarray of int64 and shape (nRows, 3)
+    '''
+
+    return np.floor(np.asarray(points) * (2.0 / gridSize)).astype(np.int64)
+
+
+def halfVoxelCellsToVoxelKeys(halfVoxelCells, translationIndicator=(0, 0, 0), factor=1):
+    '''
+    Returns the keys of the voxels containing the half voxel cells <halfVoxelCells>. A voxel with index ijk contains
+    the half voxel cells 2 * ijk - 1 - translationIndicator and 2 * ijk - translationIndicator along each axis, so that
+    ijk = floor((halfVoxelCell + 1 + translationIndicator) / 2). If <factor> is larger than 1, the keys of the voxels of
+    the grid of size <factor> times the grid size of the half voxel cells are returned, which contain the half voxel cells
+    with ijk = floor((halfVoxelCell + factor * (1 + translationIndicator)) / (2 * factor)).
+    :param halfVoxelCells: np.ndarray of int64 and shape (nRows, 3), as returned by getHalfVoxelCells
+    :param translationIndicator: three member iterable of 0s and 1s
+    :param factor: positive int
+    :return: np.ndarray of int64 and shape (nRows,)
+    '''
+
+    translationIndicator = np.asarray(translationIndicator, dtype=np.int64)
+    voxelIndices = (np.asarray(halfVoxelCells, dtype=np.int64) + factor * (1 + translationIndicator)) // (2 * factor)
+    return packVoxelKeys(2 * voxelIndices - translationIndicator)
+
+
+def accumulateOverlappingVoxelLengths(points, lengths, gridSize, translationIndicators=None):
+    '''
+    Sums <lengths> over the voxels containing <points> for several translated grids at once. Points are quantized only
+    once, into half voxel cells, and lengths are summed per half voxel cell. The voxels of each translated grid are
+    then derived from the, usually much fewer, occupied half voxel cells.
+    :param points: np.ndarray of shape (nRows, 3), e.g. branch centers returned by GJMorph.auxFuncs.resampleSWC
+    :param lengths: np.ndarray of shape (nRows,), e.g. branch lengths returned by GJMorph.auxFuncs.resampleSWC
+    :param gridSize: float
+    :param translationIndicators: list of three member iterables of 0s and 1s. Defaults to all eight translations.
+    :return: voxelKeys, voxelLengths, np.ndarrays of shape (nVoxels,), with the voxels of the translated grids in the
+    order of <translationIndicators>
+    '''
+
+    if translationIndicators is None:
+        translationIndicators = list(itertools.product([0, 1], [0, 1], [0, 1]))
+
+    voxelKeys, voxelLengths, factors = _accumulateHalfVoxelCellLengths(getHalfVoxelCells(points, gridSize), lengths,
+                                                                       translationIndicators)
+    return voxelKeys, voxelLengths
+
+
+def _accumulateHalfVoxelCellLengths(halfVoxelCells, lengths, translationIndicators, factors=(1,)):
+    '''
+    Sums <lengths> per half voxel cell and then over the voxels containing the occupied half voxel cells, for each
+    combination of grid size factor and translated grid.
+    :return: voxelKeys, voxelLengths, voxelFactors, np.ndarrays of shape (nVoxels,), voxelFactors containing the grid
+    size factor of each voxel
+    '''
+
+    cellKeys, cellLengths = sumByKey(packVoxelKeys(halfVoxelCells), lengths)
+    halfVoxelCells = unpackVoxelKeys(cellKeys)
+
+    voxelKeys = []
+    voxelLengths = []
+    voxelFactors = []
+    for factor in factors:
+        for translationIndicator in translationIndicators:
+            keys, sums = sumByKey(halfVoxelCellsToVoxelKeys(halfVoxelCells, translationIndicator, factor), cellLengths)
+            voxelKeys.append(keys)
+            voxelLengths.append(sums)
+            voxelFactors.append(np.full(keys.shape, factor, dtype=np.int64))
+
+    return np.concatenate(voxelKeys), np.concatenate(voxelLengths), np.concatenate(voxelFactors)
+
+#***********************************************************************************************************************
+
+
+def clipSegmentsToHalfVoxelCells(starts, ends, gridSize):
+    '''
+    Splits the straight line segments from <starts> to <ends> at the boundaries of the half voxel cells they pass
+    through (3D DDA traversal, all segments at once) and returns the exact length of each piece and the half voxel
+    cell containing it.
+    :param starts: np.ndarray of shape (nSegments, 3)
+    :param ends: np.ndarray of shape (nSegments, 3)
+    :param gridSize: float
+    :return: halfVoxelCells, lengths, np.ndarrays of shapes (nPieces, 3) and (nPieces,). The lengths of the pieces of
+    each segment add up to the length of the segment.
+    '''
+
+    starts = np.asarray(starts, dtype=np.float64).reshape((-1, 3))
+    ends = np.asarray(ends, dtype=np.float64).reshape((-1, 3))
+    nSegments = starts.shape[0]
+    cellSize = gridSize * 0.5
+    segVecs = ends - starts
+    segLens = np.sqrt((segVecs ** 2).sum(axis=1))
+
+    # line parameters in (0, 1) at which segments cross the boundary planes of half voxel cells, along each axis
+    startCells = getHalfVoxelCells(starts, gridSize)
+    endCells = getHalfVoxelCells(ends, gridSize)
+    segInds = [np.arange(nSegments)]
+    params = [np.zeros(nSegments)]
+    for axis in range(3):
+        nCrossings = np.abs(endCells[:, axis] - startCells[:, axis])
+        crossingSegInds = np.repeat(np.arange(nSegments), nCrossings)
+        crossingNumbers = np.arange(crossingSegInds.shape[0]) - np.repeat(np.cumsum(nCrossings) - nCrossings,
+                                                                            nCrossings)
+        direction = np.sign(segVecs[crossingSegInds, axis]).astype(np.int64)
+        # first plane crossed is at the upper boundary of the start cell when moving upwards, its lower otherwise
+        planes = startCells[crossingSegInds, axis] + (direction > 0) + direction * crossingNumbers
+        crossingParams = (planes * cellSize - starts[crossingSegInds, axis]) / segVecs[crossingSegInds, axis]
+        segInds.append(crossingSegInds)
+        params.append(np.clip(crossingParams, 0, 1))
+    segInds.append(np.arange(nSegments))
+    params.append(np.ones(nSegments))
+
+    segInds = np.concatenate(segInds)
+    params = np.concatenate(params)
+    order = np.lexsort((params, segInds))
+    segInds = segInds[order]
+    params = params[order]
+
+    # pieces lie between consecutive parameters of the same segment
+    pieceSegInds = segInds[1:]
+    isPiece = (segInds[:-1] == pieceSegInds) & (params[1:] > params[:-1])
+    pieceSegInds = pieceSegInds[isPiece]
+    paramStarts = params[:-1][isPiece]
+    paramEnds = params[1:][isPiece]
+
+    midPoints = starts[pieceSegInds] + (0.5 * (paramStarts + paramEnds))[:, None] * segVecs[pieceSegInds]
+    return getHalfVoxelCells(midPoints, gridSize), (paramEnds - paramStarts) * segLens[pieceSegInds]
+
+
+def accumulateSegmentVoxelLengths(starts, ends, gridSize, translationIndicators=None):
+    '''
+    Sums the exact lengths of the parts of the straight line segments from <starts> to <ends> lying in each voxel, for
+    one or more translated grids. Unlike with accumulateVoxelLengths, segments need not be resampled into pieces much
+    shorter than <gridSize> beforehand.
+    :param starts: np.ndarray of shape (nSegments, 3)
+    :param ends: np.ndarray of shape (nSegments, 3)
+    :param gridSize: float
+    :param translationIndicators: list of three member iterables of 0s and 1s. Defaults to all eight translations.
+    :return: voxelKeys, voxelLengths, np.ndarrays of shape (nVoxels,), with the voxels of the translated grids in the
+    order of <translationIndicators>
+    '''
+
+    if translationIndicators is None:
+        translationIndicators = list(itertools.product([0, 1], [0, 1], [0, 1]))
+
+    halfVoxelCells, lengths = clipSegmentsToHalfVoxelCells(starts, ends, gridSize)
+    voxelKeys, voxelLengths, factors = _accumulateHalfVoxelCellLengths(halfVoxelCells, lengths, translationIndicators)
+    return voxelKeys, voxelLengths
+
+#***********************************************************************************************************************
+
+
+def getGridSizeFactors(gridSizes):
+    '''
+    Returns the smallest of <gridSizes> and the factors by which the others are larger than it.
+    :param gridSizes: iterable of floats, each an integer multiple of the smallest of them
+    :return: baseGridSize, factors; float and list of ints of the same length as <gridSizes>
+    '''
+
+    gridSizes = np.asarray(gridSizes, dtype=np.float64).reshape((-1,))
+    baseGridSize = gridSizes.min()
+    factors = np.round(gridSizes / baseGridSize).astype(np.int64)
+    if not np.allclose(factors * baseGridSize, gridSizes):
+        raise ValueError("Grid sizes {} are not all integer multiples of {}".format(gridSizes.tolist(), baseGridSize))
+
+    return float(baseGridSize), factors.tolist()
+
+
+def _factorsToGridSizes(voxelFactors, gridSizes, factors):
+    '''
+    Returns the member of <gridSizes> corresponding to each of <voxelFactors>. Products of factors and the base grid
+    size can differ from the grid sizes given, e.g. 3 * 0.1 != 0.3, so that the grid sizes given are returned instead.
+    :param voxelFactors: np.ndarray of int64, members of <factors>
+    :param gridSizes: iterable of floats
+    :param factors: list of ints, as returned by getGridSizeFactors(<gridSizes>)
+    :return: np.ndarray of float64 of the shape of <voxelFactors>
+    '''
+
+    factorGridSizes = dict(zip(factors, np.asarray(gridSizes, dtype=np.float64).reshape((-1,))))
+    sortedFactors = np.array(sorted(factorGridSizes), dtype=np.int64)
+    sortedGridSizes = np.array([factorGridSizes[x] for x in sortedFactors], dtype=np.float64)
+    return sortedGridSizes[np.searchsorted(sortedFactors, voxelFactors)]
+
+
+def accumulateVoxelLengthPyramid(points, lengths, gridSizes, translationIndicators=((0, 0, 0),)):
+    '''
+    Sums <lengths> over the voxels containing <points> for several grid sizes at once. Points are quantized only once,
+    into the half voxel cells of the smallest grid size, and lengths of voxels of larger grid sizes are obtained by
+    summing blocks of these half voxel cells.
+    :param points: np.ndarray of shape (nRows, 3), e.g. branch centers returned by GJMorph.auxFuncs.resampleSWC
+    :param lengths: np.ndarray of shape (nRows,), e.g. branch lengths returned by GJMorph.auxFuncs.resampleSWC
+    :param gridSizes: iterable of floats, each an integer multiple of the smallest of them
+    :param translationIndicators: list of three member iterables of 0s and 1s
+    :return: voxelKeys, voxelLengths, voxelSizes, np.ndarrays of shape (nVoxels,), ordered by grid size as in
+    <gridSizes> and then by translation as in <translationIndicators>
+    '''
+
+    baseGridSize, factors = getGridSizeFactors(gridSizes)
+    voxelKeys, voxelLengths, voxelFactors = _accumulateHalfVoxelCellLengths(getHalfVoxelCells(points, baseGridSize),
+                                                                            lengths, translationIndicators, factors)
+    return voxelKeys, voxelLengths, _factorsToGridSizes(voxelFactors, gridSizes, factors)
+
+
+def accumulateSegmentVoxelLengthPyramid(starts, ends, gridSizes, translationIndicators=((0, 0, 0),)):
+    '''
+    Like accumulateVoxelLengthPyramid, but sums the exact lengths of the parts of the straight line segments from
+    <starts> to <ends> lying in each voxel (see accumulateSegmentVoxelLengths). Segments are clipped only once, at the
+    half voxel cells of the smallest grid size.
+    :param starts: np.ndarray of shape (nSegments, 3)
+    :param ends: np.ndarray of shape (nSegments, 3)
+    :param gridSizes: iterable of floats, each an integer multiple of the smallest of them
+    :param translationIndicators: list of three member iterables of 0s and 1s
+    :return: voxelKeys, voxelLengths, voxelSizes, np.ndarrays of shape (nVoxels,)
+    '''
+
+    baseGridSize, factors = getGridSizeFactors(gridSizes)
+    halfVoxelCells, lengths = clipSegmentsToHalfVoxelCells(starts, ends, baseGridSize)
+    voxelKeys, voxelLengths, voxelFactors = _accumulateHalfVoxelCellLengths(halfVoxelCells, lengths,
+                                                                            translationIndicators, factors)
+    return voxelKeys, voxelLengths, _factorsToGridSizes(voxelFactors, gridSizes, factors)
+
+#***********************************************************************************************************************
+
+
+def getFaceNeighbourPairs(keys):
+    '''
+    Returns all pairs of voxels among <keys> that share a face, i.e., voxels of the same translated grid whose indices
+    differ by one along exactly one axis. Voxels of different translated grids overlap instead of sharing faces and are
+    never paired.
+    :param keys: np.ndarray of int64 and shape (nVoxels,), voxel keys of one grid size
+    :return: rows1, rows2; np.ndarrays of int64 and shape (nPairs,), indices into <keys> of the two voxels of each pair
+    '''
+
+    keys = np.asarray(keys, dtype=np.int64).reshape((-1,))
+    sortOrder = np.argsort(keys, kind="mergesort")
+    sortedKeys = keys[sortOrder]
+    halfLatticeCoords = unpackVoxelKeys(keys)
+
+    rows1 = []
+    rows2 = []
+    for axis in range(3):
+        # the next voxel of the same translated grid along an axis is two half voxel lattice steps away
+        neighbourCoords = halfLatticeCoords.copy()
+        neighbourCoords[:, axis] += 2
+        inRange = (np.abs(neighbourCoords) < _keyCoordOffset).all(axis=1)
+        neighbourKeys = packVoxelKeys(neighbourCoords[inRange])
+        positions = np.minimum(np.searchsorted(sortedKeys, neighbourKeys), max(keys.shape[0] - 1, 0))
+        found = sortedKeys[positions] == neighbourKeys
+        rows1.append(np.flatnonzero(inRange)[found])
+        rows2.append(sortOrder[positions[found]])
+
+    return np.concatenate(rows1), np.concatenate(rows2)
+
+#***********************************************************************************************************************
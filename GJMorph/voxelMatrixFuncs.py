@@ -0,0 +1,200 @@
+'''
+This file contains functions for storing the dendritic lengths of a set of neurons in a set of voxels as a sparse matrix
+with one row per neuron and one column per voxel, and for reading it back.
+
+Voxels (columns) are identified by their voxel key (see GJMorph.voxelFuncs) together with their voxel size, so that
+matrices can contain voxels of several voxel sizes. Neurons (rows) are described by a pandas.DataFrame of meta data
+with one row per neuron, e.g., with the columns "Experiment ID", "Labor State" and "initRefs".
+
+Matrices are saved as .npz files containing the arrays of the CSR representation of the matrix ("data", "indices",
+"indptr", "shape"), the arrays "voxel keys" and "voxel sizes" with one entry per column, and the meta data with one
+array per column, named "meta:<column name>".
+'''
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+_metaDataPrefix = "meta:"
+
+# label columns of the tables generated by scripts/lengthDistDiffScales/generateRawDF.py
+rawDFLabelColumns = ['set name', 'expID', 'initRefs']
+
+
+# **********************************************************************************************************************
+def buildVoxelLengthMatrix(voxelKeysList, voxelLengthsList, voxelSizesList):
+    '''
+    Builds a sparse matrix with one row per neuron and one column per voxel from the voxel lengths of each neuron.
+    Lengths of repeated voxels of a neuron are summed.
+    :param voxelKeysList: list of np.ndarrays of int64, voxel keys, one array per neuron
+    :param voxelLengthsList: list of np.ndarrays of float, lengths in the voxels of <voxelKeysList>, one per neuron
+    :param voxelSizesList: list of np.ndarrays of float, voxel sizes of the voxels of <voxelKeysList>, one per neuron
+    :return: matrix, voxelKeys, voxelSizes
+    matrix: scipy.sparse.csr_matrix of shape (nNeurons, nVoxels)
+    voxelKeys, voxelSizes: np.ndarrays of shape (nVoxels,), sorted by voxel size and then voxel key
+    '''
+
+    nVoxelsPerNeuron = [np.shape(x)[0] for x in voxelKeysList]
+    rows = np.repeat(np.arange(len(voxelKeysList)), nVoxelsPerNeuron)
+    allKeys = np.concatenate([np.asarray(x, dtype=np.int64) for x in voxelKeysList]) \
+        if voxelKeysList else np.zeros(0, dtype=np.int64)
+    allLengths = np.concatenate([np.asarray(x, dtype=np.float64) for x in voxelLengthsList]) \
+        if voxelLengthsList else np.zeros(0)
+    allSizes = np.concatenate([np.asarray(x, dtype=np.float64) for x in voxelSizesList]) \
+        if voxelSizesList else np.zeros(0)
+
+    # columns are the unique (voxel size, voxel key) pairs
+    voxelIDs = np.rec.fromarrays((allSizes, allKeys), names=("size", "key"))
+    uniqueVoxelIDs, columns = np.unique(voxelIDs, return_inverse=True)
+
+    matrix = sparse.coo_matrix((allLengths, (rows, columns.reshape((-1,)))),
+                               shape=(len(voxelKeysList), uniqueVoxelIDs.shape[0])).tocsr()
+    matrix.sum_duplicates()
+
+    return matrix, np.asarray(uniqueVoxelIDs["key"], dtype=np.int64), np.asarray(uniqueVoxelIDs["size"])
+
+
+def rawDFToVoxelLengthMatrix(rawDF, metaDataColumns, lengthColumn="percentage neurite length"):
+    '''
+    Converts a table with one row per combination of neuron and voxel, as generated by
+    scripts/lengthDistDiffScales/generateRawDF.py, into a sparse voxel length matrix. Neurons are identified by the
+    values in <metaDataColumns>.
+    :param rawDF: pandas.DataFrame with the columns "voxel key", "voxel size", <lengthColumn> and <metaDataColumns>
+    :param metaDataColumns: list of column names of <rawDF>
+    :param lengthColumn: column name of <rawDF>
+    :return: matrix, voxelKeys, voxelSizes, metaDataDF (see buildVoxelLengthMatrix)
+    '''
+
+    # observed=True: for categorical meta data, only combinations present in <rawDF> are neurons
+    neuronGroups = rawDF.groupby(list(metaDataColumns), sort=True, observed=True)
+    rowIndices = neuronGroups.ngroup().values
+    metaDataDF = neuronGroups.size().index.to_frame(index=False)
+    for column in metaDataDF.columns:
+        if isinstance(metaDataDF[column].dtype, pd.CategoricalDtype):
+            metaDataDF[column] = np.asarray(metaDataDF[column])
+
+    voxelIDs = np.rec.fromarrays((rawDF["voxel size"].values.astype(np.float64),
+                                  rawDF["voxel key"].values.astype(np.int64)), names=("size", "key"))
+    uniqueVoxelIDs, columns = np.unique(voxelIDs, return_inverse=True)
+
+    matrix = sparse.coo_matrix((rawDF[lengthColumn].values.astype(np.float64), (rowIndices, columns.reshape((-1,)))),
+                               shape=(metaDataDF.shape[0], uniqueVoxelIDs.shape[0])).tocsr()
+    matrix.sum_duplicates()
+
+    return matrix, np.asarray(uniqueVoxelIDs["key"], dtype=np.int64), np.asarray(uniqueVoxelIDs["size"]), metaDataDF
+
+
+def getRawDFDtypes(lengthDtype=None):
+    '''
+    Returns the compact dtypes of the columns of the tables generated by scripts/lengthDistDiffScales/generateRawDF.py:
+    "category" for the label columns "set name", "expID" and "initRefs" and for "voxel size", which take only a few
+    distinct values repeated on every row, and int64 for "voxel key". To be used with GJMorph.tableFuncs.readTable or
+    compactRawDF.
+    :param lengthDtype: None or numpy float dtype, e.g. np.float32, dtype of the column "percentage neurite length". If
+    None, the column is left out and keeps the dtype it has.
+    :return: dict, mapping column names to dtypes
+    '''
+
+    dtypes = {column: "category" for column in rawDFLabelColumns}
+    dtypes["voxel size"] = "category"
+    dtypes["voxel key"] = np.int64
+    if lengthDtype is not None:
+        dtypes["percentage neurite length"] = np.dtype(lengthDtype)
+
+    return dtypes
+
+
+def compactRawDF(rawDF, lengthDtype=None):
+    '''
+    Converts the columns of <rawDF> to the dtypes returned by getRawDFDtypes(<lengthDtype>). Columns not in <rawDF>
+    are ignored.
+    :param rawDF: pandas.DataFrame, as generated by scripts/lengthDistDiffScales/generateRawDF.py
+    :param lengthDtype: see getRawDFDtypes
+    :return: pandas.DataFrame
+    '''
+
+    dtypes = {column: dtype for column, dtype in getRawDFDtypes(lengthDtype).items() if column in rawDF.columns}
+    return rawDF.astype(dtypes)
+
+# **********************************************************************************************************************
+
+
+def saveVoxelLengthMatrix(outFile, matrix, voxelKeys, voxelSizes, metaDataDF):
+    '''
+    Saves a voxel length matrix, its voxels and the meta data of its neurons into the .npz file <outFile>.
+    :param outFile: string, path of the output file, ".npz" is appended if it does not end with it
+    :param matrix: scipy.sparse matrix of shape (nNeurons, nVoxels)
+    :param voxelKeys: np.ndarray of int64 and shape (nVoxels,)
+    :param voxelSizes: np.ndarray of float and shape (nVoxels,)
+    :param metaDataDF: pandas.DataFrame with nNeurons rows
+    :return:
+    '''
+
+    matrix = sparse.csr_matrix(matrix)
+    assert matrix.shape[1] == len(voxelKeys) == len(voxelSizes), "voxelKeys and voxelSizes must have one entry per " \
+                                                                 "column of matrix"
+    assert matrix.shape[0] == metaDataDF.shape[0], "metaDataDF must have one row per row of matrix"
+
+    arrays = {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr,
+              "shape": np.array(matrix.shape), "voxel keys": np.asarray(voxelKeys, dtype=np.int64),
+              "voxel sizes": np.asarray(voxelSizes, dtype=np.float64)}
+    for col in metaDataDF.columns:
+        arrays[_metaDataPrefix + str(col)] = np.asarray(metaDataDF[col].values.astype(str), dtype=str)
+    # preserves the column order of the meta data
+    arrays["meta columns"] = np.array([str(x) for x in metaDataDF.columns], dtype=str)
+
+    np.savez_compressed(outFile, **arrays)
+
+
+def loadVoxelLengthMatrix(npzFile):
+    '''
+    Reads a voxel length matrix saved with saveVoxelLengthMatrix.
+    :param npzFile: string, path of an .npz file
+    :return: matrix, voxelKeys, voxelSizes, metaDataDF
+    matrix: scipy.sparse.csr_matrix of shape (nNeurons, nVoxels)
+    voxelKeys, voxelSizes: np.ndarrays of shape (nVoxels,)
+    metaDataDF: pandas.DataFrame with one row per neuron, all values are strings
+    '''
+
+    with np.load(npzFile, allow_pickle=False) as npz:
+        matrix = sparse.csr_matrix((npz["data"], npz["indices"], npz["indptr"]), shape=tuple(npz["shape"]))
+        metaDataDF = pd.DataFrame({col: npz[_metaDataPrefix + col] for col in npz["meta columns"]},
+                                  columns=list(npz["meta columns"]))
+        return matrix, npz["voxel keys"], npz["voxel sizes"], metaDataDF
+
+
+def iterDenseColumnBlocks(matrix, blockSize=1000):
+    '''
+    Yields the columns of <matrix> as dense arrays, <blockSize> columns at a time, so that the whole matrix never needs
+    to be held in memory densely. Zeros not stored in the sparse matrix are filled in.
+    :param matrix: scipy.sparse matrix of shape (nRows, nColumns)
+    :param blockSize: int, number of columns per block
+    :return: generator of tuples (columnStart, block), where block is np.ndarray of shape (nRows, <= blockSize)
+    containing the columns columnStart, columnStart + 1, ...
+    '''
+
+    # column slicing is cheap in compressed sparse column format
+    matrix = sparse.csc_matrix(matrix)
+    for columnStart in range(0, matrix.shape[1], blockSize):
+        yield columnStart, matrix[:, columnStart: columnStart + blockSize].toarray()
+
+
+def getColumnMeans(matrix, storedOnly=False):
+    '''
+    Returns the mean of every column of <matrix>.
+    :param matrix: scipy.sparse matrix
+    :param storedOnly: bool, if True, only the entries stored in the sparse matrix are averaged, i.e., in the case of a
+    voxel length matrix, only the neurons with lengths in a voxel. Otherwise, unstored entries count as zeros.
+    :return: np.ndarray of shape (nColumns,)
+    '''
+
+    matrix = sparse.csc_matrix(matrix)
+    columnSums = np.asarray(matrix.sum(axis=0)).reshape((-1,))
+    if storedOnly:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return columnSums / np.diff(matrix.indptr)
+    else:
+        return columnSums / float(matrix.shape[0])
+
+# **********************************************************************************************************************
@@ -17,10 +17,8 @@ import seaborn as sns
 from GJMorph.matplotlibRCParams import mplPars, openCircleMarker
 import sys
 from scipy.stats import ttest_ind
-from GJMorph.pandasFuncs import dfInterHueFunc
-from GJMorph.customStats import art_two_way_anova
-from statsmodels.formula.api import ols
-from statsmodels.stats.anova import anova_lm
+from GJMorph.pandasFuncs import dfInterHueFunc, RecordBuilder
+from GJMorph.customStats import art_two_way_anova_batch, RWorkerPool, two_way_anova_np
 import warnings
 warnings.filterwarnings(action='once')
 
@@ -47,7 +45,11 @@ def saveData(inXL, dataXL, origin=origin):
     """
     inDF = pd.read_excel(inXL)
 
-    dataDF = pd.DataFrame()
+    dataRecords = RecordBuilder(columns=["Experiment ID", "Labor State", "Bin Center $(\mu m)$",
+                                         "Percentage Dendritic Length", "swc File", "initRefs"],
+                                dtypes={"Bin Center $(\mu m)$": np.float64,
+                                        "Percentage Dendritic Length": np.float64},
+                                nRows=inDF.shape[0] * binCenters.shape[0])
 
     for rowInd, (expId, laborState, initRefs, swcFile) in inDF.iterrows():
 
@@ -56,16 +58,14 @@ def saveData(inXL, dataXL, origin=origin):
         lengths = nm.getLengthVsDistance(radii=binEdges[1:], centeredAt=origin)
         percentageLengths = np.array(lengths) * 100 / float(sum(lengths))
 
-        for binCenter, pcLength in zip(binCenters, percentageLengths):
-            tempS = pd.Series()
-            tempS["Experiment ID"] = expId
-            tempS["Labor State"] = laborState
-            tempS["Bin Center $(\mu m)$"] = binCenter
-            tempS["Percentage Dendritic Length"] = pcLength
-            tempS["swc File"] = swcFile
-            tempS["initRefs"] = initRefs
-            dataDF = dataDF.append(tempS, ignore_index=True)
+        dataRecords.addRecords({"Experiment ID": expId,
+                                "Labor State": laborState,
+                                "Bin Center $(\mu m)$": binCenters,
+                                "Percentage Dendritic Length": percentageLengths,
+                                "swc File": swcFile,
+                                "initRefs": initRefs})
 
+    dataDF = dataRecords.toDataFrame()
     dataDF.to_excel(dataXL)
 
 
@@ -93,16 +93,22 @@ def plotData(dataXL, outFig):
 
     allMaxVal = dataDF["Percentage Dendritic Length"].max()
 
-    signifsForInitRefs = pd.DataFrame()
+    signifRecords = RecordBuilder()
 
-    for binInd, (binCenter, bcDF) in enumerate(dataDF.groupby("Bin Center $(\mu m)$")):
+    # one column per bin, so that the t-tests of all bins of an initial reference are done in one call
+    for initRef, initRefDF in dataDF.groupby("initRefs"):
+        pdlPerBin = initRefDF.pivot_table(index=["swc File", "Labor State"], columns="Bin Center $(\mu m)$",
+                                          values="Percentage Dendritic Length").reset_index(level="Labor State")
+        bins = [x for x in pdlPerBin.columns if x != "Labor State"]
+        currentIRSigs = dfInterHueFunc(pdlPerBin, hue="Labor State", pars=bins,
+                                       func=lambda x, y: ttest_ind(x, y, equal_var=False),
+                                       outLabels=["T-Stat", "P-Value"], vectorized=True)
+        signifRecords.addRecords({"T-Stat": currentIRSigs["T-Stat"].values,
+                                  "P-Value": currentIRSigs["P-Value"].values,
+                                  "Bin Center $(\mu m)$": bins,
+                                  "initRefs": initRef})
 
-        for initRefInd, (initRef, initRefDF) in enumerate(bcDF.groupby("initRefs")):
-            currentIRSigs = dfInterHueFunc(initRefDF, hue="Labor State", pars=["Percentage Dendritic Length"],
-                           func=lambda x, y: ttest_ind(x, y, equal_var=False), outLabels=["T-Stat", "P-Value"])
-            currentIRSigs["Bin Center $(\mu m)$"] = binCenter
-            currentIRSigs["initRefs"] = initRef
-            signifsForInitRefs = signifsForInitRefs.append(currentIRSigs, ignore_index=True)
+    signifsForInitRefs = signifRecords.toDataFrame()
 
     signifsForInitRefs["P-Value Significant?"] = signifsForInitRefs["P-Value"] < 0.05
     withinIRSigsCount = signifsForInitRefs.groupby("Bin Center $(\mu m)$")["P-Value Significant?"].sum()
@@ -174,16 +180,23 @@ def plot2WayAnova(dataXL, outBase):
 
     dataDFR = dataDF.rename(columns=columnTempNames)
 
-    formula = "pdl~C(ls) + C(initRefs) + C(ls):C(initRefs)"
-    statsDF = pd.DataFrame(columns=["C(ls)", "C(initRefs)", "C(ls):C(initRefs)", "F(ls)"])
-
-    for binInd, (binCenter, bcDF) in enumerate(dataDFR.groupby("bin")):
-        model = ols(formula, bcDF).fit()
-        aov_table = anova_lm(model, typ=2)
-        toAppend = aov_table["PR(>F)"][:3]
-        toAppend.name = binCenter
-        toAppend["F(ls)"] = aov_table.loc["C(ls)", "F"]
-        statsDF = statsDF.append(toAppend)
+    # one row per bin and one column per neuron registered with one initRefs, the same Experiment ID occurs once
+    # per initRefs. Bins containing the same neurons share the design of the two-way ANOVA of
+    # "pdl~C(ls) + C(initRefs) + C(ls):C(initRefs)" and are tested at once
+    pdlPerBin = dataDFR.pivot_table(index="bin", columns=["initRefs", "ls", "Experiment ID"], values="pdl",
+                                    aggfunc="first")
+    statsDF = pd.DataFrame(index=pdlPerBin.index, columns=["C(ls)", "C(initRefs)", "C(ls):C(initRefs)", "F(ls)"],
+                           dtype=float)
+
+    isPresent = pdlPerBin.notnull()
+    for presencePattern, patternDF in isPresent.groupby(list(isPresent.columns)):
+        patternBins = patternDF.index
+        presentNrns = isPresent.columns[list(presencePattern)]
+        fValues, pVals = two_way_anova_np(pdlPerBin.loc[patternBins, presentNrns].values,
+                                          presentNrns.get_level_values("ls").values,
+                                          presentNrns.get_level_values("initRefs").values)
+        statsDF.loc[patternBins, ["C(ls)", "C(initRefs)", "C(ls):C(initRefs)"]] = pVals
+        statsDF.loc[patternBins, "F(ls)"] = fValues[:, 0]
 
     alpha = 0.05
     boniferriCorrectedAlpha = alpha / statsDF.shape[0]
@@ -217,7 +230,7 @@ def plot2WayAnova(dataXL, outBase):
     fig.savefig("{}.png".format(outBase), dpi=300)
 
 
-def plotART2WayAnova(dataXL, outBase):
+def plotART2WayAnova(dataXL, outBase, nRWorkers=1):
     """
     Performs ART and two-way ANOVA (https://depts.washington.edu/madlab/proj/art/index.html) to determine whether labor
     state affects dendritic length per shell, whether registration initial reference affects dendritic length per shell
@@ -225,6 +238,7 @@ def plotART2WayAnova(dataXL, outBase):
     radius.
     :param dataXL: string, excel file generated by "saveData" function above.
     :param outBase: string, figure will be saved as "<outBase>.png"
+    :param nRWorkers: int, number of R processes used for ART, see GJMorph.customStats.RWorkerPool
     :return:
     """
 
@@ -250,32 +264,34 @@ def plotART2WayAnova(dataXL, outBase):
 
     cumsumDF_reordered = cumsumDF.loc[: , ["bin", "ls", "initRefs", "pdl"]].set_index("bin")
 
-    # initializing a DF for collecting stats
-    statsDF = pd.DataFrame(columns=["pVal(ls)", "pVal(initRefs)", "pVal(ls:initRefs)", "ART correctness", "Using Cumulative distribution over radius?"])
-
-    for binInd, (binCenter, bcDF) in enumerate(reorderedDF.groupby("bin")):
-
-        # Doing stats for distribution of PDL over radius
-        toAppend = pd.Series()
-        toAppend["Using Cumulative distribution over radius?"] = 0
-        toAppend["Bin Center $(\mu m)$"] = binCenter
-        if any(bcDF["pdl"]):
-            toAppend["ART correctness"], (toAppend["pVal(ls)"],
-            toAppend["pVal(initRefs)"], toAppend["pVal(ls:initRefs)"]) = art_two_way_anova(bcDF)
-
-        statsDF = statsDF.append(toAppend, ignore_index=True)
-
-    for binInd, (binCenter, bcDF) in enumerate(cumsumDF_reordered.groupby("bin")):
-
-        # Doing stats for cumulative distribution of PDL over radius
-        toAppend = pd.Series()
-        toAppend["Using Cumulative distribution over radius?"] = 1
-        toAppend["Bin Center $(\mu m)$"] = binCenter
-        if any(bcDF["pdl"]):
-            toAppend["ART correctness"], (toAppend["pVal(ls)"],
-            toAppend["pVal(initRefs)"], toAppend["pVal(ls:initRefs)"]) = art_two_way_anova(bcDF)
-
-        statsDF = statsDF.append(toAppend, ignore_index=True)
+    rWorkerPool = RWorkerPool(int(nRWorkers)) if int(nRWorkers) > 1 else None
+    statsDFs = []
+    for useCumulative, binsDF in [(0, reorderedDF), (1, cumsumDF_reordered)]:
+
+        binsDF = binsDF.reset_index()
+        binCentersWithData = binsDF.groupby("bin")["pdl"].apply(lambda x: any(x))
+        binCentersWithData = binCentersWithData.index[binCentersWithData.values]
+
+        # all bins with data are tested in one call to R, or split among several R processes
+        artInputDF = binsDF.loc[binsDF["bin"].isin(binCentersWithData), ["bin", "ls", "initRefs", "pdl"]]
+        if rWorkerPool is not None:
+            artDF = rWorkerPool.art_two_way_anova_batch(artInputDF)
+        else:
+            artDF = art_two_way_anova_batch(artInputDF)
+        artDF = artDF.reindex(np.unique(binsDF["bin"]))
+
+        statsDFs.append(pd.DataFrame({"pVal(ls)": artDF["pVal(f1)"].values,
+                                      "pVal(initRefs)": artDF["pVal(f2)"].values,
+                                      "pVal(ls:initRefs)": artDF["pVal(f1:f2)"].values,
+                                      "ART correctness": artDF["ART correctness"].values,
+                                      "Using Cumulative distribution over radius?": useCumulative,
+                                      "Bin Center $(\mu m)$": artDF.index.values},
+                                     columns=["pVal(ls)", "pVal(initRefs)", "pVal(ls:initRefs)", "ART correctness",
+                                              "Using Cumulative distribution over radius?", "Bin Center $(\mu m)$"]))
+
+    statsDF = pd.concat(statsDFs, ignore_index=True)
+    if rWorkerPool is not None:
+        rWorkerPool.close()
 
     alpha = 0.05
     bfCorrectedAlpha = 0.05 / dataDF["initRefs"].unique().shape[0]
@@ -339,11 +355,11 @@ def plotART2WayAnova(dataXL, outBase):
 
 if __name__ == "__main__":
 
-    assert len(sys.argv) == 4, "Improper Usage! Please use as on the following:\n" \
+    assert len(sys.argv) in [4, 5], "Improper Usage! Please use as on the following:\n" \
                                "python {currFile} saveData <input XL File> <output XL File> or \n" \
                                "python {currFile} plotData <data XL File> <output PNG File> or \n"  \
                                "python {currFile} plot2WayAnova <data XL File> <outBase>\n" \
-                               "python {currFile} plotART2WayAnova <data XL File> <outBase>".format(
+                               "python {currFile} plotART2WayAnova <data XL File> <outBase> [<nRWorkers>]".format(
                                currFile=sys.argv[0])
 
     if sys.argv[1] == "saveData":
@@ -9,6 +9,7 @@ Note:                   <part> can take values in ["WN", "MB", "VB", "DB"]
 """
 
 from GJMorph.reg2regParNames import Reg2RegParNames
+from GJMorph.pandasFuncs import RecordBuilder
 from regmaxsn.core.misc import parFileCheck
 import pandas as pd
 import os
@@ -49,7 +50,7 @@ def convert(parFile, part, outXL):
 
     parsList = parFileCheck(parFile, Reg2RegParNames)
 
-    outDF = pd.DataFrame()
+    outRecords = RecordBuilder()
 
     for pars in parsList:
 
@@ -66,8 +67,9 @@ def convert(parFile, part, outXL):
             tempS["Experiment ID"] = expID
             tempS["swcFile"] = swcFile
             tempS["initRefs"] = os.path.split(pars["resDir"])[1]
-            outDF = outDF.append(tempS, ignore_index=True)
+            outRecords.addRecord(tempS)
 
+    outDF = outRecords.toDataFrame()
     outDF.to_excel(outXL, index=False)
 
 
@@ -3,16 +3,20 @@ Description:        This script is used to calculate the total dendritic length
                     row for every combination of SWC and voxel. Meta data such as Labor State, initRefs, swcFile and
                     Experiment ID are also saved.
 
-Usage:              python calcTDLWN.py <inputXL> <outputXL>
+Usage:              python calcTDLWN.py <inputXL> <outputXL> [<nCPU>]
                     <inputXL>: string containing the path of an excel file with the columns "Experiment ID",
                     "Labor State", "initRefs" and "swcFile".
-                    <voxel size>: string, which represents a float, the desired size of the voxels
-                    <outputXL>: string, path where the output excel file will be written.
+                    <outputXL>: string, path where the output excel file will be written. Parquet, Feather or CSV
+                    files are written instead if it ends with ".parquet", ".feather" or ".csv"
+                    (see GJMorph.tableFuncs).
+                    <nCPU>: optional, number of processes used to process SWCs in parallel. Defaults to 1.
 '''
 
 import itertools
 import pandas as pd
 from GJMorph.auxFuncs import resampleSWC, windowSWCPts
+from GJMorph.batchFuncs import iterBatch
+from GJMorph.tableFuncs import readTable, writeTable
 from regmaxsn.core.misc import parFileCheck
 import numpy as np
 import os
@@ -22,33 +26,42 @@ import sys
 
 
 
-def calcTDLWN(inputXL, outputXL, resampleLength=1):
+def getTDL(swcFile, resampleLength=1):
 
-    inputDF = pd.read_excel(inputXL)
+    tdl, _ = resampleSWC(swcFile, resampleLength)
+    return tdl
 
-    outputDF = inputDF.copy()
 
-    for rowInd, (expId, laborState, initRefs, swcFile) in inputDF.iterrows():
+def calcTDLWN(inputXL, outputXL, resampleLength=1, nCPU=1):
+
+    inputDF = readTable(inputXL)
+
+    outputDF = inputDF.copy()
 
+    for swcFile in inputDF["swcFile"]:
         assert swcFile.endswith("WN.swc"), "calcTDLWN can only work with WN subregion, {} specified".format(swcFile)
-        print("Doing {}".format(swcFile))
 
-        tdl,_ = resampleSWC(swcFile, resampleLength)
+    argsList = [(swcFile, resampleLength) for swcFile in inputDF["swcFile"]]
+    for rowInd, (swcFile, success, tdl) in zip(inputDF.index, iterBatch(getTDL, argsList,
+                                                                          labels=inputDF["swcFile"].tolist(),
+                                                                          nCPU=nCPU)):
+        print("Done {}".format(swcFile) if success else "Failed {}".format(swcFile))
 
-        outputDF.loc[rowInd, "WN_TDL"] = tdl
+        outputDF.loc[rowInd, "WN_TDL"] = tdl if success else np.nan
 
-    outputDF.to_excel(outputXL)
+    writeTable(outputDF, outputXL)
 
 
 
 
 if __name__ == '__main__':
 
-    assert len(sys.argv) == 3, 'Improper usage! Please use as \'python clacTDLWN.py <inputXL> <outXL>\''
+    assert len(sys.argv) in [3, 4], 'Improper usage! Please use as \'python clacTDLWN.py <inputXL> <outXL> [<nCPU>]\''
     inputXL = sys.argv[1]
     outputXL = sys.argv[2]
+    nCPU = int(sys.argv[3]) if len(sys.argv) == 4 else 1
 
-    calcTDLWN(inputXL, outputXL)
+    calcTDLWN(inputXL, outputXL, nCPU=nCPU)
 
 
 
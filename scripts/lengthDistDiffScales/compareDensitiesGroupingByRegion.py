@@ -7,23 +7,22 @@ mpl.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
 from GJMorph.matplotlibRCParams import mplPars
-from GJMorph.customStats import art_two_way_anova
+from GJMorph.customStats import art_two_way_anova_batch, RWorkerPool
+from GJMorph.tableFuncs import readTable, writeTable, getOutputTableFile
+from GJMorph.pandasFuncs import RecordBuilder
+from GJMorph.voxelMatrixFuncs import getRawDFDtypes
 
 def checkNormalityByRegion(densityDataXL, regionMaskingXL, outFig):
 
-    densityDataDF = pd.read_excel(densityDataXL)
-    regionMaskingDF = pd.read_excel(regionMaskingXL)
+    densityDataDF = readTable(densityDataXL, dtypes=getRawDFDtypes())
+    regionMaskingDF = readTable(regionMaskingXL)
 
-    densityDataDF_indexed = densityDataDF.set_index("voxel center")
-    regionMaskingDF_indexed = regionMaskingDF.set_index("voxel center")
+    regionMaskingDF_indexed = regionMaskingDF.set_index("voxel key")
 
-    for ind, row in regionMaskingDF_indexed.iterrows():
-        if ind in densityDataDF_indexed.index:
-            densityDataDF_indexed.loc[ind, "Is Distal?"] = row["Is Distal?"]
+    densityWithMaskDF = densityDataDF.copy()
+    densityWithMaskDF["Is Distal?"] = densityDataDF["voxel key"].map(regionMaskingDF_indexed["Is Distal?"])
 
-    densityWithMaskDF = densityDataDF_indexed.reset_index()
-
-    resDF = pd.DataFrame()
+    resRecords = RecordBuilder()
 
     fig, ax = plt.subplots(figsize=(7, 5.6))
     g = sns.FacetGrid(densityWithMaskDF, row="set name", col="Is Distal?")
@@ -33,7 +32,7 @@ def checkNormalityByRegion(densityDataXL, regionMaskingXL, outFig):
 
     for isDistal, isDistalDF in densityWithMaskDF.groupby("Is Distal?"):
 
-        for ls, lsDF in isDistalDF.groupby("set name"):
+        for ls, lsDF in isDistalDF.groupby("set name", observed=True):
 
             print("Doing Is Distal ={}, ls={}".format(isDistal, ls))
 
@@ -45,30 +44,26 @@ def checkNormalityByRegion(densityDataXL, regionMaskingXL, outFig):
             tempS["P-Value"] = pVal
             tempS['N'] = lsDF.shape[0]
 
-            resDF = resDF.append(tempS, ignore_index=True)
+            resRecords.addRecord(tempS)
 
+    resDF = resRecords.toDataFrame()
     print(resDF)
 
 
 def saveAllDataMasked(dataAllXL, masksWNXL, outXL):
 
-    dataAllDF = pd.read_excel(dataAllXL)
-    masksWNDF = pd.read_excel(masksWNXL)
-
-    dataAllDF_indexed = dataAllDF.set_index(keys=["voxel center"])
-    masksWNDF_indexed = masksWNDF.set_index(keys=["voxel center"])
+    dataAllDF = readTable(dataAllXL, dtypes=getRawDFDtypes())
+    masksWNDF = readTable(masksWNXL)
 
-    for vc, maskRow in masksWNDF_indexed.iterrows():
-        print("Setting Is Distal flags for vc={}".format(vc))
-        if vc in dataAllDF_indexed.index:
-            dataAllDF_indexed.loc[vc, "Is Distal?"] = maskRow["Is Distal?"]
+    masksWNDF_indexed = masksWNDF.set_index(keys=["voxel key"])
 
-    outputDF = dataAllDF_indexed.reset_index()
-    outputDF.to_excel(outXL)
+    outputDF = dataAllDF.copy()
+    outputDF["Is Distal?"] = dataAllDF["voxel key"].map(masksWNDF_indexed["Is Distal?"])
+    writeTable(outputDF, outXL)
 
-def plotCompareAll(allDataMaskedXL, outBase):
+def plotCompareAll(allDataMaskedXL, outBase, nRWorkers=1):
 
-    allDataMaskedDF = pd.read_excel(allDataMaskedXL)
+    allDataMaskedDF = readTable(allDataMaskedXL, dtypes=getRawDFDtypes())
     
     dataAllDF_proxIndexed = allDataMaskedDF.set_index("Is Distal?")
 
@@ -96,11 +91,22 @@ def plotCompareAll(allDataMaskedXL, outBase):
                   estimator=np.median, order=["WN", "DB", "VB"],
                       markers="_", dodge=True, ci=None, size=30)
 
-    columnTempNames = {"voxel center": "vc",
+    columnTempNames = {"voxel key": "vc",
                        "percentage neurite length": "nl",
                        "set name": "ls"}
     alpha = 0.05
-    outputDF = pd.DataFrame()
+    outputRecords = RecordBuilder()
+
+    # ART for all combinations of "Is Distal?" and region in one call to R, or split among several R processes
+    groupCodes = allDataMaskedDF.groupby(["Is Distal?", "region"]).ngroup()
+    groupCodeDict = dict(zip(zip(allDataMaskedDF["Is Distal?"], allDataMaskedDF["region"]), groupCodes))
+    artInputDF = allDataMaskedDF.rename(columns=columnTempNames).assign(group=groupCodes.values)
+    artInputDF = artInputDF.loc[groupCodes.values >= 0, ["group", "ls", "initRefs", "nl"]]
+    if int(nRWorkers) > 1:
+        with RWorkerPool(int(nRWorkers)) as rWorkerPool:
+            artDF = rWorkerPool.art_two_way_anova_batch(artInputDF)
+    else:
+        artDF = art_two_way_anova_batch(artInputDF)
 
     for isDistal, ax in [[True, distalAx], [False, proxAx]]:
         for region, regionDF in dataAllDF_proxIndexed.loc[isDistal, :].groupby("region"):
@@ -119,8 +125,8 @@ def plotCompareAll(allDataMaskedXL, outBase):
 
             tempDF = regionDF.rename(columns=columnTempNames)
 
-            tempDF_reordered = tempDF.loc[:, ["vc", "ls", "initRefs", "nl"]]
-            artRes = art_two_way_anova(tempDF_reordered.set_index("vc"))
+            artRow = artDF.loc[groupCodeDict[(isDistal, region)]]
+            artRes = artRow["ART correctness"], (artRow["pVal(f1)"], artRow["pVal(f2)"], artRow["pVal(f1:f2)"])
 
             tempS = pd.Series()
             tempS["IsDistal"] = isDistal
@@ -142,7 +148,7 @@ def plotCompareAll(allDataMaskedXL, outBase):
                 if sigDiffExists:
                     ax.plot([colInd], [-0.05], "*k", ms=10)
 
-            outputDF = outputDF.append(tempS, ignore_index=True)
+            outputRecords.addRecord(tempS)
             
 
 
@@ -165,7 +171,7 @@ def plotCompareAll(allDataMaskedXL, outBase):
     distalFig.tight_layout()
     distalFig.savefig("{}_distal.png".format(outBase), dpi=300)
 
-    outputDF.to_excel("{}.xlsx".format(outBase))
+    writeTable(outputRecords.toDataFrame(), getOutputTableFile(outBase))
 
     
 
@@ -174,7 +180,7 @@ if __name__ == "__main__":
     errStr = "Improper usage! Please use as\n" \
                                  "python {currFile} shapiro densityDataXL regionMaskingXL outFig or\n"\
                                  "python {currFile} saveAllDataMasked densityAllXL regionMaskAllXL outXL or\n"\
-                                 "python {currFile} plotCompareAll allDataMaskedXL outBase".format(currFile=sys.argv[0])
+                                 "python {currFile} plotCompareAll allDataMaskedXL outBase [nRWorkers]".format(currFile=sys.argv[0])
     
     assert len(sys.argv) in [4, 5], errStr
 
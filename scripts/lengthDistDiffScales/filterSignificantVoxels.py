@@ -4,78 +4,154 @@ Description:           This script is used to calculate  and save statistics of
                        identified those voxels for which dendritic length per voxel is affected by <Labor State> while
                        not being affected by <init Refs> and the two effects are not dependent.
 
-Usage:                 python filterSignificantVoxels.py <dataXL> <outputBase>
-                       <data XL>: string containing the path of the excel file generated by "generateRawDF.py"
-                       outputBase: string, output XL file will be saved as "<outBase>.xlsx". It will contain the
+Usage:                 python filterSignificantVoxels.py <dataXL> <outputBase> [<nRWorkers>] [<nCPU>] [<nPermutations>]
+                       [<seed>]
+                       <data XL>: string containing the path of the table file or the .npz file generated by
+                       "generateRawDF.py"
+                       outputBase: string, output XL file will be saved as "<outBase>.xlsx", or as <outBase> if it ends
+                       with ".parquet", ".feather" or ".csv" (see GJMorph.tableFuncs). It will contain the
                        following columns:
                        pVal(initRefs): p-value obtained from two-way ANOVA of <initRefs> affecting dendritic length
                        pVal(ls): p-Value obtained from two-way ANOVA of  <Labor State> affecting dendritic length
                        pVal(ls:initRefs): p-Value obtained from two-way ANOVA of the two effects above being dependent.
                        Difference of Means: difference of means of Forager and Newly Emerged morphology
-                       voxel center: string representation of 3 member float tuple, reprensenting the voxel center to
-                       which  each row correponds.
-                       voxel size: value of voxel size used to divide the space containing the morphologies
+                       FWER pVal(ls): p-value of the Welch t-statistic of Forager vs. Newly Emerged obtained from
+                       <nPermutations> permutations of labor states within <initRefs>, adjusted for the family wise error
+                       rate over all voxels of a voxel size using the maximum statistic over voxels.
+                       cluster ID, cluster mass, cluster pVal(ls): cluster of face connected voxels with Welch
+                       t-statistics of the same sign beyond the threshold corresponding to two sided p < <clusterAlpha>,
+                       sum of the absolute t-statistics of its voxels and its p-value from the permutations above
+                       (see GJMorph.permutationFuncs.clusterPermutationTest). -1 and NaN for voxels not in a cluster.
+                       Voxels for which ART fails are left out unless they belong to a cluster.
+                       HL Difference in TDL: Hodges-Lehmann estimate of the difference between Forager and Newly
+                       Emerged morphologies
+                       voxel key: integer key of the voxel to which each row corresponds
+                       (see GJMorph.voxelFuncs).
+                       voxel size: value of voxel size used to divide the space containing the morphologies. Tables
+                       generated for several voxel sizes are analyzed separately for each voxel size.
                        Significant Difference: either 0 or 1, value of 1 indicates the conditions above are satisfied.
+                       <nRWorkers>: optional, if specified and larger than 0, ART is done with the R package ARTool,
+                       using <nRWorkers> R processes, instead of GJMorph.customStats.art_two_way_anova_np.
+                       <nCPU>: optional, number of processes used for permutations. Defaults to 1.
+                       <nPermutations>: optional, number of permutations. Defaults to 1000.
+                       <seed>: optional, integer seed of the permutations. Defaults to 0.
 """
 
 import pandas as pd
 import sys
-from GJMorph.customStats import art_two_way_anova
+from GJMorph.customStats import art_two_way_anova_np, RWorkerPool, HodgesLehmannEstimate_batch
+from GJMorph.voxelMatrixFuncs import loadVoxelLengthMatrix, rawDFToVoxelLengthMatrix, iterDenseColumnBlocks, \
+    getColumnMeans, getRawDFDtypes
+from GJMorph.permutationFuncs import maxStatClusterPermutationTest
+from GJMorph.tableFuncs import readTable, writeTable, getOutputTableFile
+from scipy.stats import t as tDist
 import numpy as np
 
 if __name__ == '__main__':
 
-    assert len(sys.argv) == 3, 'Improper usage! Please use as \'python filterSignificantVoxels.py ' \
-                               '<dataXL> <outputBase>\''
+    assert len(sys.argv) in [3, 4, 5, 6, 7], 'Improper usage! Please use as \'python filterSignificantVoxels.py ' \
+                                             '<dataXL> <outputBase> [<nRWorkers>] [<nCPU>] [<nPermutations>] [<seed>]\''
 
     dataXL = sys.argv[1]
     outBase = sys.argv[2]
-
-    columnTempNames = {"voxel center": "vc",
-                       "percentage neurite length": "nl",
-                       "set name": "ls"}
-
-    dataDF = pd.read_excel(dataXL, index_col=0)
-
-    meanNLPerVoxel = dataDF.groupby("voxel center").mean()["percentage neurite length"].sort_index()
-
-    # unstacking is required to fill up the sparse data with zeros
-    indexedDF = dataDF.set_index(keys=["voxel size", 'voxel center', 'set name', 'expID', "initRefs"])
-    pivotedDF = indexedDF.unstack(level=('set name', "initRefs", 'expID'), fill_value=0)
-    dataFullDF = pivotedDF.stack(level=('set name', "initRefs", "expID")).reset_index()
-    dataDFR = dataFullDF.rename(columns=columnTempNames)
-    dataDFR_reordered = dataDFR.loc[:, ["vc", "ls", "initRefs", "nl"]]
-
-    statsDF = pd.DataFrame()
-
-    totalVCs = dataDFR_reordered["vc"].unique().shape[0]
-    for vcInd, (vc, vcDF) in enumerate(dataDFR_reordered.groupby("vc")):
-        print("Doing {}, Number {}/{}".format(vc, vcInd + 1, totalVCs))
-        toAppend = pd.Series()
-        toAppend["voxel center"] = vc
-        toAppend["voxel size"] = dataDF["voxel size"].iloc[0]
-
-        artRes = art_two_way_anova(vcDF.set_index("vc"))
-
-        if not np.isnan(artRes[1]).any():
-
-            toAppend["ART correctness"], (toAppend["pVal(ls)"],
-            toAppend["pVal(initRefs)"], toAppend["pVal(ls:initRefs)"]) = artRes
-
-            temp = vcDF.set_index("ls")
-            toAppend["Difference in Mean TDL"] = \
-                temp.loc["Forager", "nl"].mean() - temp.loc["Newly Emerged", "nl"].mean()
-            toAppend["Mean TDL"] = meanNLPerVoxel[vc]
-            toAppend["Normed Difference in Mean TDL"] = 100 * toAppend["Difference in Mean TDL"] / meanNLPerVoxel[vc]
-            statsDF = statsDF.append(toAppend, ignore_index=True)
+    nRWorkers = int(sys.argv[3]) if len(sys.argv) >= 4 else 0
+    rWorkerPool = RWorkerPool(nRWorkers) if nRWorkers > 0 else None
+    nCPU = int(sys.argv[4]) if len(sys.argv) >= 5 else 1
+    nPermutations = int(sys.argv[5]) if len(sys.argv) >= 6 else 1000
+    seed = int(sys.argv[6]) if len(sys.argv) >= 7 else 0
+
+    # neurons x voxels matrix of dendritic lengths, voxels of neurons without dendritic length in them are not stored
+    if dataXL.endswith(".npz"):
+        nlMatrix, voxelKeys, voxelSizes, metaDataDF = loadVoxelLengthMatrix(dataXL)
+    else:
+        dataDF = readTable(dataXL, indexCol=0, columns=['set name', "initRefs", 'expID', "voxel key", "voxel size",
+                                                        "percentage neurite length"], dtypes=getRawDFDtypes())
+        nlMatrix, voxelKeys, voxelSizes, metaDataDF = rawDFToVoxelLengthMatrix(dataDF, ['set name', "initRefs", 'expID'])
+
+    # mean over the neurons with dendritic length in each voxel
+    meanNLPerVoxel = getColumnMeans(nlMatrix, storedOnly=True)
+    isForager = (metaDataDF["set name"] == "Forager").values
+    isNewlyEmerged = (metaDataDF["set name"] == "Newly Emerged").values
+
+    # permutation test of labor state with FWER control over the voxels of each voxel size
+    # and cluster based permutation test, both using the same permutations
+    clusterAlpha = 0.01
+    fwerPVals = np.full(nlMatrix.shape[1], np.nan)
+    clusterIDs = np.full(nlMatrix.shape[1], -1, dtype=np.int64)
+    clusterMassPerVoxel = np.full(nlMatrix.shape[1], np.nan)
+    clusterPValPerVoxel = np.full(nlMatrix.shape[1], np.nan)
+    isLS = isForager | isNewlyEmerged
+    clusterThreshold = tDist.isf(clusterAlpha / 2, isLS.sum() - 2)
+    for voxelSize in np.unique(voxelSizes):
+        print("Doing {} permutations for voxel size {}".format(nPermutations, voxelSize))
+        sizeColumns = np.flatnonzero(voxelSizes == voxelSize)
+        sizeNLMatrix = nlMatrix[isLS][:, sizeColumns]
+        observedStats, fwerPVals[sizeColumns], clusterLabels, clusterMasses, clusterPVals, maxStatNull, \
+            maxClusterMassNull = maxStatClusterPermutationTest(sizeNLMatrix, isForager[isLS], voxelKeys[sizeColumns],
+                                                               clusterThreshold,
+                                                               strata=metaDataDF["initRefs"].values[isLS],
+                                                               nPermutations=nPermutations, seed=seed, nCPU=nCPU)
+        isInCluster = clusterLabels >= 0
+        # cluster IDs are unique across voxel sizes
+        clusterIDs[sizeColumns[isInCluster]] = clusterLabels[isInCluster] + clusterIDs.max() + 1
+        clusterMassPerVoxel[sizeColumns[isInCluster]] = clusterMasses[clusterLabels[isInCluster]]
+        clusterPValPerVoxel[sizeColumns[isInCluster]] = clusterPVals[clusterLabels[isInCluster]]
+
+    statsDFs = []
+
+    totalVCs = nlMatrix.shape[1]
+    for columnStart, nlBlock in iterDenseColumnBlocks(nlMatrix):
+        print("Doing voxels {}-{}/{}".format(columnStart + 1, columnStart + nlBlock.shape[1], totalVCs))
+        columnInds = np.arange(columnStart, columnStart + nlBlock.shape[1])
+
+        # all voxels of a block are tested at once
+        if rWorkerPool is None:
+            artCorrectness, pVals = art_two_way_anova_np(nlBlock.T, metaDataDF["set name"].values,
+                                                         metaDataDF["initRefs"].values)
+        else:
+            artInputDF = pd.DataFrame({"vc": np.repeat(columnInds, nlBlock.shape[0]),
+                                       "ls": np.tile(metaDataDF["set name"].values, nlBlock.shape[1]),
+                                       "initRefs": np.tile(metaDataDF["initRefs"].values, nlBlock.shape[1]),
+                                       "nl": nlBlock.T.reshape((-1,))},
+                                      columns=["vc", "ls", "initRefs", "nl"])
+            artDF = rWorkerPool.art_two_way_anova_batch(artInputDF).reindex(columnInds)
+            artCorrectness = artDF["ART correctness"].values
+            pVals = artDF.loc[:, ["pVal(f1)", "pVal(f2)", "pVal(f1:f2)"]].values.astype(np.float64)
+
+        blockStatsDF = pd.DataFrame({"voxel key": voxelKeys[columnInds],
+                                     "voxel size": voxelSizes[columnInds],
+                                     "ART correctness": artCorrectness,
+                                     "pVal(ls)": pVals[:, 0],
+                                     "pVal(initRefs)": pVals[:, 1],
+                                     "pVal(ls:initRefs)": pVals[:, 2],
+                                     "FWER pVal(ls)": fwerPVals[columnInds],
+                                     "cluster ID": clusterIDs[columnInds],
+                                     "cluster mass": clusterMassPerVoxel[columnInds],
+                                     "cluster pVal(ls)": clusterPValPerVoxel[columnInds],
+                                     "Difference in Mean TDL": nlBlock[isForager].mean(axis=0) -
+                                                               nlBlock[isNewlyEmerged].mean(axis=0),
+                                     "HL Difference in TDL": HodgesLehmannEstimate_batch(nlBlock[isForager],
+                                                                                         nlBlock[isNewlyEmerged]),
+                                     "Mean TDL": meanNLPerVoxel[columnInds]},
+                                    columns=["voxel key", "voxel size", "ART correctness", "pVal(ls)", "pVal(initRefs)",
+                                             "pVal(ls:initRefs)", "FWER pVal(ls)", "cluster ID", "cluster mass",
+                                             "cluster pVal(ls)", "Difference in Mean TDL", "HL Difference in TDL",
+                                             "Mean TDL"])
+        blockStatsDF["Normed Difference in Mean TDL"] = 100 * blockStatsDF["Difference in Mean TDL"] / \
+                                                        blockStatsDF["Mean TDL"]
+        # voxels in clusters are kept even if ART fails for them, so that clusters are written completely
+        statsDFs.append(blockStatsDF.loc[~np.isnan(pVals).any(axis=1) | (clusterIDs[columnInds] >= 0), :])
+
+    statsDF = pd.concat(statsDFs, ignore_index=True)
+    if rWorkerPool is not None:
+        rWorkerPool.close()
 
     alpha = 0.05
-    bfCorrectedAlpha = alpha / dataDF["initRefs"].unique().shape[0]
+    bfCorrectedAlpha = alpha / metaDataDF["initRefs"].unique().shape[0]
 
     sigDifFunc = lambda x: (x["pVal(ls:initRefs)"] > alpha) and \
                            (x["pVal(ls)"] < bfCorrectedAlpha) and (x["pVal(initRefs)"] > alpha)
 
-    statsDF["Significant Difference"] = statsDF.apply(sigDifFunc, axis=1)b
- b   statsDF.to_excel("{}.xlsx".format(outBase))
+    statsDF["Significant Difference"] = statsDF.apply(sigDifFunc, axis=1)
+    writeTable(statsDF, getOutputTableFile(outBase))
 
-b
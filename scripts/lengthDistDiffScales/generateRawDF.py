@@ -2,20 +2,48 @@
 Description:        This script is used to divide the space containing the input SWCs into voxels and calculate
                     the dendritic length of each SWC in each voxel. These calculated data stored in a table with one
                     row for every combination of SWC and voxel. Meta data such as Labor State, initRefs, swcFile and
-                    Experiment ID are also saved.
+                    Experiment ID are also saved. Voxels are identified by integer keys in the column "voxel key"
+                    (see GJMorph.voxelFuncs), their size is in the column "voxel size".
 
-Usage:              python generateRawDF.py <inputXL> <voxel size> <outputXL>
+Usage:              python generateRawDF.py <inputXL> <TDLWNXL> <voxel size> <overlappingWindowsBool> <outputXL> [<nCPU>]
+                    [<exactBool>] [<float32Bool>] [<streamingBool>]
                     <inputXL>: string containing the path of an excel file with the columns "Experiment ID",
                     "Labor State", "initRefs" and "swcFile".
-                    <voxel size>: string, which represents a float, the desired size of the voxels
-                    <outputXL>: string, path where the output excel file will be written.
+                    <TDLWNXL>: string containing the path of the table file generated by "calcTDLWN.py"
+                    <voxel size>: string, which represents a float, the desired size of the voxels, or several
+                    comma separated floats, e.g. "10,20,40", each an integer multiple of the smallest. In the latter
+                    case, every SWC is processed only once and the output contains the rows of all voxel sizes.
+                    <overlappingWindowsBool>: "True" or "False", whether to use eight overlapping voxel grids
+                    <outputXL>: string, path where the output excel file will be written. Parquet, Feather or CSV
+                    files are written instead if it ends with ".parquet", ".feather" or ".csv"
+                    (see GJMorph.tableFuncs). Excel files cannot hold more than 1048576 rows. If it ends with ".npz", a
+                    sparse matrix of dendritic lengths with one row per SWC and one column per voxel is written
+                    instead (see GJMorph.voxelMatrixFuncs).
+                    <nCPU>: optional, number of processes used to process SWCs in parallel. Defaults to 1.
+                    <exactBool>: optional, "True" or "False", whether to use the exact length of SWC segments in each
+                    voxel instead of resampling SWCs at 1um. Defaults to "False".
+                    <float32Bool>: optional, "True" or "False", whether to store dendritic lengths as float32 instead
+                    of float64. Defaults to "False".
+                    <streamingBool>: optional, "True" or "False", whether to write the rows of each SWC into
+                    <outputXL> as soon as it is processed, as one row group of a Parquet file or appended to a CSV
+                    file, instead of holding the rows of all SWCs in memory. Defaults to "False".
+
+                    The label columns "set name", "expID", "initRefs" and the column "voxel size" are categorical
+                    (see GJMorph.voxelMatrixFuncs.getRawDFDtypes). Parquet and Feather files keep these dtypes.
 '''
 
 import itertools
 import pandas as pd
-from GJMorph.auxFuncs import resampleSWC, windowSWCPts
+from GJMorph.auxFuncs import resampleSWC
+from GJMorph.swcFuncs import SWCMorphology
+from GJMorph.voxelFuncs import accumulateVoxelLengths, accumulateVoxelLengthPyramid, \
+    accumulateSegmentVoxelLengthPyramid, getGridSizeFactors
+from GJMorph.batchFuncs import iterBatch
+from GJMorph.voxelMatrixFuncs import buildVoxelLengthMatrix, saveVoxelLengthMatrix, rawDFLabelColumns
+from GJMorph.tableFuncs import readTable, writeTable, TableChunkWriter
 from regmaxsn.core.misc import parFileCheck
 import numpy as np
+import logging
 import os
 import sys
 
@@ -23,7 +51,87 @@ import sys
 
 
 
-def getRawDF(inputXL, TDLWNXL, outputXL, gridSize, overlappingWindows=False, resampleLength=1):
+def getSWCVoxelLengths(swcFile, WNTDL, gridSizes, translationIndicators, resampleLength=1, exact=False):
+    """
+    Calculates the dendritic length of one SWC in each voxel as a percentage of <WNTDL>, for each of <gridSizes>. If
+    <exact> is True, the segments of the SWC are clipped at voxel boundaries and the exact length in each voxel is used.
+    Otherwise, the SWC is resampled at <resampleLength> and each resampled piece is assigned to the voxel containing its
+    center. The SWC is processed only once for all grid sizes (see GJMorph.voxelFuncs.accumulateVoxelLengthPyramid).
+    :return: voxelKeys, pdls, voxelSizes, np.ndarrays with one entry per voxel
+    """
+
+    if exact:
+        swcMorph = SWCMorphology.fromFile(swcFile)
+        childRows, parentRows = swcMorph.getSegmentRows()
+        voxelKeys, voxelLengths, voxelSizes = accumulateSegmentVoxelLengthPyramid(swcMorph.xyz[parentRows],
+                                                                                  swcMorph.xyz[childRows],
+                                                                                  gridSizes, translationIndicators)
+        return voxelKeys, 100 * voxelLengths / WNTDL, voxelSizes
+
+    bc, bL, swcData = resampleSWC(swcFile, resampleLength, calculateBranchLens=True)
+
+    pdl = 100 * bL / WNTDL
+
+    if len(gridSizes) == 1 and len(translationIndicators) == 1:
+        voxelKeys, pdls = accumulateVoxelLengths(bc, pdl, gridSizes[0], translationIndicators[0])
+        return voxelKeys, pdls, np.full(voxelKeys.shape, gridSizes[0])
+    else:
+        # branch centers are quantized only once for all grid sizes and translated grids
+        return accumulateVoxelLengthPyramid(bc, pdl, gridSizes, translationIndicators)
+
+
+def buildRawDF(voxelKeysList, voxelPDLsList, voxelSizesList, metaDataCodes, labelCategories, voxelSizeCategories,
+               lengthDtype=np.float64):
+    """
+    Builds the table of dendritic lengths per voxel of several SWCs, with one row per combination of SWC and voxel.
+    Meta data is expanded to one entry per voxel only once, for all SWCs together, as codes of categorical columns.
+    :param voxelKeysList: list of np.ndarrays, voxel keys of each SWC, as returned by getSWCVoxelLengths
+    :param voxelPDLsList: list of np.ndarrays, dendritic lengths of each SWC in its voxels
+    :param voxelSizesList: list of np.ndarrays, voxel sizes of the voxels of each SWC
+    :param metaDataCodes: np.ndarray of ints of shape (nSWCs, 3), codes of the meta data of each SWC in the columns
+    "set name", "expID" and "initRefs" among <labelCategories>
+    :param labelCategories: list of three np.ndarrays, categories of the columns "set name", "expID" and "initRefs"
+    :param voxelSizeCategories: np.ndarray, categories of the column "voxel size", all voxel sizes
+    :param lengthDtype: numpy float dtype of the column "percentage neurite length"
+    :return: pandas.DataFrame with the columns "voxel key", "percentage neurite length", "set name", "expID",
+    "initRefs" and "voxel size"
+    """
+
+    nVoxels = [x.shape[0] for x in voxelKeysList]
+    rawDF = pd.DataFrame({'voxel key': np.concatenate(voxelKeysList).astype(np.int64),
+                          'percentage neurite length': np.concatenate(voxelPDLsList).astype(lengthDtype)},
+                         columns=['voxel key', 'percentage neurite length'])
+    for colInd, column in enumerate(rawDFLabelColumns):
+        rawDF[column] = pd.Categorical.from_codes(np.repeat(metaDataCodes[:, colInd], nVoxels),
+                                                  labelCategories[colInd])
+    rawDF['voxel size'] = pd.Categorical(np.concatenate(voxelSizesList), categories=voxelSizeCategories)
+    assert not rawDF['voxel size'].isnull().any(), "voxel sizes are missing in <voxelSizeCategories>"
+
+    return rawDF
+
+
+def getRawDF(inputXL, TDLWNXL, outputXL, gridSize, overlappingWindows=False, resampleLength=1, nCPU=1, exact=False,
+             lengthDtype=np.float64, streaming=False):
+    """
+    Calculates the dendritic length in each voxel for every SWC in <inputXL> and writes them into <outputXL>, one row
+    per combination of SWC and voxel. SWCs are processed in parallel using <nCPU> processes. SWCs for which processing
+    fails are reported and left out of the output. If <exact> is True, exact lengths of the segments of SWCs in each
+    voxel are used instead of resampling SWCs (see getSWCVoxelLengths). <gridSize> can be a list of voxel sizes, each
+    an integer multiple of the smallest, in which case the rows of all voxel sizes are written into <outputXL>, with the
+    voxel size of each row in the column "voxel size". If <outputXL> ends with ".npz", a sparse matrix with one row per
+    SWC and one column per voxel is saved instead, together with the meta data "set name", "expID" and "initRefs" of its
+    rows (see GJMorph.voxelMatrixFuncs). Otherwise, label columns and voxel sizes are written as categorical columns and
+    dendritic lengths with <lengthDtype> (see GJMorph.voxelMatrixFuncs.getRawDFDtypes). If <streaming> is True, the rows
+    of each SWC are written into <outputXL> as soon as the SWC is processed, as one row group of a Parquet file or
+    appended to a CSV file (see GJMorph.tableFuncs.TableChunkWriter), instead of collecting the rows of all SWCs in
+    memory first. The rows of one initial reference or a range of voxel keys can then be read without reading the
+    whole table (see the <filters> of GJMorph.tableFuncs.readTable and GJMorph.voxelFuncs.getVoxelKeyRange).
+    """
+
+    assert not (streaming and outputXL.endswith(".npz")), "<outputXL> cannot be an .npz file when streaming"
+    gridSizes = [float(x) for x in np.atleast_1d(gridSize)]
+    # raises an error early if the voxel sizes cannot be derived from a common base grid
+    getGridSizeFactors(gridSizes)
 
 
     if overlappingWindows:
@@ -33,43 +141,97 @@ def getRawDF(inputXL, TDLWNXL, outputXL, gridSize, overlappingWindows=False, res
     else:
         translationIndicators = [[0, 0, 0]]
 
-    inputDF = pd.read_excel(inputXL)
-    TDLWNDF = pd.read_excel(TDLWNXL).set_index(["initRefs", "Experiment ID"])
-
-    tempDFs = []
+    inputDF = readTable(inputXL)
+    TDLWNDF = readTable(TDLWNXL, columns=["initRefs", "Experiment ID", "WN_TDL"]).set_index(["initRefs",
+                                                                                            "Experiment ID"])
 
+    argsList = []
+    metaData = []
+    skippedSWCs = []
     for rowInd, (expId, laborState, initRefs, swcFile) in inputDF.iterrows():
-        print("Doing {}".format(swcFile))
-
-        bc, bL, swcData = resampleSWC(swcFile, resampleLength, calculateBranchLens=True)
 
         expIdWN = expId[:-2] + "WN"
-        pdl = 100 * bL / TDLWNDF.loc[(initRefs, expIdWN), "WN_TDL"]
-        for translationIndicator in translationIndicators:
-
-            # print('GridSize={}, swc={}, translationIndicator={}'.format(gridSize, swcFile,
-            #                                                             translationIndicator))
-
-            centers = windowSWCPts(bc,
-                                   gridSize, translationIndicator)
-
-            tempDF = pd.DataFrame()
-            tempDF.loc[:, 'voxel center'] = map(tuple, centers)
-            tempDF.loc[:, 'percentage neurite length'] = pdl
-
-            tempDF = tempDF.groupby('voxel center').sum().reset_index()
-            tempDF.loc[:, 'set name'] = laborState
-            tempDF.loc[:, 'expID'] = expId
-            tempDF.loc[:, "initRefs"] = initRefs
-            tempDF.loc[:, 'voxel size'] = gridSize
-            tempDFs.append(tempDF)
-
-    rawDF = pd.concat(tempDFs, ignore_index=True)
-
-    rawDF.to_excel(outputXL)
-
-
-
+        # calcTDLWN.py writes NaN for SWCs it failed to process, such SWCs cannot be normalized
+        WNTDL = TDLWNDF.loc[(initRefs, expIdWN), "WN_TDL"] if (initRefs, expIdWN) in TDLWNDF.index else np.nan
+        if np.isnan(WNTDL):
+            print("Skipped {}: no WN_TDL for initRefs={}, Experiment ID={} in {}".format(swcFile, initRefs, expIdWN,
+                                                                                        TDLWNXL))
+            skippedSWCs.append(swcFile)
+            continue
+        argsList.append((swcFile, WNTDL, gridSizes, translationIndicators, resampleLength, exact))
+        metaData.append((laborState, expId, initRefs))
+
+    if skippedSWCs:
+        logging.error("Skipped {} of {} SWCs without WN_TDL: {}".format(len(skippedSWCs), inputDF.shape[0],
+                                                                        ", ".join(skippedSWCs)))
+
+    # categories of the categorical columns are fixed before processing, so that they are the same in all chunks
+    labelCategories = [np.unique(np.array([x[colInd] for x in metaData], dtype=str))
+                       for colInd in range(len(rawDFLabelColumns))]
+    metaDataCodes = np.array([[np.searchsorted(labelCategories[colInd], str(x[colInd]))
+                               for colInd in range(len(rawDFLabelColumns))] for x in metaData],
+                             dtype=np.int32).reshape((-1, len(rawDFLabelColumns)))
+    voxelSizeCategories = np.unique(np.array(gridSizes, dtype=np.float64))
+
+    swcFiles = [args[0] for args in argsList]
+    doneRows = []
+    voxelKeys = []
+    voxelPDLs = []
+    voxelSizes = []
+    chunkWriter = TableChunkWriter(outputXL) if streaming else None
+    try:
+        for rowInd, (swcFile, success, result) in enumerate(iterBatch(getSWCVoxelLengths, argsList, labels=swcFiles,
+                                                                      nCPU=nCPU)):
+            print("Done {}".format(swcFile) if success else "Failed {}".format(swcFile))
+            if not success:
+                continue
+            doneRows.append(rowInd)
+            if streaming:
+                chunkWriter.write(buildRawDF([result[0]], [result[1]], [result[2]], metaDataCodes[[rowInd]],
+                                             labelCategories, voxelSizeCategories, lengthDtype))
+            else:
+                voxelKeys.append(result[0])
+                voxelPDLs.append(result[1])
+                voxelSizes.append(result[2])
+    finally:
+        if chunkWriter is not None:
+            chunkWriter.close()
+
+    if not doneRows:
+        raise ValueError("None of the {} SWCs in {} could be processed, see the errors above".format(inputDF.shape[0],
+                                                                                                   inputXL))
+
+    if streaming:
+        return
+
+    if outputXL.endswith(".npz"):
+        matrix, matrixVoxelKeys, matrixVoxelSizes = buildVoxelLengthMatrix(voxelKeys, voxelPDLs, voxelSizes)
+        doneMetaData = np.array([metaData[x] for x in doneRows], dtype=object).reshape((-1, 3))
+        metaDataDF = pd.DataFrame(doneMetaData, columns=rawDFLabelColumns)
+        saveVoxelLengthMatrix(outputXL, matrix, matrixVoxelKeys, matrixVoxelSizes, metaDataDF)
+        return
+
+    rawDF = buildRawDF(voxelKeys, voxelPDLs, voxelSizes, metaDataCodes[doneRows], labelCategories,
+                       voxelSizeCategories, lengthDtype)
+    writeTable(rawDF, outputXL)
+
+
+
+
+
+def parseBoolArg(value, argName):
+    """
+    Parses the command line argument <value> of <argName> as bool.
+    :return: bool
+    """
+
+    if value in ["True", "TRUE", "1"]:
+        return True
+    elif value in ["False", "FALSE", "0"]:
+        return False
+    else:
+        raise(IOError("Unknown value {} for <{}>, use one of [\"True\", \"TRUE\", \"1\"] for True and one of "
+                      "[\"False\", \"FALSE\", \"0\"] for False".format(value, argName)))
 
 
 def partFuncDir(dir, partStr):
@@ -79,17 +241,16 @@ def partFuncDir(dir, partStr):
 
 if __name__ == '__main__':
 
-    assert len(sys.argv) == 6, 'Improper usage! Please use as \'python generateRawDF.py <inputXL> <TDLWNXL> <voxelSize> <overlappingWindowsBool> <outXL>\''
+    assert len(sys.argv) in [6, 7, 8, 9, 10], 'Improper usage! Please use as \'python generateRawDF.py <inputXL> <TDLWNXL> <voxelSize> <overlappingWindowsBool> <outXL> [<nCPU>] [<exactBool>] [<float32Bool>] [<streamingBool>]\''
     inputXL = sys.argv[1]
     TDLWNXL = sys.argv[2]
-    voxelSize = float(sys.argv[3])
-    if sys.argv[4] in ["True", "TRUE", "1"]:
-        overlappingWindows = True
-    elif sys.argv[4] in ["False", "FALSE", "0"]:
-        overlappingWindows = False
-    else:
-        raise(IOError("Unknown value for <overlappingWindowsBool>, use one of [\"True\", \"TRUE\", \"1\"] for True and one of [\"False\", \"FALSE\", \"0\"] for False"))
+    voxelSize = [float(x) for x in sys.argv[3].split(",")]
+    overlappingWindows = parseBoolArg(sys.argv[4], "overlappingWindowsBool")
     outputXL = sys.argv[5]
+    nCPU = int(sys.argv[6]) if len(sys.argv) >= 7 else 1
+    exact = len(sys.argv) >= 8 and parseBoolArg(sys.argv[7], "exactBool")
+    float32 = len(sys.argv) >= 9 and parseBoolArg(sys.argv[8], "float32Bool")
+    streaming = len(sys.argv) == 10 and parseBoolArg(sys.argv[9], "streamingBool")
 
 
     getRawDF(inputXL=inputXL,
@@ -97,7 +258,11 @@ if __name__ == '__main__':
              TDLWNXL=TDLWNXL,
              outputXL=outputXL,
              overlappingWindows=overlappingWindows,
-             resampleLength=1)
+             resampleLength=1,
+             nCPU=nCPU,
+             exact=exact,
+             lengthDtype=np.float32 if float32 else np.float64,
+             streaming=streaming)
 
 
 
@@ -9,6 +9,8 @@ Usage:                    TODO
 import pandas as pd
 import sys
 from GJMorph.matplotlibRCParams import mplPars
+from GJMorph.tableFuncs import readTable
+from GJMorph.voxelMatrixFuncs import getRawDFDtypes
 from matplotlib import pyplot as plt
 import seaborn as sns
 import numpy as np
@@ -18,20 +20,23 @@ def plotNLDistribution(rawDataXL, initRefStr, outputBase):
     """
     This function plots the distribution of Total Dendritic Length per voxel for the registration results of using
     <initRefStr> as initial references, but pooling across voxels and experiment IDs.
-    :param rawDataXL: str, path of the excel file generated by generateRawDF.py
+    :param rawDataXL: str, path of the table file generated by generateRawDF.py
     :param initRefStr: str, indicating the pair of reference templates. Has the form
     "ref_<forager_experiment_ID>_ref_<ne_experiment_ID>"
     :param outputBase: str, the plot will be save in the file "<outputBase>.png"
     :return:
     """
 
-    dataDF = pd.read_excel(rawDataXL, index_col=0)
+    dataDF = readTable(rawDataXL, indexCol=0, columns=["set name", "initRefs", "percentage neurite length"],
+                       dtypes=getRawDFDtypes())
     dataDF.rename(columns={"set name": "Labor State"}, inplace=True)
 
     if initRefStr == "all":
         subDataDF = dataDF
     elif initRefStr in dataDF["initRefs"].values:
-        subDataDF = dataDF[dataDF["initRefs"] == initRefStr]
+        subDataDF = dataDF[dataDF["initRefs"] == initRefStr].copy()
+        # other initial references would otherwise be shown as empty categories
+        subDataDF["initRefs"] = subDataDF["initRefs"].cat.remove_unused_categories()
     else:
         raise ValueError("The initial reference string {} was not found in {}".format(initRefStr, rawDataXL))
 
@@ -70,12 +75,12 @@ def plotMeanDiffDistribution(filteredDataXL, outBase):
     """
     This function plots the distribution of differences between mean dendritic lengths of foragers and newly emerged
     per voxel.
-    :param filteredDataXL: str, path of the excel file generated filterSignificantVoxels.py
+    :param filteredDataXL: str, path of the table file generated filterSignificantVoxels.py
     :param outBase: str, plot generated will be saved to "<outBase>.png"
     :return:
     """
 
-    df = pd.read_excel(filteredDataXL, index_col=0)
+    df = readTable(filteredDataXL, indexCol=0)
 
     sns.set(style="darkgrid", rc=mplPars)
     fig, ax = plt.subplots(figsize=(7, 5.6))
@@ -99,7 +104,7 @@ def plotNormedMeanDifferenceDist(filteredDataXL, outBase):
     :return:
     """
 
-    filteredDF = pd.read_excel(filteredDataXL, index_col=0)
+    filteredDF = readTable(filteredDataXL, indexCol=0)
 
 
     sns.set(style="darkgrid", rc=mplPars)
@@ -127,7 +132,7 @@ def plotNormedMeanDifferenceDistRegion(filteredDataXL, outBase):
     :return:
     """
 
-    filteredDF = pd.read_excel(filteredDataXL, index_col=0)
+    filteredDF = readTable(filteredDataXL, indexCol=0)
 
 
     sns.set(style="whitegrid", rc=mplPars)
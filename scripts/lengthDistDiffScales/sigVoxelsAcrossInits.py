@@ -3,61 +3,74 @@ Description:            This script is used to generate SWC files with an eight
                         the mean difference value of dendritic length between Foragers and Newly Emerged morphologies
                         in the voxel containing the node.
 
-Usage:                  python sigVoxelsAcrossInits.py <inputXL> <filteredDataXL> <useNormed> <outDir>
+Usage:                  python sigVoxelsAcrossInits.py <inputXL> <filteredDataXL> <useNormed> <outDir> [<useClusters>]
                         <inputXL>: string, containing the path of the input excel file used for "generateRawDF.py"
-                        <filteredDataXL>: string, containing the path of the excel file generated by
+                        <filteredDataXL>: string, containing the path of the table file generated by
                         "filterSignificantVoxels.py"
                         <useNormed>: when "True", uses normalized differences in mean TDL,
                         otherwise uses just the differences in mean TDL
                         <outDir>: string, path where a new directory will be created if one does not exist and into
                         which the generated SWC files are written.
+                        <useClusters>: optional, when "True", voxels in clusters with "cluster pVal(ls)" < 0.05 are
+                        used instead of voxels with "Significant Difference" (see "filterSignificantVoxels.py")
 """
 
 import sys
 import os
 import pandas as pd
-from regmaxsn.core.swcFuncs import readSWC_numpy, writeSWC_numpy
+from regmaxsn.core.swcFuncs import writeSWC_numpy
+from GJMorph.swcFuncs import loadSWCData, readSWCHeader
 import seaborn as sns
 import numpy as np
-from ast import literal_eval as make_tuple
 from scipy.spatial import cKDTree
 from GJMorph.matplotlibRCParams import mplPars
+from GJMorph.voxelFuncs import voxelKeysToCenters
+from GJMorph.tableFuncs import readTable
 
 if __name__ == '__main__':
 
     sns.set(rc=mplPars)
 
-    assert len(sys.argv) == 5, 'Improper usage! Please use as \'python sigVoxelsAcrossInits.py <inputXL>' \
-                               '<filteredDataXL> <useNormed>' \
-                               '<outDir>\''
+    assert len(sys.argv) in [5, 6], 'Improper usage! Please use as \'python sigVoxelsAcrossInits.py <inputXL>' \
+                                    '<filteredDataXL> <useNormed>' \
+                                    '<outDir> [<useClusters>]\''
 
     inputXL = sys.argv[1]
     filteredDataXL = sys.argv[2]
     useNormed = sys.argv[3] == "True"
     mainOutDir = sys.argv[4]
+    useClusters = len(sys.argv) == 6 and sys.argv[5] == "True"
 
     if useNormed:
         meanDiffCappedAt = 80
-b        colorMapColumn = "Normed Difference in Mean TDL"
+        colorMapColumn = "Normed Difference in Mean TDL"
     else:
         meanDiffCappedAt = 40
-        colorMapColumn = "Dibfference in Mean TDL"
+        colorMapColumn = "Difference in Mean TDL"
 
-    inDF = pd.read_excel(inputXL)
+    inDF = readTable(inputXL)
     nInitRefs = inDF["initRefs"].unique().size
 
-    filteredDataDF = pd.read_excel(filteredDataXL, index_col=0)
-    criterion = lambda x: x["Significant Difference"] == 1
+    filteredDataDF = readTable(filteredDataXL, indexCol=0)
+    if useClusters:
+        criterion = lambda x: x["cluster pVal(ls)"] < 0.05
+    else:
+        criterion = lambda x: x["Significant Difference"] == 1
     filteredDataFilteredDF = filteredDataDF.loc[criterion, :]
-    finalVoxelSet = map(make_tuple, filteredDataFilteredDF["voxel center"])
-    voxelSize = filteredDataFilteredDF["voxel size"].iloc[0]
-    finalVoxelKDTree = cKDTree(finalVoxelSet, leafsize=100)
+    assert filteredDataDF["voxel size"].unique().shape[0] == 1, \
+        "{} contains results for several voxel sizes, filter it for one of them first".format(filteredDataXL)
+    voxelSize = filteredDataDF["voxel size"].iloc[0]
+    finalVoxelSet = voxelKeysToCenters(filteredDataFilteredDF["voxel key"].values.astype(np.int64), voxelSize)
+    finalVoxelValues = filteredDataFilteredDF[colorMapColumn].values
+    if finalVoxelSet.shape[0] > 0:
+        finalVoxelKDTree = cKDTree(finalVoxelSet, leafsize=100)
 
 
     for rowInd, (expId, laborState, initRefs, swcFile) in inDF.iterrows():
 
         print('Doing {}'.format(swcFile))
-        headr, swcData = readSWC_numpy(swcFile)
+        headr = readSWCHeader(swcFile)
+        swcData = loadSWCData(swcFile)
 
         if useNormed:
             outDir = os.path.join(mainOutDir, "{}_normedTDLColored".format(initRefs))
@@ -66,7 +79,7 @@ b        colorMapColumn = "Normed Difference in Mean TDL"
 
         if not os.path.isdir(outDir):
             os.makedirs(outDir)
-        if len(finalVoxelSet) > 0:
+        if finalVoxelSet.shape[0] > 0:
 
             nearestInGridDist, nearestInGridIndices = \
                 finalVoxelKDTree.query(swcData[:, 2:5], distance_upper_bound=voxelSize / 2, n_jobs=6)
@@ -74,14 +87,10 @@ b        colorMapColumn = "Normed Difference in Mean TDL"
             nodepresences = nearestInGridDist != np.inf
             # when a nearest neighbor with specified distance is not found
             nearestInGridIndices[nearestInGridIndices == len(finalVoxelKDTree.data)] = 0
-            temp1 = finalVoxelKDTree.data[nearestInGridIndices]
-            temp2 = map(str, map(tuple, temp1))
-            tempDF = filteredDataFilteredDF.set_index("voxel center")
-
             temp3 = np.minimum(
-                np.maximum(tempDF.loc[temp2, colorMapColumn].values, -meanDiffCappedAt),
+                np.maximum(finalVoxelValues[nearestInGridIndices], -meanDiffCappedAt),
                                meanDiffCappedAt)
-            temp = np.array(nodepresences, dtype=np.float) * temp3
+            temp = np.array(nodepresences, dtype=float) * temp3
 
             nodeHLs = temp.reshape((swcData.shape[0], 1))
 
@@ -1,53 +1,64 @@
 import pandas as pd
-from GJMorph.auxFuncs import windowSWCPts
+from GJMorph.voxelFuncs import getVoxelKeys, voxelKeysToCenters
+from GJMorph.batchFuncs import runBatch
 from btmorph2 import NeuronMorphology
 from scipy.spatial import cKDTree
-from ast import literal_eval as make_tuple
-from regmaxsn.core.swcFuncs import readSWC_numpy, writeSWC_numpy
+from regmaxsn.core.swcFuncs import writeSWC_numpy
+from GJMorph.swcFuncs import loadSWCData, readSWCHeader
 import numpy as np
 import sys
 import os
 
 
-def generate_raw_data(inputXL, outputCSV, gridSize):
+def get_swc_raw_data(swcFile, laborState, expId, initRefs, gridSize):
+    """
+    Calculates terminal proximity and the key of the containing voxel for every node of one SWC.
+    :return: pandas.DataFrame with one row per node
+    """
+
+    nrn = NeuronMorphology(swcFile, ignore_type=True, correctIfSomaAbsent=True)
+
+    terminal_proxs_dict = nrn.get_terminal_proximities_all_nodes()
+
+    nodeXYZs = []
+    terminal_proxs = []
+    for node_ind, terminal_prox in terminal_proxs_dict.items():
+        nodeXYZs.append(nrn.tree.get_node_with_index(node_ind).content["p3d"].xyz)
+        terminal_proxs.append(terminal_prox)
+    nodeXYZs = np.array(nodeXYZs)
+
+    tempDF = pd.DataFrame()
+    tempDF.loc[:, 'voxel key'] = getVoxelKeys(nodeXYZs, gridSize)
+    tempDF.loc[:, 'terminal proximity'] = terminal_proxs
+    tempDF.loc[:, 'set name'] = laborState
+    tempDF.loc[:, 'expID'] = expId
+    tempDF.loc[:, "initRefs"] = initRefs
+    tempDF.loc[:, 'voxel size'] = gridSize
+
+    return tempDF
+
+
+def generate_raw_data(inputXL, outputCSV, gridSize, nCPU=1):
     """
     For each swc in inputXL, and for every node in each swc, Terminal proximity is calculated, its
-    XYZ is approximated to the center of the voxel which contains it
+    XYZ is approximated to the voxel which contains it, represented by its key (see GJMorph.voxelFuncs)
     :param inputXL:
     :param outputXL:
     :param gridSize:
+    :param nCPU: int, number of processes used to process SWCs in parallel
     :return:
     """
     inputDF = pd.read_excel(inputXL)
 
-    tempDFs = []
+    argsList = [(swcFile, laborState, expId, initRefs, gridSize)
+                for rowInd, (expId, laborState, initRefs, swcFile) in inputDF.iterrows()]
+    results, failures = runBatch(get_swc_raw_data, argsList, labels=inputDF["swcFile"].tolist(), nCPU=nCPU)
 
-    for rowInd, (expId, laborState, initRefs, swcFile) in inputDF.iterrows():
-        print("Doing {}".format(swcFile))
-
-        nrn = NeuronMorphology(swcFile, ignore_type=True, correctIfSomaAbsent=True)
-
-        terminal_proxs_dict = nrn.get_terminal_proximities_all_nodes()
+    if len(failures) == len(argsList):
+        raise ValueError("Processing failed for all {} SWCs in {}: {}".format(len(argsList), inputXL,
+                                                                             ", ".join(x[0] for x in failures)))
 
-        nodeXYZs = []
-        terminal_proxs = []
-        for node_ind, terminal_prox in terminal_proxs_dict.iteritems():
-            nodeXYZs.append(nrn.tree.get_node_with_index(node_ind).content["p3d"].xyz)
-            terminal_proxs.append(terminal_prox)
-        nodeXYZs = np.array(nodeXYZs)
-
-        centers = windowSWCPts(nodeXYZs, gridSize)
-
-        tempDF = pd.DataFrame()
-        tempDF.loc[:, 'voxel center'] = map(tuple, centers)
-        tempDF.loc[:, 'terminal proximity'] = terminal_proxs
-        tempDF.loc[:, 'set name'] = laborState
-        tempDF.loc[:, 'expID'] = expId
-        tempDF.loc[:, "initRefs"] = initRefs
-        tempDF.loc[:, 'voxel size'] = gridSize
-        tempDFs.append(tempDF)
-
-    rawDF = pd.concat(tempDFs, ignore_index=True)
+    rawDF = pd.concat([x for x in results if x is not None], ignore_index=True)
 
     rawDF.to_csv(outputCSV)
 
@@ -56,9 +67,9 @@ def classify_proximal_distal(dataCSV, outXL, thres):
 
     dataDF = pd.read_csv(dataCSV, index_col=0)
 
-    dataDFRestricted = dataDF.loc[:, ["voxel center", "terminal proximity"]]
+    dataDFRestricted = dataDF.loc[:, ["voxel key", "terminal proximity"]]
     medianTerminalProximityDF = pd.DataFrame()
-    medianTerminalProximityDF["terminal proximity"] = dataDFRestricted.groupby("voxel center").apply(np.median)
+    medianTerminalProximityDF["terminal proximity"] = dataDFRestricted.groupby("voxel key")["terminal proximity"].median()
 
     medianTerminalProximityDF["Is Distal?"] = medianTerminalProximityDF["terminal proximity"] > thres
     medianTerminalProximityDF["voxel size"] = dataDF["voxel size"].iloc[0]
@@ -75,15 +86,14 @@ def generateDistalColoredSSWCs(distalIndicatorXL, inputXL, outDir):
     distalIndicatorDF = pd.read_excel(distalIndicatorXL)
     gridSize = distalIndicatorDF["voxel size"].iloc[0]
 
-    finalVoxelSet = map(make_tuple, distalIndicatorDF["voxel center"])
+    finalVoxelSet = voxelKeysToCenters(distalIndicatorDF["voxel key"].values.astype(np.int64), gridSize)
     finalVoxelKDTree = cKDTree(finalVoxelSet, leafsize=100)
 
-    # distalIndicatorDF.set_index("voxel center", inplace=True)
-
     for rowInd, (expId, laborState, initRefs, swcFile) in inputDF.iterrows():
         print("Doing {}".format(swcFile))
 
-        headr, swcData = readSWC_numpy(swcFile)
+        headr = readSWCHeader(swcFile)
+        swcData = loadSWCData(swcFile)
 
         nearestInGridDist, nearestInGridIndices = \
                                                   finalVoxelKDTree.query(swcData[:, 2:5], n_jobs=6)
@@ -105,14 +115,15 @@ def generateDistalColoredSSWCs(distalIndicatorXL, inputXL, outDir):
 
 if __name__ == "__main__":
 
-    assert len(sys.argv) in [5], "Improper Usage! Please use as\n" \
-                                 "python {currFile} genRawData <inputXL> <outputCSV> <gridSize>" \
+    assert len(sys.argv) in [5, 6], "Improper Usage! Please use as\n" \
+                                 "python {currFile} genRawData <inputXL> <outputCSV> <gridSize> [<nCPU>]" \
                                  "python {currFile} classify <inputCSV> <outputXL> <thresh>" \
                                  "python {currFile} genSSWC <classificationXL> <inputXL> <outdir>" \
                                  "".format(currFile=sys.argv[0])
 
     if sys.argv[1] == "genRawData":
-        generate_raw_data(*(sys.argv[2:-1] + [int(sys.argv[-1])]))
+        nCPU = int(sys.argv[5]) if len(sys.argv) == 6 else 1
+        generate_raw_data(sys.argv[2], sys.argv[3], int(sys.argv[4]), nCPU=nCPU)
     elif sys.argv[1] == "classify":
         classify_proximal_distal(*sys.argv[2:-1] + [float(sys.argv[-1])])
     elif sys.argv[1] == "genSSWC":
@@ -17,7 +17,8 @@ Note:                This script implicitly uses a specification file, with it's
 import os
 import numpy as np
 from scipy.stats import ttest_ind, f_oneway, kruskal
-from GJMorph.customStats import r_mannwhitneyu
+from GJMorph.customStats import mannwhitneyu_np
+from GJMorph.pandasFuncs import RecordBuilder
 from pylatex import Document, Tabular, Command, Math, Package
 from pylatex.utils import NoEscape, bold
 from GJMorph.folderDefs import homeFolder, specFile
@@ -92,7 +93,7 @@ def saveData(outFile, part):
 
     specsDF = pd.read_excel(specFile, index_col=0, header=0)
 
-    allData = pd.DataFrame()
+    allDataRecords = RecordBuilder(nRows=len(allSWCs))
 
     programMap = {"btmorph2": btmorphGlobalFeatures,
                   "vaa3d": vaa3dGlobalFeatures}
@@ -114,8 +115,9 @@ def saveData(outFile, part):
                 tempS[measureNameWithUnits] = np.nan
                 logging.warning("For SWC {}, Measure {} was not found in the output of program {}".format(
                     swc, programMeasure, program))
-        allData = allData.append(tempS, ignore_index=True)
+        allDataRecords.addRecord(tempS)
 
+    allData = allDataRecords.toDataFrame()
     allData.set_index(["Labor State", "SWC File"], inplace=True)
 
     allData.to_excel(outFile)
@@ -135,7 +137,7 @@ def saveStats(inFile, outFile_prefix):
     fData = allData.loc[lambda df:df["Labor State"] == "Forager", :]
     nData = allData.loc[lambda df:df["Labor State"] == "Newly Emerged", :]
 
-    statsData = pd.DataFrame()
+    statsRecords = RecordBuilder(columns=["Measure", "Newly emerged", "Forager", "P-Value"])
 
     doc = Document("{}_table".format(outFile_prefix), font_size='footnotesize')
     doc.packages.append(Package('geometry', options=['paperwidth=160mm',
@@ -168,20 +170,33 @@ def saveStats(inFile, outFile_prefix):
                                           "Avg. sibling diameter ratio",
                                           "Hausdorff fractal dimension"]
 
-               
+    measures = []
     for measureName, (divisor, UnitStr, program, programMeasure) in specsDF.iterrows():
 
         if pd.isnull(UnitStr):
-            measure = measureName
+            measures.append(measureName)
         else:
-            measure = "{} (\({}\))".format(measureName, UnitStr)
+            measures.append("{} (\({}\))".format(measureName, UnitStr))
+
+    # one row per measure and one column per neuron
+    foragerMeasures = fData.loc[:, measures].values.astype(np.float64).T
+    neMeasures = nData.loc[:, measures].values.astype(np.float64).T
+
+    # measures with missing values and excluded topological measures are not tested, all others are tested at once
+    isTested = ~(np.isnan(foragerMeasures).any(axis=1) | np.isnan(neMeasures).any(axis=1) |
+                 specsDF.index.isin(excludeTopologicalMeasures))
+    pVals = np.full(len(measures), np.nan)
+    if isTested.any():
+        uVals, pVals[isTested] = mannwhitneyu_np(foragerMeasures[isTested], neMeasures[isTested])
+
+    for measureInd, measure in enumerate(measures):
 
         measureS = pd.Series()
         measureS["Measure"] = measure
 
-        fMeasures = allData.loc[lambda df:df["Labor State"] == "Forager", measure].values
-        nMeasures = allData.loc[lambda df:df["Labor State"] == "Newly Emerged", measure].values
-
+        fMeasures = foragerMeasures[measureInd]
+        nMeasures = neMeasures[measureInd]
+        pVal = pVals[measureInd]
 
         fMin = fMeasures.min()
         fMax = fMeasures.max()
@@ -190,15 +205,6 @@ def saveStats(inFile, outFile_prefix):
         fMedian = np.median(fMeasures)
         nMedian = np.median(nMeasures)
 
-        if np.isnan(fMedian) or np.isnan(nMedian) or measureName in excludeTopologicalMeasures:
-            pVal = float("nan")
-        else:
-            # tstat, pVal = bootstrapWelsch_ttest(fMeasures, nMeasures, 1000)
-            # print('Bootstrap', tstat, pVal)
-            # tstat1, pVal = ttest_ind(fMeasures, nMeasures, equal_var=False)
-            tstat1, pVal = r_mannwhitneyu(fMeasures, nMeasures)
-            # print('Welsch T-Test', tstat1, pVal1)
-
         pm = '\pm'
         pValStr = str(round(pVal, 4))
 
@@ -230,8 +236,9 @@ def saveStats(inFile, outFile_prefix):
         measureS["Forager"] = "{:0.3g}, {:0.3g}, {:0.3g}".format(fMin, fMedian, fMax)
         measureS["P-Value"] = "{:0.4g}".format(pVal)
 
-        statsData = statsData.append(measureS, ignore_index=True)
+        statsRecords.addRecord(measureS)
 
+    statsData = statsRecords.toDataFrame()
     statsData.to_excel("{}.xlsx".format(outFile_prefix))
 
     doc.append(table1)
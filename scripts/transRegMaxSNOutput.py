@@ -17,13 +17,13 @@ from regmaxsn.core.transforms import compose_matrix
 from regmaxsn.core.swcFuncs import transSWC_rotAboutPoint
 from regmaxsn.core.RegMaxSPars import RegMaxSNParNames
 from regmaxsn.core.misc import parFileCheck
+from GJMorph.swcFuncs import loadSWCData
 import json
 
 import sys
 
 
 def transAndSave(inFile, outFile, jsonFile, rotMat, translation, rotCenter):
-    rotCenter = np.loadtxt(inFile)[:, 2:5].mean(axis=0)
     transSWC_rotAboutPoint(inFile, rotMat, translation, outFile, rotCenter)
     with open(jsonFile, 'w') as jsonFle:
         toWrite = {'inFile': inFile,
@@ -83,13 +83,13 @@ for parInd, pars in enumerate(parsList):
         inFile = os.path.join(resDir, expName + ".swc")
         outFile = os.path.join(outDir, expName + ".swc")
         jsonFile = os.path.join(outDir, "{}.json".format(expName))
-        rotCenter = np.loadtxt(inFile)[:, 2:5].mean(axis=0)
+        rotCenter = loadSWCData(inFile)[:, 2:5].mean(axis=0)
         transAndSave(inFile, outFile, jsonFile, rotMat, translation, rotCenter)
 
         inFile = os.path.join(resDir, "finalRef.swc")
         outFile = os.path.join(outDir, "finalRef.swc")
         jsonFile = os.path.join(outDir, "finalRef.json")
-        rotCenter = np.loadtxt(inFile)[:, 2:5].mean(axis=0)
+        rotCenter = loadSWCData(inFile)[:, 2:5].mean(axis=0)
         transAndSave(inFile, outFile, jsonFile, rotMat, translation, rotCenter)
 
         partDir = os.path.join(resDir, expName)
@@ -102,7 +102,7 @@ for parInd, pars in enumerate(parsList):
                         os.mkdir(outPartDir)
                     inPartFle = os.path.join(partDir, partFle)
                     outPartFle = os.path.join(outPartDir, partFle)
-                    partRotCenter = np.loadtxt(inPartFle)[:, 2:5].mean(axis=0)
+                    partRotCenter = loadSWCData(inPartFle)[:, 2:5].mean(axis=0)
                     partJSONFile = os.path.join(outPartDir, "{}.json".format(partFle[:-4]))
                     transAndSave(inPartFle, outPartFle, partJSONFile, rotMat, translation, partRotCenter)
 
@@ -21,6 +21,7 @@ from matplotlib import patches as mpatches
 import os
 from GJMorph.folderDefs import homeFolder
 from GJMorph.matplotlibRCParams import getLighterColor, mplPars
+from GJMorph.swcFuncs import loadSWCData
 
 plt.ion()
 
@@ -99,7 +100,7 @@ with sns.axes_style('whitegrid'):
 for swcInd, swcFile in enumerate(swcFiles):
 
     print('Doing {}'.format(swcFile))
-    data = np.loadtxt(swcFile)
+    data = loadSWCData(swcFile)
     dataXYZ = np.dot(initTrans, data[:, 2:5].T).T
 
     slope = (maxMarkerSize - minMarkerSize) / (maxRad - minRad)
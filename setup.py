@@ -5,10 +5,10 @@ setup(
     setup_requires=['setuptools_scm'],
     packages=find_packages(exclude=["^\."]),
     exclude_package_data={'': ["Readme.md"]},
-    install_requires=["numpy>=1.11.2",
+    install_requires=["numpy>=1.17.0",
                       "matplotlib>=1.5.3",
                       "scipy>=0.18.1",
-                      "pandas>=0.19.0",
+                      "pandas>=1.1.0",
                       "seaborn>=0.7.1",
                       "pylatex",
                       "btmorph2>=2.1.1",
@@ -18,10 +18,13 @@ setup(
                       "regmaxsn",
                       "requests>=2.14.2",
                       "py-vaa3d>=0.1",
-                      "scikit-learn>=0.19.1",
-                      "rpy2>=2.8.6"],
+                      "scikit-learn>=0.19.1"],
+    # R-backed functions of GJMorph.customStats fall back to numpy implementations without rpy2
+    # Parquet and Feather tables of GJMorph.tableFuncs require pyarrow
+    extras_require={"R": ["rpy2>=2.8.6"],
+                    "parquet": ["pyarrow>=1.0.0"]},
 
-    python_requires=">=2.7",
+    python_requires=">=3.7",
     dependency_links=["git+https://github.com/wachtlerlab/btmorph_v2.git",
                       "git+https://github.com/dEvasEnApati/pyVaa3d.git",
                       "git+https://github.com/wachtlerlab/Reg-MaxS.git"]